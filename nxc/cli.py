@@ -11,6 +11,7 @@ from argparse import RawTextHelpFormatter
 from nxc.loaders.protocolloader import ProtocolLoader
 from nxc.helpers.logger import highlight
 from nxc.helpers.args import DisplayDefaultsNotNone
+from nxc.helpers.ratelimit import parse_rate
 from nxc.logger import nxc_logger, setup_debug_logging
 
 
@@ -25,7 +26,11 @@ argparse.ArgumentParser.exit = (
 
 def gen_cli_args(argv=None):
     setup_debug_logging()
+    return parse_cli_args(*build_cli_parser(), argv)
 
+
+def build_cli_parser():
+    """The argument parser of every protocol and the version info, reusable across parse_cli_args calls"""
     # ---------------- VERSION INFO ----------------
     try:
         meta = importlib.metadata.version("netexec")
@@ -51,8 +56,15 @@ def gen_cli_args(argv=None):
     generic_group = generic_parser.add_argument_group("Generic Options")
     generic_group.add_argument("--version", action="store_true", help="Display nxc version")
     generic_group.add_argument("-t", "--threads", type=int, default=256)
+    generic_group.add_argument("-w", "--workers", type=int, default=1, help="Number of processes the targets are sharded across, each with its own --threads pool")
+    generic_group.add_argument("--adaptive", action="store_true", help="Adapt the number of concurrently scanned targets (up to --threads) to observed connect latency and timeouts")
     generic_group.add_argument("--timeout", type=int)
     generic_group.add_argument("--jitter", metavar="INTERVAL")
+    generic_group.add_argument("--checkpoint", action="store_true", help="Write a checkpoint journal to <workspace>/checkpoints/, which --resume continues from if the run is interrupted (removed once a run finishes every target)")
+    generic_group.add_argument("--resume", metavar="JOURNAL", help="Skip the targets and failed logins recorded in the checkpoint journal of an interrupted run, and keep recording to it")
+    generic_group.add_argument("--pre-sweep", action="store_true", help="TCP connect sweep of the protocol port(s) first, only responsive hosts are scanned")
+    generic_group.add_argument("--sweep-timeout", type=float, default=1.0, help="Connect timeout of the pre-sweep in seconds")
+    generic_group.add_argument("--sweep-concurrency", type=int, default=1000, help="Maximum concurrent connects of the pre-sweep")
 
     output_parser = argparse.ArgumentParser(
         add_help=False, formatter_class=DisplayDefaultsNotNone
@@ -60,6 +72,7 @@ def gen_cli_args(argv=None):
     output_group = output_parser.add_argument_group("Output Options")
     output_group.add_argument("--no-progress", action="store_true")
     output_group.add_argument("--log", metavar="LOG")
+    output_group.add_argument("--jsonl", metavar="FILE", help="Append structured results (host info, logins, shares, module events) to FILE as JSON lines")
     log_level = output_group.add_mutually_exclusive_group()
     log_level.add_argument("--verbose", action="store_true")
     log_level.add_argument("--debug", action="store_true")
@@ -103,7 +116,7 @@ def gen_cli_args(argv=None):
     mgroup = module_parser.add_argument_group("Modules")
     mgroup.add_argument("-M", "--module", action="append",default=[])
     mgroup.add_argument("-o", nargs="+", default=[], dest="module_options")
-    mgroup.add_argument("-L", "--list-modules", action="store_true")
+    mgroup.add_argument("-L", "--list-modules", nargs="?", type=str, const="", help="List available modules, optionally filtered by category")
     mgroup.add_argument("--options", dest="show_module_options", action="store_true")
 
     # ---------------- PROTOCOL SUBPARSERS ----------------
@@ -145,35 +158,38 @@ def gen_cli_args(argv=None):
     )
 
 
+    # ---------------- RATE LIMITING ----------------
+    rate_group = std_parser.add_argument_group("Rate Limiting", "Rates are attempts per second, or COUNT/[PERIOD]UNIT like 3/m or 1/30m")
+    rate_group.add_argument("--rate-global", type=parse_rate, metavar="RATE", help="Maximum authentication attempts across the whole run")
+    rate_group.add_argument("--rate-user", type=parse_rate, metavar="RATE", help="Maximum authentication attempts per username")
+    rate_group.add_argument("--rate-subnet", type=parse_rate, metavar="RATE", help="Maximum authentication attempts per target /24 (/64 for IPv6)")
+    rate_group.add_argument("--rate-burst", type=int, default=1, help="Attempts allowed back to back before a rate applies")
+    rate_group.add_argument("--fail-window", type=float, metavar="SECONDS", help="Only count failed logins of the last SECONDS towards the failed login limits (the domain's lockout observation window)")
+
     # ---------------- LOAD PROTOCOL ARGS SAFELY ----------------
     p_loader = ProtocolLoader()
     protocols = p_loader.get_protocols()
-    for proto_name in protocols.keys():
-        # empty placeholder so argparse accepts "smb", "ldap", etc
-        subparsers.add_parser(
-            proto_name,
-            add_help=False
-    )
     for proto_name, proto in protocols.items():
-        try:
-            # load protocol module itself (smb.py, ldap.py, etc)
-            proto_mod = p_loader.load_protocol(proto["path"])
-        except Exception as e:
-            nxc_logger.debug(f"Failed loading protocol {proto_name}: {e}")
-            continue
-
-        # proto_args is OPTIONAL and lives INSIDE protocol module
-        if hasattr(proto_mod, "proto_args"):
+        # proto_args is OPTIONAL and lives next to the protocol package (smb/proto_args.py, ...)
+        if "argspath" in proto:
             try:
-                subparsers = proto_mod.proto_args(
+                args_mod = p_loader.load_protocol(proto["argspath"])
+                subparsers = args_mod.proto_args(
                     subparsers,
-                    [std_parser, module_parser]
+                    [std_parser]
                 )
+                continue
             except Exception as e:
                 nxc_logger.exception(
                     f"Error registering CLI args for protocol {proto_name}: {e}"
                 )
 
+        # empty placeholder so argparse accepts "smb", "ldap", etc
+        subparsers.add_parser(
+            proto_name,
+            add_help=False
+        )
+
 
     # ---------------- FINAL PARSE ----------------
     # argcomplete.autocomplete(parser, always_complete_options=False)
@@ -191,8 +207,13 @@ def gen_cli_args(argv=None):
     #     sys.exit(0)
 
     # return args, [CODENAME, VERSION, COMMIT, DISTANCE]
+    return parser, [CODENAME, VERSION, COMMIT, DISTANCE]
+
+
+def parse_cli_args(parser, version_info, argv=None):
+    CODENAME, VERSION, COMMIT, DISTANCE = version_info
     if argv is None:
-            argv = sys.argv[1:]
+        argv = sys.argv[1:]
 
     if not argv:
         parser.print_help()
@@ -203,11 +224,11 @@ def gen_cli_args(argv=None):
         args.module = []
 
     if not hasattr(args, "list_modules"):
-        args.list_modules = False
+        args.list_modules = None
 
 
     if args.version:
         print(f"{VERSION} - {CODENAME} - {COMMIT} - {DISTANCE}")
         sys.exit(0)
 
-    return args, [CODENAME, VERSION, COMMIT, DISTANCE]
\ No newline at end of file
+    return args, version_info
\ No newline at end of file
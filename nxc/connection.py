@@ -1,91 +1,26 @@
 from datetime import datetime
 import os
 import random
-import sys
 import contextlib
 
-from os.path import isfile
-from threading import BoundedSemaphore
 from functools import wraps
-from time import sleep
-from ipaddress import ip_address
-from dns import resolver, rdatatype
-from socket import AF_UNSPEC, SOCK_DGRAM, IPPROTO_IP, AI_CANONNAME, getaddrinfo
+from time import monotonic, sleep
 
-from nxc.config import pwned_label
+from nxc.config import process_secret, pwned_label
+from nxc.helpers.concurrency import connect_failure, reset_connect_error
+from nxc.helpers.credentials import CredentialPlan
 from nxc.helpers.logger import highlight
-from nxc.loaders.moduleloader import ModuleLoader
+from nxc.helpers import events, ratelimit
+from nxc.helpers.ratelimit import AttemptScheduler
+from nxc.helpers.resolver import get_host_addr_info
+from nxc.loaders.moduleloader import ModuleRegistry
 from nxc.logger import nxc_logger, NXCAdapter
-from nxc.context import Context
 from nxc.paths import NXC_PATH
 from nxc.protocols.ldap.laps import laps_search
 from nxc.helpers.pfx import pfx_auth
 
 from impacket.dcerpc.v5 import transport
 
-sem = BoundedSemaphore(1)
-global_failed_logins = 0
-user_failed_logins = {}
-
-
-def get_host_addr_info(target, force_ipv6, dns_server, dns_tcp, dns_timeout):
-    result = {
-        "host": "",
-        "is_ipv6": False,
-        "is_link_local_ipv6": False
-    }
-    address_info = {"AF_INET6": "", "AF_INET": ""}
-
-    try:
-        if ip_address(target).version == 4:
-            address_info["AF_INET"] = target
-        else:
-            address_info["AF_INET6"] = target
-    except Exception:
-        # If the target is not an IP address, we need to resolve it
-        if not (dns_server or dns_tcp):
-            for res in getaddrinfo(target, None, AF_UNSPEC, SOCK_DGRAM, IPPROTO_IP, AI_CANONNAME):
-                af, _, _, canonname, sa = res
-                address_info[af.name] = sa[0]
-
-            if address_info["AF_INET6"] and ip_address(address_info["AF_INET6"]).is_link_local:
-                address_info["AF_INET6"] = canonname
-                result["is_link_local_ipv6"] = True
-        else:
-            dnsresolver = resolver.Resolver()
-            dnsresolver.timeout = dns_timeout
-            dnsresolver.lifetime = dns_timeout
-
-            if dns_server:
-                dnsresolver.nameservers = [dns_server]
-
-            try:
-                answers_ipv4 = dnsresolver.resolve(target, rdatatype.A, raise_on_no_answer=False, tcp=dns_tcp)
-                address_info["AF_INET"] = answers_ipv4[0].address
-            except Exception:
-                pass
-
-            try:
-                answers_ipv6 = dnsresolver.resolve(target, rdatatype.AAAA, raise_on_no_answer=False, tcp=dns_tcp)
-                address_info["AF_INET6"] = answers_ipv6[0].address
-
-                if address_info["AF_INET6"] and ip_address(address_info["AF_INET6"]).is_link_local:
-                    result["is_link_local_ipv6"] = True
-            except Exception:
-                pass
-
-    if not (address_info["AF_INET"] or address_info["AF_INET6"]):
-        raise Exception(f"The DNS query name does not exist: {target}")
-
-    # IPv4 preferred
-    if address_info["AF_INET"] and not force_ipv6:
-        result["host"] = address_info["AF_INET"]
-    else:
-        result["is_ipv6"] = True
-        result["host"] = address_info["AF_INET6"]
-
-    return result
-
 
 def requires_admin(func):
     def _decorator(self, *args, **kwargs):
@@ -130,6 +65,15 @@ def dcom_FirewallChecker(iInterface, remoteHost, timeout):
 
 
 class connection:
+    # Shared across all targets of a run, set by run_engine
+    credential_plan = None
+    module_paths = []
+    module_registry = None
+    adaptive_window = None
+    rate_limiter = None
+    checkpoint = None
+    rescheduled = None  # (target, port) -> login state of the targets waiting for the rate limiter or --jitter, a new dict per run
+
     def __init__(self, args, db, target):
         self.args = args
         self.db = db
@@ -150,10 +94,13 @@ class connection:
         self.use_kcache = None if not self.args.use_kcache else self.args.use_kcache
         self.admin_privs = False
         self.failed_logins = 0
+        self.attempts_skipped = False  # attempts held back by the fail limits, the target is tried again on --resume
+        self.retry_after = None  # set when the next attempt has to wait (rate limits, --jitter), run_targets submits the target again after it
 
         # Network info
         self.domain = None
         self.host = None            # IP address of the target. If kerberos this is the hostname
+        self.host_id = None         # Row id of the target in the protocol database, set by enum_host_info()
         self.hostname = target      # Target info supplied by the user, may be an IP address or a hostname
         self.remoteName = target    # hostname + domain, defaults to target if domain could not be resolved/not specified
         self.kdcHost = self.args.kdcHost
@@ -161,11 +108,18 @@ class connection:
         self.local_ip = None
         self.dns_server = self.args.dns_server
 
+        # Carry on with the logins of a rescheduled pass
+        self.reschedule_key = (target, self.port)
+        self.pending_logins = self.rescheduled.pop(self.reschedule_key, None) if self.rescheduled is not None else None
+
         # DNS resolution
         dns_result = self.resolver(target)
         if dns_result:
             self.host, self.is_ipv6, self.is_link_local_ipv6 = dns_result["host"], dns_result["is_ipv6"], dns_result["is_link_local_ipv6"]
         else:
+            # Resolution may fail transiently, --resume tries the target again
+            if self.checkpoint is not None:
+                self.checkpoint.target_unfinished(target)
             return
 
         if self.kerberos:
@@ -173,8 +127,10 @@ class connection:
 
         self.logger.info(f"Socket info: host={self.host}, hostname={self.hostname}, kerberos={self.kerberos}, ipv6={self.is_ipv6}, link-local ipv6={self.is_link_local_ipv6}")
 
+        finished = False
         try:
             self.proto_flow()
+            finished = not self.attempts_skipped
         except FileNotFoundError as e:
             self.logger.error(f"File not found error on target {target}: {e}")
         except Exception as e:
@@ -186,6 +142,13 @@ class connection:
             else:
                 self.logger.exception(f"Exception while calling proto_flow() on target {target}: {e}")
         finally:
+            if self.retry_after is not None:
+                self.rescheduled[self.reschedule_key] = self.pending_logins
+            elif self.checkpoint is not None:
+                if finished:
+                    self.checkpoint.target_done(target)
+                else:
+                    self.checkpoint.target_unfinished(target)
             self.logger.debug(f"Closing connection to: {target}")
             with contextlib.suppress(Exception):
                 self.conn.close()
@@ -216,6 +179,10 @@ class connection:
     def print_host_info(self):
         return
 
+    def host_info(self):
+        """Fields of the "host" event written to the --jsonl stream after print_host_info()"""
+        return {"domain": self.domain, "os": getattr(self, "server_os", None)}
+
     def create_conn_obj(self):
         return
 
@@ -237,7 +204,12 @@ class connection:
     def proto_flow(self):
         self.logger.debug("Kicking off proto_flow")
         self.proto_logger()
-        if not self.create_conn_obj():
+        start = monotonic()
+        reset_connect_error()
+        connected = self.create_conn_obj()
+        if self.adaptive_window is not None:
+            self.adaptive_window.observe(self.host, monotonic() - start, None if connected else connect_failure())
+        if not connected:
             self.logger.info(f"Failed to create connection object for target {self.host}, exiting...")
         else:
             self.logger.debug("Created connection object")
@@ -250,8 +222,15 @@ class connection:
             # Default output filename for logs
             self.output_filename = os.path.join(base_log_dir, filename_pattern)
 
-            self.print_host_info()
-            if self.login() or (self.username == "" and self.password == ""):
+            # A target rescheduled by the rate limiter printed its host info on its first pass
+            if self.pending_logins is None:
+                self.print_host_info()
+                if events.stream is not None:
+                    self.logger.event("host", **self.host_info())
+            logged_in = self.login()
+            if self.retry_after is not None:
+                self.logger.debug(f"Every remaining login is rate limited, rescheduling in {self.retry_after:.2f} second(s)")
+            elif logged_in or (self.username == "" and self.password == ""):
                 if hasattr(self.args, "module") and self.args.module:
                     self.load_modules()
                     self.logger.debug("Calling modules")
@@ -300,8 +279,7 @@ class connection:
             )
 
             self.logger.debug(f"Loading context for module {module.name} - {module}")
-            context = Context(self.db, module_logger, self.args)
-            context.localip = self.local_ip
+            context = self.module_registry.new_context(module_logger, self.local_ip)
 
             if hasattr(module, "on_login"):
                 self.logger.debug(f"Module {module.name} has on_login method")
@@ -312,292 +290,198 @@ class connection:
                 module.on_admin_login(context, self)
 
     def inc_failed_login(self, username):
-        global global_failed_logins, user_failed_logins
-
-        if username not in user_failed_logins:
-            user_failed_logins[username] = 0
-
-        user_failed_logins[username] += 1
-        global_failed_logins += 1
+        ratelimit.login_failures.increment(username)
         self.failed_logins += 1
 
     def over_fail_limit(self, username):
-        global global_failed_logins, user_failed_logins
-
-        if global_failed_logins == self.args.gfail_limit:
-            return True
-
         if self.failed_logins == self.args.fail_limit:
             return True
 
-        if username in user_failed_logins and self.args.ufail_limit == user_failed_logins[username]:  # noqa: SIM103
-            return True
-
-        return False
-
-    def query_db_creds(self):
-        """Queries the database for credentials to be used for authentication.
-
-        Valid cred_id values are:
-            - a single cred_id
-            - a range specified with a dash (ex. 1-5)
-            - 'all' to select all credentials
-
-        :return: domains[], usernames[], owned[], secrets[], cred_types[]
-        """
-        domains = []
-        usernames = []
-        owned = []
-        secrets = []
-        cred_types = []
-        creds = []  # list of tuples (cred_id, domain, username, secret, cred_type, pillaged_from) coming from the database
-        data = []  # Arbitrary data needed for the login, e.g. ssh_key
-
-        for cred_id in self.args.cred_id:
-            if cred_id.lower() == "all":
-                creds = self.db.get_credentials()
-            else:
-                if not self.db.get_credentials(filter_term=int(cred_id)):
-                    self.logger.error(f"Invalid database credential ID {cred_id}!")
-                    continue
-                creds.extend(self.db.get_credentials(filter_term=int(cred_id)))
+        return ratelimit.login_failures.over_limit(username, self.args.gfail_limit, self.args.ufail_limit)
 
-        for cred in creds:
-            c_id, domain, username, secret, cred_type, pillaged_from = cred
-            domains.append(domain)
-            usernames.append(username)
-            owned.append(False)  # As these are likely valid we still want to test them if they are specified in the command line
-            secrets.append(secret)
-            cred_types.append(cred_type)
-
-        if len(secrets) != len(data):
-            data = [None] * len(secrets)
-
-        return domains, usernames, owned, secrets, cred_types, data
-
-    def parse_credentials(self):
-        r"""Parse credentials from the command line or from a file specified.
-
-        Usernames can be specified with a domain (domain\\username) or without (username).
-        If the file contains domain\\username the domain specified will be overwritten by the one in the file.
-
-        :return: domain[], username[], owned[], secret[], cred_type[]
-        """
-        domain = []
-        username = []
-        owned = []
-        secret = []
-        cred_type = []
-
-        # Parse usernames
-        for user in self.args.username:
-            if isfile(user):
-                with open(user) as user_file:
-                    for line in user_file:
-                        if "\\" in line and len(line.split("\\")) == 2:
-                            domain_single, username_single = line.split("\\")
-                        else:
-                            domain_single = self.args.domain if hasattr(self.args, "domain") and self.args.domain is not None else self.domain
-                            username_single = line
-                        domain.append(domain_single)
-                        username.append(username_single.strip())
-                        owned.append(False)
-            else:
-                if "\\" in user:
-                    domain_single, username_single = user.split("\\")
-                else:
-                    domain_single = self.args.domain if hasattr(self.args, "domain") and self.args.domain is not None else self.domain
-                    username_single = user
-                domain.append(domain_single)
-                username.append(username_single)
-                owned.append(False)
-
-        # Parse passwords
-        for password in self.args.password:
-            if isfile(password):
-                try:
-                    with open(password, errors=("ignore" if self.args.ignore_pw_decoding else "strict")) as password_file:
-                        for line in password_file:
-                            secret.append(line.strip())
-                            cred_type.append("plaintext")
-                except UnicodeDecodeError as e:
-                    self.logger.error(f"{type(e).__name__}: Could not decode password file. Make sure the file only contains UTF-8 characters.")
-                    self.logger.error("You can ignore non UTF-8 characters with the option '--ignore-pw-decoding'")
-                    sys.exit(1)
-            else:
-                secret.append(password)
-                cred_type.append("plaintext")
-
-        # Parse NTLM-hashes
-        if hasattr(self.args, "hash") and self.args.hash:
-            for ntlm_hash in self.args.hash:
-                if isfile(ntlm_hash):
-                    with open(ntlm_hash) as ntlm_hash_file:
-                        for i, line in enumerate(ntlm_hash_file):
-                            line = line.strip()
-                            if len(line) != 32 and len(line) != 65 and len(line) != 0:
-                                self.logger.fail(f"Invalid NTLM hash length on line {(i + 1)} (len {len(line)}): {line}")
-                                continue
-                            else:
-                                secret.append(line)
-                                cred_type.append("hash")
-                else:
-                    if len(ntlm_hash) != 32 and len(ntlm_hash) != 65 and len(ntlm_hash) != 0:
-                        self.logger.fail(f"Invalid NTLM hash length {len(ntlm_hash)}, authentication not sent")
-                        exit(1)
-                    else:
-                        secret.append(ntlm_hash)
-                        cred_type.append("hash")
-            self.logger.debug(secret)
-
-        # Parse AES keys
-        if self.args.aesKey:
-            for aesKey in self.args.aesKey:
-                if isfile(aesKey):
-                    with open(aesKey) as aesKey_file:
-                        for line in aesKey_file:
-                            secret.append(line.strip())
-                            cred_type.append("aesKey")
-                else:
-                    secret.append(aesKey)
-                    cred_type.append("aesKey")
-
-        # Allow trying multiple users with a single password
-        if len(username) > 1 and len(secret) == 1:
-            secret = secret * len(username)
-            cred_type = cred_type * len(username)
-            self.args.no_bruteforce = True
-
-        return domain, username, owned, secret, cred_type, [None] * len(secret)
+    def skip_credentials(self, username, owned):
+        """Whether an attempt is left out: the fail limits are reached, or the user is owned and --continue-on-success is set"""
+        if self.over_fail_limit(username):
+            self.attempts_skipped = True
+            return True
+        return bool(self.args.continue_on_success and owned)
+
+    def jitter_delay(self):
+        """Seconds to wait before an authentication with --jitter, 0 without"""
+        if not self.args.jitter:
+            return 0
+        jitter = self.args.jitter
+        if "-" in jitter:
+            start, end = jitter.split("-")
+            jitter = (int(start), int(end))
+        else:
+            jitter = (0, int(jitter))
+        return jitter[0] if jitter[0] == jitter[1] else random.choice(range(jitter[0], jitter[1]))
 
     def try_credentials(self, domain, username, owned, secret, cred_type, data=None):
         """
         Try to login using the specified credentials and protocol.
-        With  --jitter an authentication throttle can be applied.
+        The --jitter authentication throttle is applied by try_attempts().
 
         Possible login methods are:
             - plaintext (/kerberos)
             - NTLM-hash (/kerberos)
             - AES-key
         """
-        if self.over_fail_limit(username):
-            return False
-        if self.args.continue_on_success and owned:
+        if self.skip_credentials(username, owned):
             return False
 
-        if self.args.jitter:
-            jitter = self.args.jitter
-            if "-" in jitter:
-                start, end = jitter.split("-")
-                jitter = (int(start), int(end))
+        result = self.authenticate(domain, username, secret, cred_type, data)
+        if events.stream is not None:
+            # Failed attempts leave their secret out, the stream would otherwise hold the whole wordlist
+            secret_field = {"secret": process_secret(secret)} if result else {}
+            self.logger.event("login", success=bool(result), domain=domain, username=username, cred_type=cred_type, admin=self.admin_privs if result else False, **secret_field)
+        return result
+
+    def authenticate(self, domain, username, secret, cred_type, data=None):
+        """Single login attempt with the login method of the protocol matching cred_type"""
+        if cred_type == "plaintext":
+            if self.kerberos:
+                self.logger.debug("Trying to authenticate using Kerberos")
+                return self.kerberos_login(domain, username, secret, "", "", self.kdcHost, False)
+            elif hasattr(self.args, "domain"):  # Some protocols don't use domain for login
+                self.logger.debug("Trying to authenticate using plaintext with domain")
+                return self.plaintext_login(domain, username, secret)
+            elif self.args.protocol == "ssh":
+                self.logger.debug("Trying to authenticate using plaintext over SSH")
+                return self.plaintext_login(username, secret, data)
             else:
-                jitter = (0, int(jitter))
-            value = jitter[0] if jitter[0] == jitter[1] else random.choice(range(jitter[0], jitter[1]))
-            self.logger.debug(f"Throttle authentications: sleeping {value} second(s)")
-            sleep(value)
-
-        with sem:
-            if cred_type == "plaintext":
-                if self.kerberos:
-                    self.logger.debug("Trying to authenticate using Kerberos")
-                    return self.kerberos_login(domain, username, secret, "", "", self.kdcHost, False)
-                elif hasattr(self.args, "domain"):  # Some protocols don't use domain for login
-                    self.logger.debug("Trying to authenticate using plaintext with domain")
-                    return self.plaintext_login(domain, username, secret)
-                elif self.args.protocol == "ssh":
-                    self.logger.debug("Trying to authenticate using plaintext over SSH")
-                    return self.plaintext_login(username, secret, data)
-                else:
-                    self.logger.debug("Trying to authenticate using plaintext")
-                    return self.plaintext_login(username, secret)
-            elif cred_type == "hash":
-                if self.kerberos:
-                    return self.kerberos_login(domain, username, "", secret, "", self.kdcHost, False)
-                return self.hash_login(domain, username, secret)
-            elif cred_type == "aesKey":
-                return self.kerberos_login(domain, username, "", "", secret, self.kdcHost, False)
+                self.logger.debug("Trying to authenticate using plaintext")
+                return self.plaintext_login(username, secret)
+        elif cred_type == "hash":
+            if self.kerberos:
+                return self.kerberos_login(domain, username, "", secret, "", self.kdcHost, False)
+            return self.hash_login(domain, username, secret)
+        elif cred_type == "aesKey":
+            return self.kerberos_login(domain, username, "", "", secret, self.kdcHost, False)
 
     def login(self):
         """Try to login using the credentials specified in the command line or in the database.
 
+        The credential plan is normally built once per run by run_engine and shared by all targets,
+        only the owned bitmap is per target.
+
         :return: True if the login was successful and "--continue-on-success" was not specified, False otherwise.
         """
-        # domain[n] always corresponds to username[n] and owned [n]
-        domain = []
-        username = []
-        owned = []  # Determines whether we have found a valid credential for this user. Default: False
-        # secret[n] always corresponds to cred_type[n]
-        secret = []
-        cred_type = []
-        data = []  # Arbitrary data needed for the login, e.g. ssh_key
-
-        if self.args.cred_id:
-            db_domain, db_username, db_owned, db_secret, db_cred_type, db_data = self.query_db_creds()
-            domain.extend(db_domain)
-            username.extend(db_username)
-            owned.extend(db_owned)
-            secret.extend(db_secret)
-            cred_type.extend(db_cred_type)
-            data.extend(db_data)
-
-        if self.args.username:
-            parsed_domain, parsed_username, parsed_owned, parsed_secret, parsed_cred_type, parsed_data = self.parse_credentials()
-            domain.extend(parsed_domain)
-            username.extend(parsed_username)
-            owned.extend(parsed_owned)
-            secret.extend(parsed_secret)
-            cred_type.extend(parsed_cred_type)
-            data.extend(parsed_data)
+        if self.pending_logins is not None:
+            # Rescheduled by the rate limiter or --jitter, carry on where the previous pass stopped
+            plan, owned, attempts, self.failed_logins, delayed = self.pending_logins
+            return self.try_attempts(plan, owned, attempts, delayed)
+
+        plan = self.credential_plan if self.credential_plan is not None else CredentialPlan.from_args(self.args, self.db, self.logger)
+        owned = plan.new_owned()  # Determines whether we have found a valid credential for this user
 
         if self.args.use_kcache:
             self.logger.debug("Trying to authenticate using Kerberos cache")
-            with sem:
-                username = self.args.username[0] if len(self.args.username) else ""
-                password = self.args.password[0] if len(self.args.password) else ""
-                self.kerberos_login(self.domain, username, password, "", "", self.kdcHost, True)
-                self.logger.info("Successfully authenticated using Kerberos cache")
-                return True
+            username = self.args.username[0] if len(self.args.username) else ""
+            password = self.args.password[0] if len(self.args.password) else ""
+            self.kerberos_login(self.domain, username, password, "", "", self.kdcHost, True)
+            self.logger.info("Successfully authenticated using Kerberos cache")
+            return True
 
         if self.args.pfx_cert or self.args.pfx_base64 or self.args.pem_cert:
             self.logger.debug("Trying to authenticate using Certificate pfx")
             if not self.args.username:
                 self.logger.fail("You must specify a username when using certificate authentication")
                 return False
-            with sem:
-                return pfx_auth(self)
+            return pfx_auth(self)
 
         if hasattr(self.args, "laps") and self.args.laps:
             self.logger.debug("Trying to authenticate using LAPS")
-            username[0], secret[0], domain[0] = laps_search(self, username, secret, cred_type, domain, self.dns_server)
-            cred_type = ["plaintext"]
-            if not (username[0] or secret[0] or domain[0]):
+            domains = [plan.domain(i, self.domain) for i in range(len(plan.usernames))]
+            laps_username, laps_secret, laps_domain = laps_search(self, list(plan.usernames), list(plan.secrets), list(plan.cred_types), domains, self.dns_server)
+            if not (laps_username or laps_secret or laps_domain):
                 return False
+            plan = CredentialPlan([laps_domain], [laps_username], [laps_secret], ["plaintext"], no_bruteforce=True)
+            owned = plan.new_owned()
 
-        if not self.args.no_bruteforce:
-            for secr_index, secr in enumerate(secret):
-                for user_index, user in enumerate(username):
-                    if self.try_credentials(domain[user_index], user, owned[user_index], secr, cred_type[secr_index], data[secr_index]):
-                        owned[user_index] = True
-                        if not self.args.continue_on_success:
-                            return True
-        else:
-            if len(username) != len(secret):
-                self.logger.error("Number provided of usernames and passwords/hashes do not match!")
-                return False
-            for user_index, user in enumerate(username):
-                if self.try_credentials(domain[user_index], user, owned[user_index], secret[user_index], cred_type[user_index], data[user_index]) and not self.args.continue_on_success:
-                    owned[user_index] = True
-                    if not self.args.continue_on_success:
-                        return True
+        if not plan.is_consistent():
+            self.logger.error("Number provided of usernames and passwords/hashes do not match!")
+            return False
+
+        return self.try_attempts(plan, owned, self.schedule_attempts(plan))
+
+    def try_attempts(self, plan, owned, attempts, delayed=None):
+        """Try the (user index, secret index) attempts in order.
+
+        When the next attempt has to wait, because the rate limiter stopped them with attempts left or
+        for its --jitter delay, the state is kept in pending_logins and retry_after is set: the target
+        ends this pass and is submitted again after the delay, no thread sleeps. delayed is an attempt
+        taken from attempts whose --jitter delay has passed.
+        Outside of a run (no rescheduled dict) the delays are slept in place.
+        """
+        while True:
+            logged_in = self.attempt_pass(plan, owned, attempts, delayed)
+            if self.retry_after is None or self.rescheduled is not None:
+                return logged_in
+            sleep(self.retry_after)
+            plan, owned, attempts, self.failed_logins, delayed = self.pending_logins
+            self.retry_after = self.pending_logins = None
+
+    def attempt_pass(self, plan, owned, attempts, delayed):
+        if delayed is not None and self.try_attempt(plan, owned, *delayed):
+            return True
+        for user_index, secret_index in attempts:
+            if not self.skip_credentials(plan.usernames[user_index], owned[user_index]):
+                delay = self.jitter_delay()
+                if delay:
+                    self.logger.debug(f"Throttle authentications: rescheduling in {delay} second(s)")
+                    self.retry_after = delay
+                    self.pending_logins = (plan, owned, attempts, self.failed_logins, (user_index, secret_index))
+                    return False
+            if self.try_attempt(plan, owned, user_index, secret_index):
+                return True
+
+        if getattr(attempts, "retry_after", None) is not None:
+            self.retry_after = attempts.retry_after
+            self.pending_logins = (plan, owned, attempts, self.failed_logins, None)
+        return False
+
+    def try_attempt(self, plan, owned, user_index, secret_index):
+        """Single attempt of the plan, True when the logins of the target stop with it"""
+        failed_logins = self.failed_logins
+        if self.try_credentials(
+            plan.domain(user_index, self.domain),
+            plan.usernames[user_index],
+            owned[user_index],
+            plan.secrets[secret_index],
+            plan.cred_types[secret_index],
+            plan.data[secret_index],
+        ):
+            owned[user_index] = True
+            return not self.args.continue_on_success
+        if self.checkpoint is not None and self.failed_logins != failed_logins:
+            self.checkpoint.attempt_failed(self.hostname, user_index, secret_index)
+        return False
+
+    def schedule_attempts(self, plan):
+        """Attempts of the plan, with a rate limiter an AttemptScheduler granting each one.
+
+        Attempts a resumed checkpoint journal recorded as failed are left out.
+        """
+        attempts = plan.attempts()
+        if self.checkpoint is not None:
+            # Logins that already failed before the run was interrupted
+            skip = self.checkpoint.failed_attempts(self.hostname)
+            if skip:
+                attempts = (attempt for attempt in attempts if attempt not in skip)
+
+        if self.rate_limiter is None:
+            return attempts
+        return AttemptScheduler(attempts, self.rate_limiter, plan.usernames, self.host)
 
     def mark_pwned(self):
         return highlight(f"({pwned_label})" if self.admin_privs else "")
 
     def load_modules(self):
         self.logger.info(f"Loading modules for target: {self.host}")
-        loader = ModuleLoader(self.args, self.db, self.logger)
-        self.modules = []
-
-        for module_path in self.module_paths:
-            module = loader.init_module(module_path)
-            self.modules.append(module)
+        if self.module_registry is None:
+            # Not started through run_engine, initialize the modules for this target only
+            self.module_registry = ModuleRegistry(self.args, self.db, self.logger)
+            self.module_registry.load(self.module_paths)
+        self.modules = self.module_registry.modules_for_target()
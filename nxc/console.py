@@ -1,6 +1,131 @@
+import atexit
+import os
+import sys
+import threading
+from logging import LogRecord
+from queue import Empty, SimpleQueue
+
 from rich.console import Console
+from rich.text import Text
+
+# Records rendered and written per batch by the output writer thread
+OUTPUT_BATCH = 512
+TAB_SIZE = 4
+
 
 def make_console(file):
-    return Console(file=file, soft_wrap=True, tab_size=4)
+    return Console(file=file, soft_wrap=True, tab_size=TAB_SIZE)
 
 nxc_console = make_console(None)
+
+
+class OutputPipeline:
+    """Console output of NXCAdapter.display/success/highlight/fail, written by one writer thread
+
+    Callers only enqueue a record: the sink (sys.stdout at call time), a render function and its
+    data, and the file handlers with the caller's location when file logging is enabled. The writer
+    renders everything queued so far and writes it to each sink at once, in call order.
+    termcolor and rich are only used for sinks which are a TTY, other sinks get plain text.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.queue = None
+        self.thread = None
+        self.consoles = {}
+
+    def start(self):
+        with self.lock:
+            # A forked worker inherits the queue but not the writer thread
+            if self.pid != os.getpid():
+                self.queue = SimpleQueue()
+                self.thread = threading.Thread(target=self.writer, name="nxc-output", daemon=True)
+                self.thread.start()
+                self.pid = os.getpid()
+
+    def put(self, sink, render, data, log=None):
+        if self.pid != os.getpid():
+            self.start()
+        self.queue.put((sink, render, data, log))
+
+    def stop(self):
+        """Write everything queued and end the writer thread, the next put() starts a new one
+
+        Called before forking --workers, so that no thread of the parent can hold a lock the children inherit.
+        """
+        with self.lock:
+            if self.pid != os.getpid():
+                return
+            self.queue.put(None)
+            self.thread.join()
+            self.pid = self.thread = None
+
+    def flush(self):
+        """Block until everything queued so far is written"""
+        if self.pid != os.getpid() or threading.current_thread() is self.thread:
+            return
+        written = threading.Event()
+        self.queue.put(written)
+        written.wait()
+
+    def writer(self):
+        stopped = False
+        while not stopped:
+            batch = [self.queue.get()]
+            try:
+                while len(batch) < OUTPUT_BATCH:
+                    batch.append(self.queue.get_nowait())
+            except Empty:
+                pass
+            if None in batch:
+                # Sent by stop(), which runs while no other thread logs
+                stopped = True
+                batch.remove(None)
+
+            try:
+                self.write(batch)
+            except Exception as e:
+                sys.__stderr__.write(f"Output writer failed: {e}\n")
+            finally:
+                for record in batch:
+                    if isinstance(record, threading.Event):
+                        record.set()
+
+    def write(self, batch):
+        group_sink, group_tty, texts = None, False, []
+        for record in batch:
+            if isinstance(record, threading.Event):
+                continue
+            sink, render, data, log = record
+            if sink is not group_sink:
+                if texts:
+                    self.write_sink(group_sink, group_tty, texts)
+                group_sink, group_tty, texts = sink, sink.isatty(), []
+
+            line = render(data, group_tty)
+            text = Text.from_ansi(line) if group_tty else line.expandtabs(TAB_SIZE)
+            texts.append(text)
+
+            if log is not None:
+                handlers, pathname, lineno = log
+                for handler in handlers:
+                    handler.handle(LogRecord("nxc", 20, pathname=pathname, lineno=lineno, msg=text, args=(), exc_info=None))
+        if texts:
+            self.write_sink(group_sink, group_tty, texts)
+
+    def write_sink(self, sink, tty, texts):
+        if not tty:
+            sink.write("".join(f"{text}\n" for text in texts))
+            sink.flush()
+            return
+
+        # The run's console is used when it prints to this sink, so lines stay above its progress bar
+        console = nxc_console if nxc_console.file is sink else self.consoles.setdefault(sink, make_console(sink))
+        with console:
+            for text in texts:
+                console.print(text)
+
+
+output = OutputPipeline()
+atexit.register(output.flush)
@@ -3,6 +3,17 @@ import os
 
 from nxc.paths import NXC_PATH, CONFIG_PATH
 
+_conf = None
+
+
+def load_conf():
+    """Read nxc.conf once per process, every Context shares the parsed config"""
+    global _conf
+    if _conf is None:
+        _conf = configparser.ConfigParser()
+        _conf.read(CONFIG_PATH)
+    return _conf
+
 
 class Context:
     def __init__(self, db, logger, args):
@@ -13,7 +24,6 @@ class Context:
         self.log_folder_path = os.path.join(NXC_PATH, "logs")
         self.localip = None
 
-        self.conf = configparser.ConfigParser()
-        self.conf.read(CONFIG_PATH)
+        self.conf = load_conf()
 
         self.log = logger
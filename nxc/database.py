@@ -2,26 +2,145 @@ import configparser
 import ipaddress
 import platform
 import shutil
+import sqlite3
 import sys
+import warnings
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from functools import cache
+from hashlib import sha256
 from os import mkdir
 from os.path import exists
 from os.path import join as path_join
 from pathlib import Path
-from threading import Lock
+from threading import Event, Lock, Thread, local
 
-from sqlalchemy import Table, create_engine, MetaData, func
+from sqlalchemy import Column, Integer, Table, UniqueConstraint, and_, bindparam, create_engine, delete, event, inspect, MetaData, func, null, or_, select, update
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.dialects.sqlite import Insert
 from sqlalchemy.exc import (
-    IllegalStateChangeError,
+    IntegrityError,
     NoInspectionAvailable,
     NoSuchTableError,
+    SAWarning,
 )
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import NullPool
+from sqlalchemy.schema import CreateIndex, CreateTable
+from sqlalchemy.sql.visitors import replacement_traverse
 from nxc.loaders.protocolloader import ProtocolLoader
 from nxc.logger import nxc_logger
 from nxc.paths import WORKSPACE_DIR
 
+SQLITE_PRAGMAS = (
+    # readers never block the writer (nor each other) and commits append to the WAL instead of rewriting pages
+    "PRAGMA journal_mode=WAL",
+    # with WAL, NORMAL only fsyncs at checkpoints and stays consistent on crashes (the last commits may roll back)
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-65536",  # 64 MiB page cache per connection
+    "PRAGMA mmap_size=268435456",  # 256 MiB
+    # a writer waits for the lock instead of failing with "database is locked"
+    "PRAGMA busy_timeout=10000",
+)
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+@contextmanager
+def ddl_transaction(db_engine, attach=None):
+    """Connection inside an explicit transaction, pysqlite would leave DDL statements out of its implicit one.
+
+    attach maps schema names to database files attached for the duration, SQLite refuses ATTACH inside a transaction.
+    """
+    with db_engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        for name, path in (attach or {}).items():
+            conn.exec_driver_sql(f'ATTACH DATABASE ? AS "{name}"', (str(path),))
+        try:
+            conn.exec_driver_sql("BEGIN")
+            try:
+                yield conn
+            except BaseException:
+                conn.exec_driver_sql("ROLLBACK")
+                raise
+            conn.exec_driver_sql("COMMIT")
+        finally:
+            for name in attach or {}:
+                conn.exec_driver_sql(f'DETACH DATABASE "{name}"')
+
+
+@contextmanager
+def expression_indexes_skipped():
+    """Reflection without a warning per expression index (e.g. lower(username)), SQLAlchemy cannot reflect those"""
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="Skipped unsupported reflection of expression-based index", category=SAWarning)
+        yield
+
+
+def credential_index(table):
+    """Conflict target of the unique ix_users_credential index: a user is unique per lowercased username, domain and type"""
+    return [func.lower(table.c.username), func.lower(table.c.domain), func.lower(table.c.credtype)]
+
+
+@cache
+def schema_version(metadata):
+    """Stamp for PRAGMA user_version, a hash of the DDL of the ORM tables so that any schema change gets a new one"""
+    dialect = sqlite.dialect()
+    ddl = [str(CreateTable(table).compile(dialect=dialect)) for table in metadata.sorted_tables]
+    ddl += [str(CreateIndex(index).compile(dialect=dialect)) for table in metadata.sorted_tables for index in sorted(table.indexes, key=lambda index: index.name)]
+    # user_version is a signed 32 bit integer and 0 means unstamped
+    return int.from_bytes(sha256("\n".join(ddl).encode()).digest()[:4], "big") & 0x7FFFFFFF or 1
+
+
+def get_schema_version(conn):
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def create_schema(db_engine, metadata):
+    """Create the missing tables of a protocol database, a no-op once the database carries the current schema version.
+
+    Only a database created from scratch is stamped here, existing ones are checked by BaseDB first.
+    """
+    version = schema_version(metadata)
+    with db_engine.connect() as conn:
+        if get_schema_version(conn) == version:
+            return
+    with ddl_transaction(db_engine) as conn:
+        new_database = not inspect(conn).get_table_names()
+        metadata.create_all(conn)
+        if new_database:
+            conn.exec_driver_sql(f"PRAGMA user_version = {version}")
+
+
+def table_key(table):
+    """Expressions identifying a row across databases and whether they are unique: the unique constraint or index
+    of the table, else its first index, else every column but the id
+    """
+    for constraint in table.constraints:
+        if isinstance(constraint, UniqueConstraint):
+            return list(constraint.columns), True
+    indexes = sorted(table.indexes, key=lambda index: (not index.unique, index.name))
+    if indexes:
+        return list(indexes[0].expressions), bool(indexes[0].unique)
+    return [column for column in table.columns if not column.primary_key], False
+
+
 def create_db_engine(db_path):
-    return create_engine(f"sqlite:///{db_path}", isolation_level="AUTOCOMMIT", future=True)
+    """BaseDB keeps one connection per thread for the whole run, so the engine does not pool them"""
+    db_engine = create_engine(
+        f"sqlite:///{db_path}",
+        isolation_level="AUTOCOMMIT",
+        poolclass=NullPool,
+        connect_args={"check_same_thread": False},
+        future=True,
+    )
+    event.listen(db_engine, "connect", set_sqlite_pragmas)
+    return db_engine
 
 
 def open_config(config_path):
@@ -61,21 +180,42 @@ def init_protocol_dbs(workspace_name, p_loader=None):
     protocols = p_loader.get_protocols()
 
     for name, proto in protocols.items():
-        db_mod = proto.get("db")
-        if not db_mod:
+        if "dbpath" not in proto:
             continue
 
         proto_db_path = path_join(WORKSPACE_DIR, workspace_name, f"{name}.db")
 
         if not exists(proto_db_path):
             print(f"[*] Initializing {name.upper()} protocol database")
+            db_mod = p_loader.load_protocol(proto["dbpath"])
             db_engine = create_db_engine(proto_db_path)
             db_mod.database.db_schema(db_engine)
             db_engine.dispose()
 
 
+def merge_workspaces(workspace_name, sources, p_loader=None):
+    """Merge the protocol databases of other workspaces into this one, returns the number of merged rows per protocol"""
+    if p_loader is None:
+        p_loader = ProtocolLoader()
 
+    init_protocol_dbs(workspace_name, p_loader)
+    merged = {}
+    for name, proto in p_loader.get_protocols().items():
+        if "dbpath" not in proto:
+            continue
+        source_paths = [path_join(WORKSPACE_DIR, source, f"{name}.db") for source in sources if source != workspace_name]
+        source_paths = [source_path for source_path in source_paths if exists(source_path)]
+        if not source_paths:
+            continue
 
+        db_engine = create_db_engine(path_join(WORKSPACE_DIR, workspace_name, f"{name}.db"))
+        db = p_loader.load_protocol(proto["dbpath"]).database(db_engine)
+        try:
+            merged[name] = sum(db.merge(source_path) for source_path in source_paths)
+        finally:
+            db.shutdown_db()
+            db_engine.dispose()
+    return merged
 
 
 def create_workspace(workspace_name, p_loader=None):
@@ -143,26 +283,163 @@ def format_host_query(q, filter_term, HostsTable):
     return q
 
 
+def upsert_set(q, table, update_columns, keep_columns=()):
+    """SET clause of an INSERT ... ON CONFLICT DO UPDATE q: None never overwrites a stored value, and
+    a stored value of keep_columns is never overwritten
+    """
+    return {
+        column: func.coalesce(table.c[column], q.excluded[column]) if column in keep_columns else func.coalesce(q.excluded[column], table.c[column])
+        for column in update_columns
+    }
+
+
+class WriteBehind:
+    """Queues rows for a protocol DB and writes them in batches on a dedicated thread.
+
+    Rows are grouped by handler and coalesced by key in memory (non None values of a later row win,
+    except for the keep_columns of submit()), so a secret dumped twice is written once. A handler receives a connection inside a single
+    transaction and the list of rows, which it writes with executemany.
+    flush() is the barrier: once it returns, every row submitted before the call is in the database.
+    """
+
+    def __init__(self, db, flush_interval=0.5, batch_size=10000):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.pending = {}  # handler -> {key: row}
+        self.count = 0
+        self.closed = False
+        self.lock = Lock()  # protects pending, held only to add or swap rows
+        self.write_lock = Lock()  # one batch at a time, flush() waits for the one in progress
+        self.wakeup = Event()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, handler, key, row, keep_columns=()):
+        """Queue a row, returns False once the writer is closed so the caller writes it directly.
+
+        The keep_columns of a row already queued under key keep their value when it is not None.
+        """
+        with self.lock:
+            if self.closed:
+                return False
+            rows = self.pending.setdefault(handler, {})
+            previous = rows.get(key)
+            rows[key] = row if previous is None else {**previous, **{column: value for column, value in row.items() if value is not None and (column not in keep_columns or previous.get(column) is None)}}
+            self.count += 1
+            if self.count >= self.batch_size:
+                self.wakeup.set()
+        return True
+
+    def run(self):
+        while not self.closed:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self.write_lock:
+            with self.lock:
+                pending, self.pending, self.count = self.pending, {}, 0
+            if not pending:
+                return
+            try:
+                self.write(pending)
+            except Exception as e:
+                nxc_logger.fail(f"Error writing batched rows to the {self.db.protocol} database: {e}")
+                nxc_logger.debug("Batched write failed", exc_info=True)
+
+    def write(self, pending):
+        with self.db.transaction() as conn:
+            for handler, rows in pending.items():
+                handler(conn, list(rows.values()))
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+        self.wakeup.set()
+        self.thread.join()
+        self.flush()
+
+
+class CredentialCache:
+    """Run scoped LRU of the credentials written by this process, keyed like the unique credential index.
+
+    Dumps report the same secret from every host (e.g. a local admin hash on thousands of machines),
+    an add_credential() that would not change the stored row is answered from here without touching
+    SQLite. An entry only matches an identical credential, so a changed password still goes to the
+    database, and it is bounded to maxsize entries, the least recently used are evicted first.
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()  # key -> (fingerprint, row id)
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, *fingerprints):
+        """Row id of the credential if it was written with one of these fingerprints, None otherwise"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] not in fingerprints:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, fingerprint, row_id):
+        with self.lock:
+            self.entries[key] = (fingerprint, row_id)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
 class BaseDB:
+    # Methods queueing their row inside batched_writes(), where they return None. --workers children batch these calls themselves
+    batched_calls = ()
+
     def __init__(self, db_engine):
         self.db_engine = db_engine
         self.db_path = self.db_engine.url.database
         self.protocol = Path(self.db_path).stem.upper()
         self.metadata = MetaData()
+        self.orm_metadata = None
+        self.schema_current = None  # whether the stored user_version matches the ORM tables, read on the first reflect_table()
         self.reflect_tables()
-        session_factory = sessionmaker(bind=self.db_engine, expire_on_commit=True)
-
-        session = scoped_session(session_factory)
-        self.sess = session()
-        self.lock = Lock()
+        if not self.schema_current:
+            self.stamp_schema()
+        self.local = local()  # conn: this thread's connection, depth: nesting of transaction() blocks
+        self.connections = []
+        self.connections_lock = Lock()
+        self.lock = Lock()  # serializes writes outside of transaction() blocks, reads never take it
+        self.writer = None
+        self.writer_users = 0
+        self.writer_lock = Lock()
+        self.credential_cache = CredentialCache()
 
     def reflect_tables(self):
         raise NotImplementedError("Reflect tables not implemented")
 
-    def reflect_table(self, table):
+    def reflect_table(self, table, migrate=True):
+        if self.schema_current is None:
+            self.orm_metadata = table.__table__.metadata
+            with self.db_engine.connect() as conn:
+                self.schema_current = get_schema_version(conn) == schema_version(self.orm_metadata)
+        if self.schema_current:
+            # Stamped by a previous run that reflected (and if needed migrated) every table, the ORM definition is the schema
+            return table.__table__.to_metadata(self.metadata)
+
         with self.db_engine.connect():
             try:
-                reflected_table = Table(table.__tablename__, self.metadata, autoload_with=self.db_engine)
+                with expression_indexes_skipped():
+                    reflected_table = Table(table.__tablename__, self.metadata, autoload_with=self.db_engine)
 
                 # Check for column addition / deletion
                 reflected_columns = set(reflected_table.columns.keys())
@@ -176,8 +453,22 @@ class BaseDB:
                 if reflected_constraints != orm_constraints:
                     raise ValueError(f"Schema mismatch detected! ORM constraints: {orm_constraints}, Reflected constraints: {reflected_constraints}")
 
+                # Indexes are not part of the comparison, workspaces created before an index was declared just get it.
+                # Rows a new unique index rejects are merged by migrate_table(), after its backup
+                with ddl_transaction(self.db_engine) as conn:
+                    self.create_indexes(conn, table.__table__)
                 return reflected_table
-            except (NoInspectionAvailable, NoSuchTableError, ValueError) as e:
+            except (NoInspectionAvailable, NoSuchTableError, ValueError, IntegrityError) as e:
+                if migrate:
+                    try:
+                        self.migrate_table(table)
+                    except Exception as migration_error:
+                        nxc_logger.debug(f"Migrating table '{table.__tablename__}' failed: {migration_error}")
+                    else:
+                        if table.__tablename__ in self.metadata.tables:
+                            self.metadata.remove(self.metadata.tables[table.__tablename__])
+                        return self.reflect_table(table, migrate=False)
+
                 commands_platform = {
                     "Windows": [
                         f"cmd /c copy {self.db_path} %USERPROFILE%\\nxc_{self.protocol.lower()}.bak",
@@ -197,21 +488,353 @@ class BaseDB:
                 nxc_logger.fail(f"Then remove the {self.protocol} DB (`{delete_command}`) and run nxc to initialize the new DB")
                 sys.exit()
 
-    def shutdown_db(self):
+    def stamp_schema(self):
+        """Record the schema version once every table was reflected, later runs skip the reflection"""
+        if self.orm_metadata is None:
+            return
+        version = schema_version(self.orm_metadata)
+        with self.db_engine.connect() as conn:
+            conn.exec_driver_sql(f"PRAGMA user_version = {version}")
+        self.schema_current = True
+
+    def migrate_table(self, table):
+        """Bring a table of an older workspace to the current definition, keeping its rows.
+
+        SQLite cannot alter constraints, so this follows its documented procedure: create the new
+        table under a temporary name, copy the columns both versions share, drop the old table and
+        rename the new one, all in one transaction. The database is backed up next to itself first.
+        Rows sharing a key of a unique index are merged, see merge_duplicates().
+        """
+        name = table.__tablename__
+        inspector = inspect(self.db_engine)
+        if not inspector.has_table(name):
+            table.__table__.create(self.db_engine)
+            nxc_logger.debug(f"Created missing table '{name}' in the {self.protocol} database")
+            return
+
+        existing_columns = {column["name"] for column in inspector.get_columns(name)}
+        columns = ", ".join(f'"{column.name}"' for column in table.__table__.columns if column.name in existing_columns)
+        migration_name = f"{name}_migration"
+        # The copy's foreign keys need their target tables in the same MetaData
+        metadata = MetaData()
+        for orm_table in table.__table__.metadata.sorted_tables:
+            orm_table.to_metadata(metadata, name=migration_name if orm_table.name == name else None)
+
+        backup_path = self.backup()
+        with ddl_transaction(self.db_engine) as conn:
+            conn.execute(CreateTable(metadata.tables[migration_name]))
+            conn.exec_driver_sql(f'INSERT INTO "{migration_name}" ({columns}) SELECT {columns} FROM "{name}"')
+            conn.exec_driver_sql(f'DROP TABLE "{name}"')
+            conn.exec_driver_sql(f'ALTER TABLE "{migration_name}" RENAME TO "{name}"')
+            self.create_indexes(conn, table.__table__, merge=True)
+        nxc_logger.display(f"Migrated table '{name}' of the {self.protocol} database to the current schema (backup: {backup_path})")
+
+    def create_indexes(self, conn, table, merge=False):
+        # IF NOT EXISTS rather than checkfirst, SQLAlchemy cannot reflect expression indexes such as lower(username)
+        for index in table.indexes:
+            try:
+                conn.execute(CreateIndex(index, if_not_exists=True))
+            except IntegrityError:
+                # Workspaces written before the index was unique can hold rows it rejects, only a migration merges them
+                if not merge:
+                    raise
+                self.merge_duplicates(conn, table, index)
+                conn.execute(CreateIndex(index, if_not_exists=True))
+
+    def merge_duplicates(self, conn, table, index):
+        """Collapse the rows sharing a key of the unique index onto the oldest one, references to the others are repointed first"""
+        kept = {}
+        duplicates = []
+        for row in conn.execute(select(table.c.id, *index.expressions).order_by(table.c.id)):
+            key = tuple(row[1:])
+            # NULLs never conflict in a SQLite unique index
+            if None in key:
+                continue
+            if key in kept:
+                duplicates.append({"duplicate": row.id, "kept": kept[key]})
+            else:
+                kept[key] = row.id
+        if not duplicates:
+            return
+
+        duplicate_ids = [duplicate["duplicate"] for duplicate in duplicates]
+        inspector = inspect(conn)
+        for referencing_table in table.metadata.sorted_tables:
+            if not inspector.has_table(referencing_table.name):
+                continue
+            for foreign_key in referencing_table.foreign_keys:
+                if foreign_key.column.table is not table:
+                    continue
+                column = foreign_key.parent
+                # Rows that would become duplicates themselves are ignored here and deleted below
+                q = update(referencing_table).prefix_with("OR IGNORE").where(column == bindparam("duplicate")).values({column.name: bindparam("kept")})
+                conn.execute(q, duplicates)
+                conn.execute(delete(referencing_table).where(column.in_(duplicate_ids)))
+        conn.execute(delete(table).where(table.c.id.in_(duplicate_ids)))
+        nxc_logger.display(f"Merged {len(duplicates)} duplicate row(s) of table '{table.name}' in the {self.protocol} database")
+
+    def upsert(self, table, values, index_elements, update_columns=None, keep_columns=()):
+        """Insert a row or update the one it conflicts with on index_elements, and return its id, in a single statement.
+
+        update_columns defaults to every column in values. None never overwrites a stored value,
+        so callers pass every column they know and leave the rest None. keep_columns are only
+        filled when empty, a stored value is never overwritten.
+        """
+        q = Insert(table).values(values)
+        update_columns = values.keys() if update_columns is None else update_columns
+        q = q.on_conflict_do_update(index_elements=index_elements, set_=upsert_set(q, table, update_columns, keep_columns))
+        return self.db_execute(q.returning(table.c.id)).scalar_one()
+
+    def merge(self, db_path):
+        """Merge the rows of another database of this protocol, e.g. the same engagement scanned from another box.
+
+        Everything is set based, in one transaction over the ATTACHed database: tables are copied in
+        foreign key order with INSERT ... SELECT, rows already present (by their unique key) only get
+        their empty columns filled, and the old and new ids of referenced tables are collected in
+        temporary mapping tables that the foreign keys of the following tables are joined through.
+        Returns the number of rows inserted or updated.
+        """
+        self.flush()
+        referenced = {key.column.table.name for table in self.orm_metadata.sorted_tables for key in table.foreign_keys}
+        merged = 0
+        with ddl_transaction(self.db_engine, attach={"source": db_path}) as conn:
+            source = MetaData()
+            with expression_indexes_skipped():
+                source.reflect(conn, schema="source")
+            id_maps = {}
+            for table in self.orm_metadata.sorted_tables:
+                source_table = source.tables.get(f"source.{table.name}")
+                if source_table is not None:
+                    merged += self.merge_table(conn, table, source_table, id_maps, table.name in referenced)
+            for id_map in id_maps.values():
+                id_map.drop(conn)
+        self.credential_cache.clear()
+        nxc_logger.debug(f"Merged {merged} row(s) from {db_path} into the {self.protocol} database")
+        return merged
+
+    def merge_table(self, conn, table, source_table, id_maps, referenced):
+        # Value of every column for an incoming row, foreign keys are translated through the id maps of their tables
+        values = {}
+        joins = []
+        conditions = []
+        for column in table.columns:
+            if column.primary_key:
+                continue
+            value = source_table.c[column.name] if column.name in source_table.c else null()
+            foreign_key = next(iter(column.foreign_keys), None)
+            if foreign_key is not None and value is not null():
+                id_map = id_maps.get(foreign_key.column.table.name)
+                if id_map is None:
+                    conditions.append(value.is_(None))
+                    value = null()
+                else:
+                    id_map = id_map.alias(f"{id_map.name}_{column.name}")
+                    joins.append((id_map, id_map.c.old_id == value))
+                    # rows pointing to a row the source database does not hold are dropped
+                    conditions.append(or_(value.is_(None), id_map.c.new_id.is_not(None)))
+                    value = id_map.c.new_id
+            values[column.name] = value
+
+        key, unique = table_key(table)
+
+        # The stored rows are aliased, unqualified they would resolve to the source table of the same name
+        existing = table.alias("existing")
+
+        def incoming(expression):
+            return replacement_traverse(expression, {}, lambda element: values[element.name] if isinstance(element, Column) and element.table is table else None)
+
+        def stored(expression):
+            return replacement_traverse(expression, {}, lambda element: existing.c[element.name] if isinstance(element, Column) and element.table is table else None)
+
+        # IS rather than =, so that rows with NULLs in their key still match
+        match = and_(*(stored(expression).is_not_distinct_from(incoming(expression)) for expression in key))
+        already_present = select(existing.c.id).where(match).exists()
+
+        rows = select(*values.values()).select_from(source_table)
+        for id_map, onclause in joins:
+            rows = rows.outerjoin(id_map, onclause)
+
+        if unique:
+            # NULLs never conflict in a unique index, those rows are matched with IS instead
+            rows = rows.where(*conditions, or_(and_(*(incoming(expression).is_not(None) for expression in key)), ~already_present))
+            q = Insert(table).from_select(list(values), rows)
+            update_columns = [name for name, value in values.items() if value is not null() and not any(table.c[name] is expression for expression in key)]
+            fill_empty = {name: func.coalesce(func.nullif(table.c[name], ""), q.excluded[name]) for name in update_columns}
+            q = q.on_conflict_do_update(index_elements=key, set_=fill_empty) if fill_empty else q.on_conflict_do_nothing(index_elements=key)
+        else:
+            q = Insert(table).from_select(list(values), rows.where(*conditions, ~already_present))
+        merged = conn.execute(q).rowcount
+
+        if referenced and "id" in source_table.c:
+            id_map = Table(
+                f"merge_map_{table.name}",
+                MetaData(),
+                Column("old_id", Integer, primary_key=True),
+                Column("new_id", Integer),
+                prefixes=["TEMPORARY"],
+            )
+            id_map.create(conn)
+            ids = select(source_table.c.id, func.min(existing.c.id)).select_from(source_table)
+            for join_map, onclause in joins:
+                ids = ids.outerjoin(join_map, onclause)
+            ids = ids.join(existing, match).group_by(source_table.c.id)
+            conn.execute(Insert(id_map).from_select(["old_id", "new_id"], ids))
+            id_maps[table.name] = id_map
+        return merged
+
+    def backup(self):
+        """Consistent copy of the database (WAL content included) next to it, returns its path"""
+        backup_path = f"{self.db_path}.{datetime.now().strftime('%Y%m%d-%H%M%S')}.bak"
+        raw_conn = self.db_engine.raw_connection()
         try:
-            self.sess.close()
-        # due to the async nature of nxc, sometimes session state is a bit messy and this will throw:
-        # Method 'close()' can't be called here; method '_connection_for_bind()' is already in progress and
-        # this would cause an unexpected state change to <SessionTransactionState.CLOSED: 5>
-        except IllegalStateChangeError as e:
-            nxc_logger.debug(f"Error while closing session db object: {e}")
+            target = sqlite3.connect(backup_path)
+            raw_conn.driver_connection.backup(target)
+            target.close()
+        finally:
+            raw_conn.close()
+        return backup_path
+
+    def shutdown_db(self):
+        self.flush()
+        cache = self.credential_cache
+        if cache.hits or cache.misses:
+            nxc_logger.debug(f"{self.protocol} credential cache: {cache.hits} hits, {cache.misses} misses, {len(cache.entries)} entries")
+        with self.connections_lock:
+            connections, self.connections = self.connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception as e:
+                nxc_logger.debug(f"Error while closing db connection: {e}")
+        self.local = local()
 
     def clear_database(self):
         for table in self.metadata.sorted_tables:
             self.db_execute(table.delete())
+        self.credential_cache.clear()
+
+    def connection(self):
+        """Connection of the calling thread, opened on first use and kept until shutdown_db()
+
+        Connections are transactional: SQLite starts a transaction at the first write,
+        db_execute() commits it right away unless a transaction() block is open.
+        """
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.db_engine.connect().execution_options(isolation_level="SERIALIZABLE")
+            self.local.conn = conn
+            self.local.depth = 0
+            with self.connections_lock:
+                self.connections.append(conn)
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Group every write of the block (db_execute() calls included) into a single commit
+
+        Blocks nest, the outermost one commits, or rolls back if the block raised.
+        """
+        conn = self.connection()
+        self.local.depth += 1
+        try:
+            yield conn
+        except BaseException:
+            self.local.depth -= 1
+            if not self.local.depth:
+                conn.rollback()
+            raise
+        self.local.depth -= 1
+        if not self.local.depth:
+            conn.commit()
+
+    @contextmanager
+    def batched_writes(self):
+        """Route the hot insert paths (e.g. add_credential) through a WriteBehind writer for the block.
+
+        Blocks may overlap (e.g. several threads dumping NTDS), the writer lives until the last one exits.
+        Every block ends with a flush, reads through db_execute flush first as well.
+        """
+        with self.writer_lock:
+            if self.writer is None:
+                self.writer = WriteBehind(self)
+            self.writer_users += 1
+        try:
+            yield
+        finally:
+            with self.writer_lock:
+                self.writer_users -= 1
+                writer = self.writer
+                last = not self.writer_users
+                if last:
+                    self.writer = None
+            if last:
+                writer.close()
+            else:
+                writer.flush()
+
+    def flush(self):
+        writer = self.writer
+        if writer is not None:
+            writer.flush()
 
     def db_execute(self, *args):
-        self.lock.acquire()
-        res = self.sess.execute(*args)
-        self.lock.release()
+        # Reads must see the rows still queued in the write-behind writer
+        writer = self.writer
+        if writer is not None and writer.count:
+            writer.flush()
+
+        conn = self.connection()
+        if self.local.depth:
+            return self.buffered(conn.execute(*args))
+        if not getattr(args[0], "is_dml", False):
+            return self.buffered(conn.execute(*args))
+        with self.lock:
+            try:
+                res = self.buffered(conn.execute(*args))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
         return res
+
+    def iter_pages(self, table, page_size=500, **filters):
+        """Yield the rows of a table page by page (lists of at most page_size rows) in id order
+
+        Pages are fetched with keyset pagination (id > last id of the previous page), so every page
+        is a short indexed read no matter how deep it is. Filters are column=value pairs combined
+        with AND: strings match case-insensitively as a substring, other values by equality and
+        None is no filter.
+        """
+        conditions = []
+        for name, value in filters.items():
+            if value is None:
+                continue
+            column = table.c[name]
+            conditions.append(func.lower(column).like(f"%{value.lower()}%") if isinstance(value, str) else column == value)
+
+        last_id = None
+        while True:
+            q = select(table).where(*conditions)
+            if last_id is not None:
+                q = q.where(table.c.id > last_id)
+            rows = self.db_execute(q.order_by(table.c.id).limit(page_size)).all()
+            if rows:
+                yield rows
+            if len(rows) < page_size:
+                return
+            last_id = rows[-1].id
+
+    def stream(self, q, batch_size=1000):
+        """Yield the rows of a select batch by batch instead of loading them all (e.g. for exports)
+
+        Rows come from a connection of their own, so the generator may be consumed slowly without
+        holding this thread's connection open in a read transaction.
+        """
+        self.flush()
+        with self.db_engine.connect() as conn:
+            yield from conn.execution_options(yield_per=batch_size).execute(q)
+
+    @staticmethod
+    def buffered(res):
+        """Fetch rows right away, callers consume them after the statement's transaction has ended"""
+        return res.freeze()() if res.returns_rows else res
@@ -2,8 +2,8 @@ from os import mkdir
 from os.path import exists
 from os.path import join as path_join
 import shutil
-from nxc.paths import NXC_PATH, CONFIG_PATH, TMP_PATH, DATA_PATH
-from nxc.database import initialize_db
+from nxc.paths import NXC_PATH, CONFIG_PATH, TMP_PATH, DATA_PATH, WORKSPACE_DIR
+from nxc.loaders.protocolloader import ProtocolLoader
 from nxc.logger import nxc_logger
 
 
@@ -38,7 +38,12 @@ def first_run_setup(logger=nxc_logger):
             logger.display(f"Creating missing folder logs/{subfolder}")
             mkdir(path_join(NXC_PATH, f"logs/{subfolder}"))
 
-    initialize_db()
+    # nxc.database (and SQLAlchemy) is only imported when a protocol database of the default workspace is missing
+    protocols = ProtocolLoader().get_protocols()
+    if any("dbpath" in proto and not exists(path_join(WORKSPACE_DIR, "default", f"{name}.db")) for name, proto in protocols.items()):
+        from nxc.database import initialize_db
+
+        initialize_db()
 
     if not exists(CONFIG_PATH):
         logger.display("Copying default configuration file")
@@ -0,0 +1,157 @@
+import os
+from datetime import datetime
+from os.path import exists, join
+from threading import Event, Lock, Thread
+
+from nxc.logger import nxc_logger
+from nxc.paths import WORKSPACE_DIR
+
+HEADER = "# nxc checkpoint v1"
+
+
+def new_journal_path(workspace, protocol):
+    directory = join(WORKSPACE_DIR, workspace, "checkpoints")
+    os.makedirs(directory, exist_ok=True)
+    return join(directory, f"{protocol}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.journal")
+
+
+class CheckpointJournal:
+    """Append-only journal of finished targets and failed credential attempts, used by --resume.
+
+    Lines are tab separated:
+        D <target>                           every attempt and module of the target ran
+        F <target> <user index> <secret index>   a login failed, indices into the CredentialPlan
+
+    Records are buffered in memory and written + fsync'ed by a background thread every
+    flush_interval seconds, so the threads scanning targets never wait on the disk. A crash
+    loses at most the last interval, which is simply tried again. A truncated last line is ignored.
+    Loading a journal drops the failed logins of finished targets, and rewrites it without them.
+
+    A target whose attempts were not all made (an error, or logins held back by the fail limits)
+    is not marked done, so that --resume tries it again.
+    """
+
+    def __init__(self, path, protocol, fingerprint, flush_interval=1.0):
+        self.path = path
+        self.protocol = protocol
+        self.fingerprint = fingerprint
+        self.flush_interval = flush_interval
+        self.done = set()
+        self.failed = {}  # target -> {(user index, secret index)}
+        self.unfinished = False  # a target of this run was left for --resume
+        self.buffer = []
+        self.lock = Lock()  # protects the buffer, held only to append or swap it
+        self.io_lock = Lock()
+        self.stopped = Event()
+        self.flusher = None
+
+        if exists(path):
+            self.load()
+        self.file = open(path, "a", encoding="utf-8")  # noqa: SIM115
+        if self.file.tell() == 0:
+            self.file.write(f"{HEADER}\t{protocol}\t{fingerprint}\n")
+            self.file.flush()
+
+    def load(self):
+        with open(self.path, encoding="utf-8") as journal:
+            header = journal.readline().rstrip("\n").split("\t")
+            if header[0] != HEADER:
+                raise ValueError(f"{self.path} is not a nxc checkpoint journal")
+            if header[1:] != [self.protocol, self.fingerprint]:
+                raise ValueError(f"{self.path} was written for another protocol or set of credentials")
+
+            records = collapsed = 0
+            for line in journal:
+                if not line.endswith("\n"):
+                    break
+                records += 1
+                fields = line.rstrip("\n").split("\t")
+                if fields[0] == "D" and len(fields) == 2:
+                    self.done.add(fields[1])
+                    # The failed logins of a finished target are never looked up again
+                    collapsed += len(self.failed.pop(fields[1], ()))
+                elif fields[0] == "F" and len(fields) == 4:
+                    if fields[1] in self.done:
+                        collapsed += 1
+                    else:
+                        self.failed.setdefault(fields[1], set()).add((int(fields[2]), int(fields[3])))
+        if collapsed or records > len(self.done) + sum(map(len, self.failed.values())):
+            self.compact()
+        nxc_logger.display(f"Resuming from {self.path}: {len(self.done)} finished target(s), {sum(map(len, self.failed.values()))} failed login(s) skipped")
+
+    def compact(self):
+        """Rewrite the journal with only the records still needed: finished targets and the failed logins of the others"""
+        compacted = f"{self.path}.compact"
+        with open(compacted, "w", encoding="utf-8") as journal:
+            journal.write(f"{HEADER}\t{self.protocol}\t{self.fingerprint}\n")
+            journal.writelines(f"D\t{target}\n" for target in self.done)
+            journal.writelines(f"F\t{target}\t{user_index}\t{secret_index}\n" for target, attempts in self.failed.items() for user_index, secret_index in attempts)
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.replace(compacted, self.path)
+        nxc_logger.debug(f"Compacted checkpoint journal {self.path}")
+
+    def is_done(self, target):
+        return target in self.done
+
+    def failed_attempts(self, target):
+        return self.failed.get(target, set())
+
+    def attempt_failed(self, target, user_index, secret_index):
+        self.record(f"F\t{target}\t{user_index}\t{secret_index}\n")
+
+    def target_done(self, target):
+        self.record(f"D\t{target}\n")
+
+    def target_unfinished(self, target):
+        self.unfinished = True
+
+    def record(self, line):
+        with self.lock:
+            self.buffer.append(line)
+            if self.flusher is None:
+                # Started on first use, so forking --workers happens before any thread exists
+                self.flusher = Thread(target=self.flush_loop, daemon=True)
+                self.flusher.start()
+
+    def flush_loop(self):
+        while not self.stopped.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            lines, self.buffer = self.buffer, []
+        if not lines:
+            return
+        with self.io_lock:
+            self.file.writelines(lines)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.stopped.set()
+        if self.flusher is not None:
+            self.flusher.join()
+        self.flush()
+        self.file.close()
+
+    def remove(self):
+        """Delete the closed journal, once a run finished every target there is nothing to resume"""
+        os.remove(self.path)
+        nxc_logger.debug(f"Removed checkpoint journal {self.path}")
+
+
+class SkipFinished:
+    """Target stream wrapper dropping the targets a resumed journal has already finished"""
+
+    def __init__(self, targets, journal):
+        self.targets = targets
+        self.journal = journal
+
+    def total(self):
+        return max(self.targets.total() - len(self.journal.done), 1)
+
+    def __iter__(self):
+        for target in self.targets:
+            if not self.journal.is_done(target):
+                yield target
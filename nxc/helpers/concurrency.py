@@ -0,0 +1,131 @@
+import errno
+import socket
+from collections import deque
+from threading import Lock, local
+from time import monotonic
+
+# Why an initial connect failed, see connect_failure()
+TIMEOUT = "timeout"
+LOCAL_ERROR = "local error"
+REFUSED = "refused"
+# Errors of the scanning host itself running out of sockets, buffers or ports
+LOCAL_ERRNOS = {errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM, errno.EADDRNOTAVAIL}
+
+connect_errors = local()
+
+
+def record_connect_errors():
+    """Keep the last error of socket creation and connect() per thread.
+
+    The protocols catch their connect errors, the window still needs to tell a timeout from a refusal.
+    Installed once, by --adaptive.
+    """
+    if getattr(socket.socket.connect, "records_errors", False):
+        return
+    init = socket.socket.__init__
+    connect = socket.socket.connect
+
+    def recording_init(sock, *args, **kwargs):
+        try:
+            init(sock, *args, **kwargs)
+        except OSError as e:
+            connect_errors.last = e
+            raise
+
+    def recording_connect(sock, address):
+        try:
+            return connect(sock, address)
+        except OSError as e:
+            connect_errors.last = e
+            raise
+
+    recording_connect.records_errors = True
+    socket.socket.__init__ = recording_init
+    socket.socket.connect = recording_connect
+
+
+def reset_connect_error():
+    connect_errors.last = None
+
+
+def connect_failure():
+    """Why the last connect of this thread failed: TIMEOUT, LOCAL_ERROR or REFUSED (refused, reset, unreachable, or the protocol failed after connecting)"""
+    error = getattr(connect_errors, "last", None)
+    if isinstance(error, TimeoutError):
+        return TIMEOUT
+    if error is not None and error.errno in LOCAL_ERRNOS:
+        return LOCAL_ERROR
+    return REFUSED
+
+
+class AdaptiveWindow:
+    """Congestion controller for the number of targets scanned concurrently, capped by --threads.
+
+    Every initial connect reports how long it took and, when it failed, why (see connect_failure()):
+        - only successful connects are round trip time samples. Below the slow start threshold the
+          window grows by one per success (doubling every round), above it by one per window's
+          worth of successes
+        - congestion is a local error (no sockets, buffers or ports left), or a timeout of a host
+          that answered before: a host that never answered may simply not exist. With
+          hosts_answered (--pre-sweep) every target answered a probe already. Refused and reset
+          connects come from a working path, they are samples without congestion
+        - when the recent congestion rate exceeds failure_threshold, or the smoothed RTT climbs
+          above latency_factor times the best RTT seen (queueing on the link), the window and the
+          slow start threshold are multiplied by backoff, at most once per smoothed RTT so a burst
+          of failures counts as one event
+    """
+
+    def __init__(self, maximum, initial=16, minimum=1, backoff=0.5, failure_threshold=0.25, latency_factor=3.0, sample_size=32, hosts_answered=False):
+        self.maximum = max(maximum, 1)
+        self.minimum = min(max(minimum, 1), self.maximum)
+        self.window = float(min(max(initial, self.minimum), self.maximum))
+        self.slow_start_threshold = float(self.maximum)
+        self.backoff = backoff
+        self.failure_threshold = failure_threshold
+        self.latency_factor = latency_factor
+        self.hosts_answered = hosts_answered
+        self.answered = set()  # hosts with a successful connect, their timeouts are congestion
+        self.samples = deque(maxlen=sample_size)  # True for every congestion signal
+        self.min_rtt = None
+        self.srtt = None
+        self.last_decrease = 0.0
+        self.lock = Lock()
+
+    @property
+    def limit(self):
+        return int(self.window)
+
+    def observe(self, host, rtt, failure=None):
+        with self.lock:
+            if failure is None:
+                self.answered.add(host)
+                self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+                self.srtt = rtt if self.srtt is None else 0.875 * self.srtt + 0.125 * rtt
+                self.samples.append(False)
+            elif failure == LOCAL_ERROR or (failure == TIMEOUT and (self.hosts_answered or host in self.answered)):
+                self.samples.append(True)
+            elif failure == REFUSED:
+                self.samples.append(False)
+
+            if self.congested():
+                self.decrease()
+            elif failure is None:
+                self.window = min(self.maximum, self.window + (1 if self.window < self.slow_start_threshold else 1 / self.window))
+
+    def congested(self):
+        """Caller holds the lock"""
+        if len(self.samples) >= self.samples.maxlen // 4 and sum(self.samples) / len(self.samples) > self.failure_threshold:
+            return True
+        # The absolute slack keeps sub-millisecond LAN jitter from looking like queueing
+        return self.srtt is not None and self.srtt > max(self.min_rtt * self.latency_factor, self.min_rtt + 0.1)
+
+    def decrease(self):
+        """Caller holds the lock"""
+        now = monotonic()
+        if now - self.last_decrease < max(self.srtt or 0.0, 1.0):
+            return
+        self.last_decrease = now
+        self.window = max(self.minimum, self.window * self.backoff)
+        self.slow_start_threshold = self.window
+        # Start judging the new window from fresh samples
+        self.samples.clear()
@@ -0,0 +1,199 @@
+import sys
+from hashlib import sha256
+from os.path import isfile
+
+from nxc.logger import nxc_logger
+
+
+def query_db_creds(args, db, logger=nxc_logger):
+    """Queries the database for credentials to be used for authentication.
+
+    Valid cred_id values are:
+        - a single cred_id
+        - a range specified with a dash (ex. 1-5)
+        - 'all' to select all credentials
+
+    :return: list of tuples (cred_id, domain, username, secret, cred_type, pillaged_from)
+    """
+    creds = []
+
+    if db is None:
+        logger.error("No database available to query credential IDs from")
+        return creds
+
+    for cred_id in args.cred_id:
+        if str(cred_id).lower() == "all":
+            creds = db.get_credentials()
+        else:
+            db_creds = db.get_credentials(filter_term=int(cred_id))
+            if not db_creds:
+                logger.error(f"Invalid database credential ID {cred_id}!")
+                continue
+            creds.extend(db_creds)
+    return creds
+
+
+def parse_credentials(args, logger=nxc_logger):
+    r"""Parse credentials from the command line or from a file specified.
+
+    Usernames can be specified with a domain (domain\\username) or without (username).
+    If the file contains domain\\username the domain specified will be overwritten by the one in the file.
+    Usernames without any domain get None, which is resolved to the domain of each target at login time.
+
+    :return: domain[], username[], secret[], cred_type[]
+    """
+    default_domain = getattr(args, "domain", None)
+    domain = []
+    username = []
+    secret = []
+    cred_type = []
+
+    # Parse usernames
+    for user in args.username:
+        if isfile(user):
+            with open(user) as user_file:
+                for line in user_file:
+                    if "\\" in line and len(line.split("\\")) == 2:
+                        domain_single, username_single = line.split("\\")
+                    else:
+                        domain_single = default_domain
+                        username_single = line
+                    domain.append(domain_single)
+                    username.append(username_single.strip())
+        else:
+            if "\\" in user:
+                domain_single, username_single = user.split("\\")
+            else:
+                domain_single = default_domain
+                username_single = user
+            domain.append(domain_single)
+            username.append(username_single)
+
+    # Parse passwords
+    for password in getattr(args, "password", None) or []:
+        if isfile(password):
+            try:
+                with open(password, errors=("ignore" if args.ignore_pw_decoding else "strict")) as password_file:
+                    for line in password_file:
+                        secret.append(line.strip())
+                        cred_type.append("plaintext")
+            except UnicodeDecodeError as e:
+                logger.error(f"{type(e).__name__}: Could not decode password file. Make sure the file only contains UTF-8 characters.")
+                logger.error("You can ignore non UTF-8 characters with the option '--ignore-pw-decoding'")
+                sys.exit(1)
+        else:
+            secret.append(password)
+            cred_type.append("plaintext")
+
+    # Parse NTLM-hashes
+    if getattr(args, "hash", None):
+        for ntlm_hash in args.hash:
+            if isfile(ntlm_hash):
+                with open(ntlm_hash) as ntlm_hash_file:
+                    for i, line in enumerate(ntlm_hash_file):
+                        line = line.strip()
+                        if len(line) != 32 and len(line) != 65 and len(line) != 0:
+                            logger.fail(f"Invalid NTLM hash length on line {(i + 1)} (len {len(line)}): {line}")
+                            continue
+                        else:
+                            secret.append(line)
+                            cred_type.append("hash")
+            else:
+                if len(ntlm_hash) != 32 and len(ntlm_hash) != 65 and len(ntlm_hash) != 0:
+                    logger.fail(f"Invalid NTLM hash length {len(ntlm_hash)}, authentication not sent")
+                    sys.exit(1)
+                else:
+                    secret.append(ntlm_hash)
+                    cred_type.append("hash")
+
+    # Parse AES keys
+    if getattr(args, "aesKey", None):
+        for aesKey in args.aesKey:
+            if isfile(aesKey):
+                with open(aesKey) as aesKey_file:
+                    for line in aesKey_file:
+                        secret.append(line.strip())
+                        cred_type.append("aesKey")
+            else:
+                secret.append(aesKey)
+                cred_type.append("aesKey")
+
+    return domain, username, secret, cred_type
+
+
+class CredentialPlan:
+    """Immutable set of credentials to try, built once per run and shared by every target.
+
+    Users and secrets are stored in parallel tuples:
+        - domains[n], usernames[n] describe a user, a domain of None means "the target's domain"
+        - secrets[n], cred_types[n], data[n] describe a secret (data is e.g. an SSH key)
+
+    The only per target state is the owned bitmap from new_owned(), one byte per user.
+    """
+
+    __slots__ = ("cred_types", "data", "domains", "no_bruteforce", "secrets", "usernames")
+
+    def __init__(self, domains, usernames, secrets, cred_types, data=None, no_bruteforce=False):
+        self.domains = tuple(domains)
+        self.usernames = tuple(usernames)
+        self.secrets = tuple(secrets)
+        self.cred_types = tuple(cred_types)
+        self.data = tuple(data) if data is not None else (None,) * len(self.secrets)
+        self.no_bruteforce = no_bruteforce
+
+    @classmethod
+    def from_args(cls, args, db, logger=nxc_logger):
+        """Build the plan from --cred-id, -u/-p/-H/--aesKey, reading every wordlist exactly once"""
+        domains = []
+        usernames = []
+        secrets = []
+        cred_types = []
+
+        if getattr(args, "cred_id", None):
+            for _, domain, username, secret, cred_type, _ in query_db_creds(args, db, logger):
+                domains.append(domain)
+                usernames.append(username)
+                secrets.append(secret)
+                cred_types.append(cred_type)
+
+        if getattr(args, "username", None):
+            parsed_domains, parsed_usernames, parsed_secrets, parsed_cred_types = parse_credentials(args, logger)
+            # Allow trying multiple users with a single password, only for the lists given on the command line
+            if len(parsed_usernames) > 1 and len(parsed_secrets) == 1:
+                parsed_secrets = parsed_secrets * len(parsed_usernames)
+                parsed_cred_types = parsed_cred_types * len(parsed_usernames)
+                args.no_bruteforce = True
+            domains.extend(parsed_domains)
+            usernames.extend(parsed_usernames)
+            secrets.extend(parsed_secrets)
+            cred_types.extend(parsed_cred_types)
+
+        no_bruteforce = bool(getattr(args, "no_bruteforce", False))
+
+        logger.debug(f"Credential plan: {len(usernames)} user(s), {len(secrets)} secret(s), no_bruteforce={no_bruteforce}")
+        return cls(domains, usernames, secrets, cred_types, no_bruteforce=no_bruteforce)
+
+    def domain(self, user_index, target_domain):
+        domain = self.domains[user_index]
+        return target_domain if domain is None else domain
+
+    def new_owned(self):
+        """Fresh per target bitmap of users for which a valid credential has been found"""
+        return bytearray(len(self.usernames))
+
+    def fingerprint(self):
+        """Identifies the plan in checkpoint journals, which store attempts as indices into it"""
+        digest = sha256(repr((self.domains, self.usernames, self.secrets, self.cred_types, self.no_bruteforce)).encode())
+        return digest.hexdigest()[:16]
+
+    def is_consistent(self):
+        return not self.no_bruteforce or len(self.usernames) == len(self.secrets)
+
+    def attempts(self):
+        """Yield (user_index, secret_index) pairs in the order they should be tried"""
+        if self.no_bruteforce:
+            yield from ((i, i) for i in range(len(self.usernames)))
+        else:
+            for secret_index in range(len(self.secrets)):
+                for user_index in range(len(self.usernames)):
+                    yield user_index, secret_index
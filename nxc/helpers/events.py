@@ -0,0 +1,43 @@
+import json
+from datetime import datetime, timezone
+
+from nxc.console import output
+
+# Structured result stream of the run (--jsonl), None when it is not enabled
+stream = None
+
+
+def render_event(data, tty):
+    return json.dumps(data, default=str)
+
+
+def render_lines(data, tty):
+    return data
+
+
+class EventStream:
+    """Results of a run written as JSON lines to a file
+
+    emit() only builds the event dict and queues it, the output writer thread serializes and writes
+    events in batches alongside the console output.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "a", encoding="utf-8")  # noqa: SIM115
+
+    def emit(self, event, **fields):
+        output.put(self.file, render_event, {"time": datetime.now(timezone.utc).isoformat(), "event": event, **fields})
+
+    def write_lines(self, lines):
+        """Queue already serialized events, the lines written by the workers of a sharded run"""
+        output.put(self.file, render_lines, lines.rstrip("\n"))
+
+    def close(self):
+        output.flush()
+        self.file.close()
+
+
+def emit(event, **fields):
+    if stream is not None:
+        stream.emit(event, **fields)
@@ -0,0 +1,260 @@
+import re
+from argparse import ArgumentTypeError
+from collections import deque
+from ipaddress import ip_network
+from math import inf
+from threading import Lock
+from time import monotonic
+
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+# Attempts of a target held back for throttled users before the target is rescheduled
+MAX_DEFERRED_ATTEMPTS = 64
+
+
+def parse_rate(value):
+    """Parse an attempts rate for argparse: "10" (per second), "10/s", "3/m", "1/30m", "5/1h"
+
+    :return: attempts per second
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*(?:/\s*(\d+(?:\.\d+)?)?\s*([smhd]))?\s*", value.lower())
+    if not match:
+        raise ArgumentTypeError(f"Invalid rate '{value}', expected e.g. 10, 10/s, 3/m or 1/30m")
+    count, period, unit = match.groups()
+    seconds = float(period or 1) * UNITS[unit or "s"]
+    if float(count) <= 0 or seconds <= 0:
+        raise ArgumentTypeError(f"Invalid rate '{value}', must be positive")
+    return float(count) / seconds
+
+
+def subnet_of(host):
+    """/24 of an IPv4 target, /64 of an IPv6 one, hostnames are their own subnet"""
+    try:
+        return str(ip_network(f"{host}/{64 if ':' in host else 24}", strict=False))
+    except ValueError:
+        return host
+
+
+class FailedLogins:
+    """Lockout counters shared by every target of a run.
+
+    Authentication against different targets runs concurrently, only these counters are serialized.
+    With a window (--fail-window) only failures of the last window seconds are counted, matching
+    the "reset account lockout counter after" policy of the domain.
+    With --workers every child process counts on its own and gets its share of the limits (see shard()),
+    so together they stay within them without asking each other.
+    """
+
+    def __init__(self, window=None, index=0, shards=1):
+        self.window = window
+        self.index = index
+        self.shards = shards
+        self.lock = Lock()
+        self.total = 0
+        self.per_user = {}
+        self.events = deque()  # (timestamp, username), only kept with a window
+
+    def expire(self):
+        """Forget failures older than the window. Caller holds the lock."""
+        if self.window is None:
+            return
+        horizon = monotonic() - self.window
+        while self.events and self.events[0][0] <= horizon:
+            _, username = self.events.popleft()
+            self.total -= 1
+            self.per_user[username] -= 1
+            if not self.per_user[username]:
+                del self.per_user[username]
+
+    def increment(self, username):
+        with self.lock:
+            self.expire()
+            self.per_user[username] = self.per_user.get(username, 0) + 1
+            self.total += 1
+            if self.window is not None:
+                self.events.append((monotonic(), username))
+
+    def shard(self, index, shards):
+        """Counters for process index of shards splitting the run"""
+        return FailedLogins(self.window, index, shards)
+
+    def share_of(self, limit):
+        """Part of a limit given to this shard, the remainder goes to the first shards"""
+        if limit is None or self.shards == 1:
+            return limit
+        return limit // self.shards + (self.index < limit % self.shards)
+
+    def over_limit(self, username, gfail_limit, ufail_limit):
+        gfail_limit = self.share_of(gfail_limit)
+        ufail_limit = self.share_of(ufail_limit)
+        # >= since concurrent targets can overshoot a limit between the check and the attempt
+        with self.lock:
+            self.expire()
+            if gfail_limit is not None and self.total >= gfail_limit:
+                return True
+            return ufail_limit is not None and self.per_user.get(username, 0) >= ufail_limit
+
+
+login_failures = FailedLogins()
+
+
+class TokenBucket:
+    __slots__ = ("burst", "rate", "tokens", "updated")
+
+    def __init__(self, rate, burst, now, tokens=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst if tokens is None else tokens
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Seconds until a token is available, 0 if one is available now"""
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Token buckets for authentication attempts: one global, one per username and one per target subnet.
+
+    reserve() never blocks: it either takes a token from every applicable bucket and returns 0,
+    or takes nothing and returns how long the caller has to wait. The caller is free to try
+    another user in the meantime, and waits without holding any lock.
+    With --workers every child process gets its own limiter with its share of the rates (see shard()).
+    """
+
+    def __init__(self, global_rate=None, user_rate=None, subnet_rate=None, burst=1):
+        self.global_rate = global_rate
+        self.user_rate = user_rate
+        self.subnet_rate = subnet_rate
+        self.burst = max(burst, 1)
+        self.initial_tokens = self.burst
+        self.lock = Lock()
+        self.global_bucket = None
+        self.user_buckets = {}
+        self.subnet_buckets = {}
+
+    @classmethod
+    def from_args(cls, args):
+        """None when no rate was requested"""
+        rates = (getattr(args, "rate_global", None), getattr(args, "rate_user", None), getattr(args, "rate_subnet", None))
+        if not any(rates):
+            return None
+        return cls(*rates, burst=getattr(args, "rate_burst", 1))
+
+    def shard(self, shards):
+        """Limiter for one of shards processes splitting the run, each gets its share of every rate and of the initial
+        burst, so the processes stay within the limits together without asking each other for tokens
+        """
+        rates = (rate / shards if rate else None for rate in (self.global_rate, self.user_rate, self.subnet_rate))
+        # A bucket still holds at least one token, a single attempt has to fit
+        limiter = RateLimiter(*rates, burst=self.burst / shards)
+        limiter.initial_tokens = self.burst / shards
+        return limiter
+
+    def buckets(self, username, host, now):
+        """Caller holds the lock"""
+        buckets = []
+        if self.global_rate:
+            if self.global_bucket is None:
+                self.global_bucket = TokenBucket(self.global_rate, self.burst, now, self.initial_tokens)
+            buckets.append(self.global_bucket)
+        if self.user_rate:
+            key = username.lower()
+            if key not in self.user_buckets:
+                self.user_buckets[key] = TokenBucket(self.user_rate, self.burst, now, self.initial_tokens)
+            buckets.append(self.user_buckets[key])
+        if self.subnet_rate:
+            key = subnet_of(host)
+            if key not in self.subnet_buckets:
+                self.subnet_buckets[key] = TokenBucket(self.subnet_rate, self.burst, now, self.initial_tokens)
+            buckets.append(self.subnet_buckets[key])
+        return buckets
+
+    def reserve(self, username, host):
+        with self.lock:
+            now = monotonic()
+            buckets = self.buckets(username, host, now)
+            for bucket in buckets:
+                bucket.refill(now)
+            delay = max((bucket.delay() for bucket in buckets), default=0.0)
+            if delay == 0:
+                for bucket in buckets:
+                    bucket.tokens -= 1
+            return delay
+
+
+class AttemptScheduler:
+    """Login attempts of one target, each one yielded only once the rate limiter granted it.
+
+    Attempts are pulled from their iterator lazily. While a user's (or the subnet's) bucket refills,
+    the attempts of that user wait in a small per-user queue and the attempts of other users are
+    tried, the relative order of the attempts of a single user is kept. Iteration stops when every
+    attempt was yielded, or when every pending one is throttled and no more can be held back:
+    retry_after is then the number of seconds until one is granted, iterating again resumes.
+    """
+
+    def __init__(self, attempts, rate_limiter, usernames, host, max_deferred=MAX_DEFERRED_ATTEMPTS):
+        self.attempts = iter(attempts)
+        self.rate_limiter = rate_limiter
+        self.usernames = usernames
+        self.host = host
+        self.max_deferred = max_deferred
+        self.deferred = {}  # user index -> deque of secret indices, only for throttled users
+        self.deferred_count = 0
+        self.ready_at = inf  # when the first throttled user gets a token again
+        self.exhausted = False
+        self.retry_after = None
+
+    def reserve(self, user_index):
+        return self.rate_limiter.reserve(self.usernames[user_index], self.host)
+
+    def __iter__(self):
+        self.retry_after = None
+        while True:
+            held_back = self.deferred_count
+            if self.deferred and monotonic() >= self.ready_at:
+                yield from self.retry_deferred()
+            if not self.exhausted and self.deferred_count < self.max_deferred:
+                attempt = next(self.attempts, None)
+                if attempt is None:
+                    self.exhausted = True
+                else:
+                    yield from self.schedule(*attempt)
+                continue
+            if not self.deferred:
+                return
+            if self.deferred_count == held_back:
+                self.retry_after = max(self.ready_at - monotonic(), 0)
+                return
+
+    def schedule(self, user_index, secret_index):
+        if user_index not in self.deferred:
+            delay = self.reserve(user_index)
+            if not delay:
+                yield user_index, secret_index
+                return
+            self.deferred[user_index] = deque()
+            self.ready_at = min(self.ready_at, monotonic() + delay)
+        self.deferred[user_index].append(secret_index)
+        self.deferred_count += 1
+
+    def retry_deferred(self):
+        """Yield the next attempt of every throttled user that got a token"""
+        wait = None
+        for user_index in list(self.deferred):
+            delay = self.reserve(user_index)
+            if delay:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            queue = self.deferred[user_index]
+            secret_index = queue.popleft()
+            self.deferred_count -= 1
+            if queue:
+                # The user's next attempt is tried again on the next round
+                wait = 0
+            else:
+                del self.deferred[user_index]
+            yield user_index, secret_index
+        self.ready_at = inf if wait is None else monotonic() + wait
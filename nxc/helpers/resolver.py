@@ -0,0 +1,257 @@
+import asyncio
+import contextlib
+from functools import lru_cache
+from ipaddress import ip_address
+from itertools import islice
+from socket import AF_UNSPEC, SOCK_DGRAM, IPPROTO_IP, AI_CANONNAME, getaddrinfo
+from threading import Event, Lock
+from time import monotonic
+
+from dns import asyncresolver, resolver, rdatatype
+
+from nxc.logger import nxc_logger
+
+# getaddrinfo() does not expose TTLs, so system resolver answers are kept for this long
+DEFAULT_TTL = 300
+# "does not exist" answers are remembered for a shorter time
+NEGATIVE_TTL = 60
+
+
+class DNSCache:
+    """Run wide, thread-safe memo of name resolutions with TTL-aware eviction.
+
+    Failed resolutions are cached as negative entries too, and concurrent lookups of the same
+    name (e.g. every host of a domain resolving the kdcHost) wait for the first one instead of
+    sending their own query.
+    """
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self.entries = {}  # key -> (expires, result, exception)
+        self.in_flight = {}  # key -> Event
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, resolve):
+        """Return the cached answer for key, calling resolve() -> (result, ttl) on a miss.
+
+        resolve() may raise, the exception is cached for NEGATIVE_TTL and re-raised to every caller.
+        """
+        while True:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry and entry[0] > monotonic():
+                    self.hits += 1
+                    return self._unpack(entry)
+                event = self.in_flight.get(key)
+                if event is None:
+                    self.misses += 1
+                    event = self.in_flight[key] = Event()
+                    break
+            event.wait()
+
+        try:
+            result, ttl = resolve()
+            self.put(key, result, ttl)
+            return result
+        except Exception as e:
+            self.put(key, None, NEGATIVE_TTL, e)
+            raise
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+            event.set()
+
+    def put(self, key, result, ttl, exception=None):
+        with self.lock:
+            if len(self.entries) >= self.max_entries:
+                self.evict()
+            self.entries[key] = (monotonic() + ttl, result, exception)
+
+    def evict(self):
+        """Drop expired entries, or the oldest half if everything is still fresh. Caller holds the lock."""
+        now = monotonic()
+        expired = [key for key, entry in self.entries.items() if entry[0] <= now]
+        if not expired:
+            expired = list(islice(self.entries, len(self.entries) // 2))
+        for key in expired:
+            del self.entries[key]
+
+    def __contains__(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            return bool(entry and entry[0] > monotonic())
+
+    @staticmethod
+    def _unpack(entry):
+        _, result, exception = entry
+        if exception is not None:
+            raise exception
+        return result
+
+
+dns_cache = DNSCache()
+
+
+@lru_cache(maxsize=16)
+def get_dns_resolver(dns_server, dns_timeout, use_async=False):
+    """Resolvers parse resolv.conf on creation, so build one per configuration instead of per target"""
+    dnsresolver = asyncresolver.Resolver() if use_async else resolver.Resolver()
+    dnsresolver.timeout = dns_timeout
+    dnsresolver.lifetime = dns_timeout
+    if dns_server:
+        dnsresolver.nameservers = [dns_server]
+    return dnsresolver
+
+
+def build_addr_info(target, address_info, force_ipv6, is_link_local_ipv6):
+    if not (address_info["AF_INET"] or address_info["AF_INET6"]):
+        raise Exception(f"The DNS query name does not exist: {target}")
+
+    result = {
+        "host": "",
+        "is_ipv6": False,
+        "is_link_local_ipv6": is_link_local_ipv6
+    }
+    # IPv4 preferred
+    if address_info["AF_INET"] and not force_ipv6:
+        result["host"] = address_info["AF_INET"]
+    else:
+        result["is_ipv6"] = True
+        result["host"] = address_info["AF_INET6"]
+    return result
+
+
+def system_addr_info(target, force_ipv6, addrinfo):
+    address_info = {"AF_INET6": "", "AF_INET": ""}
+    is_link_local_ipv6 = False
+    canonname = ""
+    for res in addrinfo:
+        af, _, _, canonname, sa = res
+        address_info[af.name] = sa[0]
+
+    if address_info["AF_INET6"] and ip_address(address_info["AF_INET6"]).is_link_local:
+        address_info["AF_INET6"] = canonname
+        is_link_local_ipv6 = True
+    return build_addr_info(target, address_info, force_ipv6, is_link_local_ipv6), DEFAULT_TTL
+
+
+def dns_addr_info(target, force_ipv6, answers_ipv4, answers_ipv6):
+    address_info = {"AF_INET6": "", "AF_INET": ""}
+    is_link_local_ipv6 = False
+    ttls = []
+
+    with contextlib.suppress(Exception):
+        address_info["AF_INET"] = answers_ipv4[0].address
+        ttls.append(answers_ipv4.rrset.ttl)
+
+    with contextlib.suppress(Exception):
+        address_info["AF_INET6"] = answers_ipv6[0].address
+        ttls.append(answers_ipv6.rrset.ttl)
+        if address_info["AF_INET6"] and ip_address(address_info["AF_INET6"]).is_link_local:
+            is_link_local_ipv6 = True
+    return build_addr_info(target, address_info, force_ipv6, is_link_local_ipv6), min(ttls, default=NEGATIVE_TTL)
+
+
+def resolve_addr_info(target, force_ipv6, dns_server, dns_tcp, dns_timeout):
+    """Uncached resolution, returns (result, ttl)"""
+    if not (dns_server or dns_tcp):
+        return system_addr_info(target, force_ipv6, getaddrinfo(target, None, AF_UNSPEC, SOCK_DGRAM, IPPROTO_IP, AI_CANONNAME))
+
+    dnsresolver = get_dns_resolver(dns_server, dns_timeout)
+    answers_ipv4 = answers_ipv6 = None
+    with contextlib.suppress(Exception):
+        answers_ipv4 = dnsresolver.resolve(target, rdatatype.A, raise_on_no_answer=False, tcp=dns_tcp)
+    with contextlib.suppress(Exception):
+        answers_ipv6 = dnsresolver.resolve(target, rdatatype.AAAA, raise_on_no_answer=False, tcp=dns_tcp)
+    return dns_addr_info(target, force_ipv6, answers_ipv4, answers_ipv6)
+
+
+def get_host_addr_info(target, force_ipv6, dns_server, dns_tcp, dns_timeout):
+    try:
+        if ip_address(target).version == 4:
+            return build_addr_info(target, {"AF_INET6": "", "AF_INET": target}, force_ipv6, False)
+        else:
+            return build_addr_info(target, {"AF_INET6": target, "AF_INET": ""}, force_ipv6, False)
+    except ValueError:
+        # If the target is not an IP address, we need to resolve it
+        key = (target.lower(), force_ipv6, dns_server, dns_tcp)
+        return dns_cache.get(key, lambda: resolve_addr_info(target, force_ipv6, dns_server, dns_tcp, dns_timeout))
+
+
+async def async_addr_info(target, force_ipv6, dns_server, dns_tcp, dns_timeout):
+    if not (dns_server or dns_tcp):
+        loop = asyncio.get_running_loop()
+        return system_addr_info(target, force_ipv6, await loop.getaddrinfo(target, None, family=AF_UNSPEC, type=SOCK_DGRAM, proto=IPPROTO_IP, flags=AI_CANONNAME))
+
+    dnsresolver = get_dns_resolver(dns_server, dns_timeout, use_async=True)
+    # A and AAAA are pipelined instead of being sent one after the other
+    answers_ipv4, answers_ipv6 = await asyncio.gather(
+        dnsresolver.resolve(target, rdatatype.A, raise_on_no_answer=False, tcp=dns_tcp),
+        dnsresolver.resolve(target, rdatatype.AAAA, raise_on_no_answer=False, tcp=dns_tcp),
+        return_exceptions=True,
+    )
+    return dns_addr_info(target, force_ipv6, answers_ipv4, answers_ipv6)
+
+
+async def prefetch_addr_info(targets, force_ipv6, dns_server, dns_tcp, dns_timeout):
+    """Resolve a batch of hostnames concurrently and store the answers (or failures) in the run wide cache"""
+    async def prefetch(target):
+        key = (target.lower(), force_ipv6, dns_server, dns_tcp)
+        if key in dns_cache:
+            return
+        try:
+            result, ttl = await async_addr_info(target, force_ipv6, dns_server, dns_tcp, dns_timeout)
+            dns_cache.put(key, result, ttl)
+        except Exception as e:
+            dns_cache.put(key, None, NEGATIVE_TTL, e)
+
+    await asyncio.gather(*(prefetch(target) for target in targets))
+
+
+def is_hostname(target):
+    try:
+        ip_address(target)
+        return False
+    except ValueError:
+        return True
+
+
+class DNSPrefetch:
+    """Resolves the hostnames of a target stream in batches, ahead of the workers that connect to them
+
+    Iterated from a thread, every batch is resolved on its own event loop. Iterated with async for
+    (from inside a running loop, e.g. by the liveness sweep), batches are awaited on that loop.
+    """
+
+    def __init__(self, targets, args, batch_size=256):
+        self.targets = targets
+        self.args = args
+        self.batch_size = batch_size
+
+    def total(self):
+        return self.targets.total()
+
+    def batches(self):
+        """Batches of targets with the set of hostnames to resolve in each"""
+        iterator = iter(self.targets)
+        while batch := list(islice(iterator, self.batch_size)):
+            yield batch, {target for target in batch if is_hostname(target)}
+
+    async def prefetch(self, hostnames):
+        nxc_logger.debug(f"Prefetching DNS for {len(hostnames)} hostname(s)")
+        await prefetch_addr_info(hostnames, self.args.force_ipv6, self.args.dns_server, self.args.dns_tcp, self.args.dns_timeout)
+
+    def __iter__(self):
+        for batch, hostnames in self.batches():
+            if hostnames:
+                asyncio.run(self.prefetch(hostnames))
+            yield from batch
+
+    async def __aiter__(self):
+        for batch, hostnames in self.batches():
+            if hostnames:
+                await self.prefetch(hostnames)
+            for target in batch:
+                yield target
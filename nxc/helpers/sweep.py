@@ -0,0 +1,121 @@
+import asyncio
+import contextlib
+import queue
+import threading
+
+from nxc.logger import nxc_logger
+from nxc.parsers.nmap import protocol_dict
+
+
+async def iterate(targets):
+    """Targets of a stream with or without an async path, streams resolving names (DNSPrefetch) must not start a loop of their own"""
+    if hasattr(targets, "__aiter__"):
+        async for target in targets:
+            yield target
+    else:
+        for target in targets:
+            yield target
+
+
+def sweep_ports(args):
+    """Ports to probe for the selected protocol, an explicit --port wins over the protocol defaults"""
+    if getattr(args, "port", None):
+        return [args.port]
+    return protocol_dict.get(args.protocol, {}).get("ports", [])
+
+
+class LivenessSweep:
+    """Filters a target stream down to hosts accepting a TCP connection on one of the given ports.
+
+    An asyncio loop in a background thread fires non-blocking connects with up to ``concurrency``
+    hosts probed at once, all ports of a host together, and hands responsive hosts to the thread
+    pool through a bounded queue. Dead hosts never get a protocol object, so they don't tie up a
+    worker for the protocol timeout. A consumer that stops iterating early stops the sweep.
+    """
+
+    _done = object()
+
+    def __init__(self, targets, ports, timeout=1.0, concurrency=1000):
+        self.targets = targets
+        self.ports = ports
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.dead = 0
+
+    def total(self):
+        return max(self.targets.total() - self.dead, 0)
+
+    def __iter__(self):
+        alive = queue.Queue(maxsize=self.concurrency)
+        stopped = threading.Event()
+        thread = threading.Thread(target=asyncio.run, args=(self._sweep(alive, stopped),), name="nxc-sweep", daemon=True)
+        thread.start()
+        try:
+            while (host := alive.get()) is not self._done:
+                yield host
+        finally:
+            stopped.set()
+        nxc_logger.debug(f"Liveness sweep finished, {self.dead} host(s) did not respond on port(s) {self.ports}")
+
+    @staticmethod
+    def _put(alive, item, stopped):
+        """Blocking put that gives up once the consumer stopped iterating, returns whether the item was queued"""
+        while not stopped.is_set():
+            try:
+                alive.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    async def _sweep(self, alive, stopped):
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pending = set()
+        try:
+            async for target in iterate(self.targets):
+                await semaphore.acquire()
+                if stopped.is_set():
+                    break
+                task = asyncio.create_task(self._probe(target, semaphore, alive, stopped))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending)
+        except Exception as e:
+            nxc_logger.exception(f"Error during liveness sweep: {e}")
+        finally:
+            # Blocking puts run in the executor so a slow consumer applies backpressure without stalling the loop
+            await loop.run_in_executor(None, self._put, alive, self._done, stopped)
+
+    async def _probe(self, target, semaphore, alive, stopped):
+        try:
+            if await self._answers(target):
+                await asyncio.get_running_loop().run_in_executor(None, self._put, alive, target, stopped)
+            else:
+                self.dead += 1
+        finally:
+            semaphore.release()
+
+    async def _answers(self, host):
+        """Connect to every port at once, True as soon as one accepts, the other connects are cancelled"""
+        pending = {asyncio.create_task(self._connect(host, port)) for port in self.ports}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if any(task.result() for task in done):
+                    return True
+            return False
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _connect(self, host, port):
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), self.timeout)
+        except (OSError, asyncio.TimeoutError):
+            return False
+        writer.close()
+        with contextlib.suppress(Exception):
+            await writer.wait_closed()
+        return True
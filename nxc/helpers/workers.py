@@ -0,0 +1,388 @@
+import multiprocessing
+import queue
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import count
+from threading import Event, Lock, Thread
+
+from rich.progress import Progress
+
+from nxc import console
+from nxc.database import WriteBehind
+from nxc.helpers import events, ratelimit
+from nxc.logger import nxc_logger
+
+# Parent threads answering the database calls of the workers
+CALL_THREADS = 8
+# Checkpoint journal methods a worker sends to the parent without waiting
+CHECKPOINT_WRITES = ("attempt_failed", "target_done", "target_unfinished")
+
+
+def sharding_supported():
+    """Workers are forked so they inherit the loaded protocol, credential plan and modules without pickling them"""
+    return "fork" in multiprocessing.get_all_start_methods()
+
+
+class QueueWriter:
+    """File object for the workers' stdout/stderr, every write is printed by the parent"""
+
+    def __init__(self, results, is_terminal, kind="output"):
+        self.results = results
+        self.is_terminal = is_terminal
+        self.kind = kind
+
+    def write(self, text):
+        if text:
+            self.results.put((self.kind, text))
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return self.is_terminal
+
+
+class ParentChannel:
+    """Messages from a worker to the parent, over the shared results queue.
+
+    call() blocks its thread until the parent answered, the answers come back on the worker's reply pipe
+    in any order and are handed to the waiting threads by a reader thread, so calls of several threads
+    are in flight together. send() does not wait. The messages of a worker are handled in the order
+    they were sent, a call sees the writes sent before it.
+    """
+
+    def __init__(self, worker_id, results, replies):
+        self.worker_id = worker_id
+        self.results = results
+        self.replies = replies
+        self.call_ids = count()
+        self.waiting = {}  # call id -> (Event, [reply])
+        self.lock = Lock()
+        self.closed = False
+        Thread(target=self.receive, name="nxc-replies", daemon=True).start()
+
+    def send(self, *message):
+        self.results.put(message)
+
+    def call(self, name, method, args, kwargs):
+        done, reply = Event(), []
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("The parent process exited")
+            call_id = next(self.call_ids)
+            self.waiting[call_id] = (done, reply)
+        self.send("call", self.worker_id, call_id, name, method, args, kwargs)
+        done.wait()
+        ok, value = reply[0]
+        if not ok:
+            raise value
+        return value
+
+    def receive(self):
+        while True:
+            try:
+                call_id, ok, value = self.replies.recv()
+            except (EOFError, OSError):
+                break
+            with self.lock:
+                done, reply = self.waiting.pop(call_id)
+            reply.append((ok, value))
+            done.set()
+        with self.lock:
+            self.closed = True
+            waiting, self.waiting = self.waiting, {}
+        for done, reply in waiting.values():
+            reply.append((False, RuntimeError("The parent process exited")))
+            done.set()
+
+
+class RemoteObject:
+    """Stand-in for an object living in the parent process, method calls are forwarded and block until answered"""
+
+    def __init__(self, name, channel):
+        self._name = name
+        self._channel = channel
+
+    def __getattr__(self, method):
+        def call(*args, **kwargs):
+            return self._channel.call(self._name, method, args, kwargs)
+
+        return call
+
+
+class ForwardedWrites:
+    """Copy of a parent object inherited through fork: its write methods are sent to the parent without
+    waiting, everything else is answered by the copy
+    """
+
+    def __init__(self, local, name, writes, channel):
+        self._local = local
+        self._name = name
+        self._writes = writes
+        self._channel = channel
+
+    def __getattr__(self, attribute):
+        if attribute not in self._writes:
+            return getattr(self._local, attribute)
+
+        def write(*args, **kwargs):
+            self._channel.send("write", self._name, attribute, args, kwargs)
+
+        return write
+
+
+class ShippedWrites(WriteBehind):
+    """WriteBehind of a worker: calls are coalesced and batched in the worker like rows, each batch is sent
+    to the parent without waiting, which makes the calls again in a single transaction
+    """
+
+    def __init__(self, db, channel):
+        self.channel = channel
+        super().__init__(db)
+
+    def write(self, pending):
+        self.channel.send("batch", {method: list(calls.values()) for method, calls in pending.items()})
+
+
+class WorkerDatabase(RemoteObject):
+    """The parent's protocol database as seen by a worker.
+
+    Calls are forwarded to the parent and answered there. Inside batched_writes() the batched_calls of the
+    database (e.g. add_credential) are queued in a local ShippedWrites instead and return None, like they
+    do in the parent.
+    """
+
+    def __init__(self, db, channel):
+        super().__init__("db", channel)
+        self.protocol = db.protocol
+        self.batched_calls = type(db).batched_calls
+        self.writer = None
+        self.writer_users = 0
+        self.writer_lock = Lock()
+
+    @contextmanager
+    def batched_writes(self):
+        with self.writer_lock:
+            if self.writer is None:
+                self.writer = ShippedWrites(self, self._channel)
+            self.writer_users += 1
+        try:
+            yield
+        finally:
+            with self.writer_lock:
+                self.writer_users -= 1
+                writer = self.writer
+                last = not self.writer_users
+                if last:
+                    self.writer = None
+            if last:
+                writer.close()
+            else:
+                writer.flush()
+
+    def flush(self):
+        writer = self.writer
+        if writer is not None:
+            writer.flush()
+
+    def __getattr__(self, method):
+        call = super().__getattr__(method)
+
+        def forward(*args, **kwargs):
+            writer = self.writer
+            if writer is not None:
+                if method in self.batched_calls and writer.submit(method, repr((args, sorted(kwargs.items()))), {"args": args, "kwargs": kwargs}):
+                    return None
+                # The parent answers once the calls queued before this one are written
+                writer.flush()
+            return call(*args, **kwargs)
+
+        return forward
+
+
+def worker_main(worker_id, shards, protocol_obj, args, db, tasks, results, replies, is_terminal):
+    from nxc.netexec import run_targets
+
+    sys.stdout = sys.stderr = QueueWriter(results, is_terminal)
+    console.nxc_console = console.make_console(sys.stdout)
+    if events.stream is not None:
+        # Events are written to the --jsonl file by the parent
+        events.stream.file = QueueWriter(results, False, kind="events")
+
+    channel = ParentChannel(worker_id, results, replies)
+    # Each worker gets its share of the lockout and rate limits, a login attempt never waits on the parent
+    ratelimit.login_failures = ratelimit.login_failures.shard(worker_id, shards)
+    if protocol_obj.rate_limiter is not None:
+        protocol_obj.rate_limiter = protocol_obj.rate_limiter.shard(shards)
+    if protocol_obj.checkpoint is not None:
+        # Lookups are answered by the journal the parent loaded before forking, records are written by the parent
+        protocol_obj.checkpoint = ForwardedWrites(protocol_obj.checkpoint, "checkpoint", CHECKPOINT_WRITES, channel)
+    # The database is owned by the parent, its engine and connections inherited by fork are never touched
+    db = WorkerDatabase(db, channel) if db is not None else None
+    if protocol_obj.module_registry is not None:
+        protocol_obj.module_registry.db = db
+        protocol_obj.module_registry.context.db = db
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            run_targets(executor, protocol_obj, args, db, iter(tasks.get, None), on_finished=lambda count: results.put(("finished", count)), window=protocol_obj.adaptive_window)
+    except Exception:
+        nxc_logger.exception(f"Worker {worker_id} failed")
+    finally:
+        console.output.flush()
+        results.put(("exit", worker_id))
+
+
+class ShardedRun:
+    """Runs the targets of a scan across several processes, each with its own --threads pool.
+
+    The parent streams targets into a bounded task queue, so shards balance themselves: an idle
+    worker simply pulls the next target. Lockout counters and rate limits are split between the
+    workers, which need no round trip per login attempt. Console output, progress, checkpoint
+    records and batched database writes flow back over a single results queue without waiting,
+    database calls needing an answer are answered by a small pool of parent threads.
+    """
+
+    def __init__(self, protocol_obj, args, db, workers):
+        self.protocol_obj = protocol_obj
+        self.args = args
+        self.db = db
+        self.workers = workers
+        self.mp = multiprocessing.get_context("fork")
+        self.tasks = self.mp.Queue(maxsize=max(args.threads, 1) * 2 * workers)
+        self.results = self.mp.Queue()
+        self.shared = {"checkpoint": protocol_obj.checkpoint, "db": db}
+        self.processes = []
+        self.reply_pipes = []
+        self.reply_locks = []
+        self.calls = None
+        self.on_finished = None
+
+    def start(self):
+        is_terminal = sys.stdout.isatty()
+        for worker_id in range(self.workers):
+            receiver, sender = self.mp.Pipe(duplex=False)
+            process = self.mp.Process(
+                target=worker_main,
+                args=(worker_id, self.workers, self.protocol_obj, self.args, self.db, self.tasks, self.results, receiver, is_terminal),
+                daemon=True,
+            )
+            process.start()
+            receiver.close()
+            self.processes.append(process)
+            self.reply_pipes.append(sender)
+            self.reply_locks.append(Lock())
+        nxc_logger.debug(f"Started {self.workers} worker processes with {self.args.threads} threads each")
+
+    def put(self, item):
+        """Blocking put that gives up once no worker is left to drain the queue"""
+        while True:
+            try:
+                self.tasks.put(item, timeout=1)
+                return True
+            except queue.Full:
+                if not any(process.is_alive() for process in self.processes):
+                    return False
+
+    def feed(self, targets):
+        for target in targets:
+            if not self.put(target):
+                nxc_logger.error("All worker processes exited, stopping the scan")
+                return
+        for _ in self.processes:
+            self.put(None)
+
+    def collect(self):
+        """Handle worker messages until every worker has exited"""
+        running = set(range(self.workers))
+        while running:
+            try:
+                message = self.results.get(timeout=1)
+            except queue.Empty:
+                running = {worker_id for worker_id in running if self.processes[worker_id].is_alive()}
+                continue
+
+            kind = message[0]
+            if kind == "output":
+                sys.stdout.write(message[1])
+            elif kind == "events":
+                events.stream.write_lines(message[1])
+            elif kind == "call":
+                self.calls.submit(self.answer, *message[1:])
+            elif kind == "write":
+                self.write(*message[1:])
+            elif kind == "batch":
+                self.write_batch(message[1])
+            elif kind == "finished" and self.on_finished:
+                self.on_finished(message[1])
+            elif kind == "exit":
+                running.discard(message[1])
+
+    def answer(self, worker_id, call_id, name, method, args, kwargs):
+        try:
+            reply = (call_id, True, getattr(self.shared[name], method)(*args, **kwargs))
+        except Exception as e:
+            reply = (call_id, False, e)
+        with self.reply_locks[worker_id]:
+            try:
+                self.reply_pipes[worker_id].send(reply)
+            except (EOFError, OSError):
+                nxc_logger.debug(f"Worker {worker_id} exited before the answer to {name}.{method}")
+            except Exception as e:
+                # Unpicklable results (or exceptions) still have to unblock the worker
+                self.reply_pipes[worker_id].send((call_id, False, RuntimeError(f"{name}.{method}: {e}")))
+
+    def write(self, name, method, args, kwargs):
+        """Handled in message order by the collector, before any later call of the worker"""
+        try:
+            getattr(self.shared[name], method)(*args, **kwargs)
+        except Exception as e:
+            nxc_logger.fail(f"Error in {name}.{method} of a worker: {e}")
+
+    def write_batch(self, calls):
+        try:
+            with self.db.transaction():
+                for method, rows in calls.items():
+                    for row in rows:
+                        getattr(self.db, method)(*row["args"], **row["kwargs"])
+        except Exception as e:
+            nxc_logger.fail(f"Error writing a batch of a worker to the {self.db.protocol} database: {e}")
+            nxc_logger.debug("Batched write failed", exc_info=True)
+
+    def run(self, targets, on_finished=None):
+        self.on_finished = on_finished
+        self.calls = ThreadPoolExecutor(max_workers=CALL_THREADS)
+        collector = Thread(target=self.collect, daemon=True)
+        collector.start()
+        try:
+            self.feed(targets)
+            collector.join()
+        finally:
+            self.calls.shutdown()
+            for process in self.processes:
+                process.join(timeout=1)
+                if process.is_alive():
+                    process.terminate()
+
+
+def start_sharded_run(protocol_obj, args, db, targets):
+    sharded = ShardedRun(protocol_obj, args, db, args.workers)
+    # Fork before the parent starts any thread: the output writer is stopped (and started again on its next line),
+    # the progress bar, DNS prefetching, the liveness sweep and the checkpoint flusher only start after
+    console.output.stop()
+    sharded.start()
+    if args.no_progress or targets.total() == 1:
+        sharded.run(targets)
+    else:
+        with Progress(console=console.nxc_console) as progress:
+            task = progress.add_task(
+                f"[green]Running nxc against ~{targets.total()} target(s) with {args.workers} workers",
+                total=targets.total(),
+            )
+
+            def advance(count):
+                progress.update(task, advance=count, total=targets.total())
+
+            sharded.run(targets, on_finished=advance)
@@ -1,14 +1,141 @@
+import ast
+import copy
+import json
+import os
 import sys
 import traceback
 import importlib
+from hashlib import sha256
 from types import ModuleType
 
 from importlib import import_module
 from importlib.resources import files
+from importlib.util import module_from_spec, spec_from_file_location
 
 from nxc.context import Context
 from nxc.helpers.misc import CATEGORY
 from nxc.logger import NXCAdapter
+from nxc.paths import NXC_PATH
+
+MODULE_INDEX_PATH = os.path.join(NXC_PATH, "modules_index.json")
+MODULE_INDEX_VERSION = 1
+USER_MODULES_PATH = os.path.join(NXC_PATH, "modules")
+# Class attributes of NXCModule read from the source, the category is stored by name
+MODULE_ATTRIBUTES = ("name", "description", "supported_protocols", "category")
+
+
+def module_name(module_path):
+    """Name of a module from its import path (nxc.modules.x) or its file path (~/.nxc/modules/x.py)"""
+    if module_path.endswith(".py"):
+        return os.path.basename(module_path)[:-3]
+    return module_path.split(".")[-1]
+
+
+def parse_module_info(source, name):
+    """Metadata of a module read from its source without executing it
+
+    Returns None when the NXCModule class does not declare its metadata as plain literals, the
+    module then has to be imported to be read (and sanity checked).
+    """
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and node.name == "NXCModule":
+            break
+    else:
+        return None
+
+    info = {}
+    methods = {}
+    for item in node.body:
+        if isinstance(item, ast.Assign) and len(item.targets) == 1 and isinstance(item.targets[0], ast.Name):
+            attribute, value = item.targets[0].id, item.value
+            if attribute == "category":
+                if isinstance(value, ast.Attribute) and isinstance(value.value, ast.Name) and value.value.id == "CATEGORY":
+                    info["category"] = value.attr
+            elif attribute in MODULE_ATTRIBUTES:
+                try:
+                    info[attribute] = ast.literal_eval(value)
+                except ValueError:
+                    return None
+        elif isinstance(item, ast.FunctionDef):
+            methods[item.name] = item
+
+    if (
+        any(attribute not in info for attribute in MODULE_ATTRIBUTES)
+        or info["name"] != name
+        or info["category"] not in CATEGORY.__members__
+        or "options" not in methods
+        or not ("on_login" in methods or "on_admin_login" in methods)
+    ):
+        return None
+
+    del info["name"]
+    return {
+        **info,
+        "options": ast.get_docstring(methods["options"], clean=False),
+        "requires_admin": "on_admin_login" in methods,
+    }
+
+
+class ModuleIndex:
+    """Metadata of every module persisted in ~/.nxc/modules_index.json
+
+    An entry is reused while the size and mtime of its file are unchanged. Otherwise the file is
+    hashed, and only parsed again when its content actually changed (a checkout or a copy touches
+    the mtime of every module).
+    """
+
+    def __init__(self, path=MODULE_INDEX_PATH):
+        self.path = path
+        self.entries = self.read()
+        self.dirty = False
+
+    def read(self):
+        try:
+            with open(self.path) as index_file:
+                index = json.load(index_file)
+        except (OSError, ValueError):
+            return {}
+        return index.get("modules", {}) if index.get("version") == MODULE_INDEX_VERSION else {}
+
+    def get(self, file_path, read_info):
+        """Cached metadata of a module file, read_info(source) is only called when the file changed"""
+        stat = os.stat(file_path)
+        entry = self.entries.get(file_path)
+        if entry and (entry["mtime"], entry["size"]) == (stat.st_mtime_ns, stat.st_size):
+            return entry["info"]
+
+        with open(file_path, "rb") as module_file:
+            source = module_file.read()
+        digest = sha256(source).hexdigest()
+        if not entry or entry["sha256"] != digest:
+            info = read_info(source)
+            if info is None:
+                return None
+            entry = {"sha256": digest, "info": info}
+
+        self.entries[file_path] = {**entry, "mtime": stat.st_mtime_ns, "size": stat.st_size}
+        self.dirty = True
+        return entry["info"]
+
+    def save(self, file_paths):
+        """Write the index if it changed, dropping the entries of deleted modules"""
+        stale = set(self.entries) - set(file_paths)
+        if not (self.dirty or stale):
+            return
+        for file_path in stale:
+            del self.entries[file_path]
+
+        # Written to a temporary file first, concurrent runs never read a partial index
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as index_file:
+            json.dump({"version": MODULE_INDEX_VERSION, "modules": self.entries}, index_file)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
 
 
 class ModuleLoader:
@@ -65,12 +192,21 @@ class ModuleLoader:
     # ---------------------------------------------------------
     # Load module safely (IMPORT-BASED)
     # ---------------------------------------------------------
+    def import_module(self, module_path: str):
+        """Import a module by name, or from its file for the user modules of ~/.nxc/modules"""
+        if module_path.endswith(".py"):
+            spec = spec_from_file_location(f"nxc_user_modules.{module_name(module_path)}", module_path)
+            mod = module_from_spec(spec)
+            spec.loader.exec_module(mod)
+            return mod
+        return import_module(module_path)
+
     def load_module(self, module_import_path: str):
         try:
-            mod = import_module(module_import_path)
+            mod = self.import_module(module_import_path)
             module = mod.NXCModule()
 
-            name = module_import_path.split(".")[-1]
+            name = module_name(module_import_path)
             if self.module_is_sane(module, name):
                 return module
 
@@ -85,7 +221,7 @@ class ModuleLoader:
     # ---------------------------------------------------------
     # Initialize module for execution
     # ---------------------------------------------------------
-    def init_module(self, module_import_path: str):
+    def init_module(self, module_import_path: str, context=None):
         module = self.load_module(module_import_path)
         if not module:
             return None
@@ -100,10 +236,11 @@ class ModuleLoader:
             sys.exit(1)
 
         try:
-            module_logger = NXCAdapter(
-                extra={"module_name": module.name.upper()}
-            )
-            context = Context(self.db, module_logger, self.args)
+            if context is None:
+                module_logger = NXCAdapter(
+                    extra={"module_name": module.name.upper()}
+                )
+                context = Context(self.db, module_logger, self.args)
 
             module_options = {}
             for opt in self.args.module_options:
@@ -126,10 +263,10 @@ class ModuleLoader:
     # ---------------------------------------------------------
     def get_module_info(self, module_import_path: str):
         try:
-            mod = import_module(module_import_path)
+            mod = self.import_module(module_import_path)
             cls = mod.NXCModule
 
-            name = module_import_path.split(".")[-1]
+            name = module_name(module_import_path)
             if not self.module_is_sane(cls, name):
                 return None
 
@@ -156,29 +293,97 @@ class ModuleLoader:
         return None
 
     # ---------------------------------------------------------
-    # List modules (EMBEDDED SAFE)
+    # List modules (EMBEDDED SAFE, NO IMPORT)
     # ---------------------------------------------------------
-    def list_modules(self):
+    def module_files(self):
+        """(import path, file path) of the bundled modules, then of the user modules which override them"""
+        for file in sorted(files("nxc.modules").iterdir(), key=lambda file: file.name):
+            if file.name.endswith(".py") and file.name not in ("__init__.py", "example_module.py"):
+                yield f"nxc.modules.{file.name[:-3]}", str(file)
+
+        if os.path.isdir(USER_MODULES_PATH):
+            for file_name in sorted(os.listdir(USER_MODULES_PATH)):
+                if file_name.endswith(".py"):
+                    file_path = os.path.join(USER_MODULES_PATH, file_name)
+                    yield file_path, file_path
+
+    def read_module_info(self, module_path, source):
+        """Metadata of a changed module file, parsed from its source or imported when that is not possible"""
+        name = module_name(module_path)
+        info = parse_module_info(source, name)
+        if info is None:
+            self.logger.debug(f"Module {name} metadata is not static, importing it")
+            info = self.get_module_info(module_path)
+            if info is None:
+                return None
+            info = {key: value for key, value in info[name].items() if key != "path"}
+            info["category"] = info["category"].name
+        return info
+
+    def list_modules(self, index=None):
+        """Metadata of all modules answered from the module index, only new or changed modules are read"""
         modules = {}
+        index = ModuleIndex() if index is None else index
+        file_paths = []
 
         try:
-            pkg = files("nxc.modules")
-
-            for file in pkg.iterdir():
-                if not file.name.endswith(".py"):
-                    continue
-                if file.name == "example_module.py":
-                    continue
-
-                name = file.name[:-3]
-                import_path = f"nxc.modules.{name}"
-
-                info = self.get_module_info(import_path)
+            for module_path, file_path in self.module_files():
+                file_paths.append(file_path)
+                info = index.get(file_path, lambda source, module_path=module_path: self.read_module_info(module_path, source))
                 if info:
-                    modules.update(info)
+                    modules[module_name(module_path)] = {**info, "path": module_path, "category": CATEGORY[info["category"]]}
 
         except Exception as e:
             self.logger.debug(f"Module discovery failed: {e}")
             self.logger.debug(traceback.format_exc())
 
+        try:
+            index.save(file_paths)
+        except OSError as e:
+            self.logger.debug(f"Could not write the module index {index.path}: {e}")
+
         return modules
+
+
+class ModuleRegistry:
+    """Run level registry of the modules selected with -M
+
+    Every module is imported, sanity checked and has its options() parsed exactly once per run.
+    Targets then get a deep copy of the initialized module, so per target state set in on_login
+    does not leak between hosts, and a shallow copy of a shared base Context.
+    """
+
+    def __init__(self, args, db, logger):
+        self.args = args
+        self.db = db
+        self.logger = logger
+        self.loader = ModuleLoader(args, db, logger)
+        self.context = Context(db, logger, args)
+        self.modules = []
+        # Objects shared by the whole run which must never be copied into per target modules
+        self._shared = {id(obj): obj for obj in (args, db, logger, self.context, self.context.conf)}
+
+    def load(self, module_paths):
+        for module_path in module_paths:
+            context = self.new_context(NXCAdapter(extra={"module_name": module_path.split(".")[-1].upper()}))
+            self._shared[id(context)] = context
+            module = self.loader.init_module(module_path, context=context)
+            if module:
+                self.modules.append((module_path, module))
+
+    def new_context(self, logger, localip=None):
+        context = copy.copy(self.context)
+        context.log = logger
+        context.localip = localip
+        return context
+
+    def modules_for_target(self):
+        modules = []
+        for module_path, module in self.modules:
+            try:
+                modules.append(copy.deepcopy(module, dict(self._shared)))
+            except Exception as e:
+                # Modules holding uncopyable state (sockets, locks, ...) are initialized again for each target
+                self.logger.debug(f"Could not copy module {module.name}, initializing it again: {e}")
+                modules.append(self.loader.init_module(module_path))
+        return [module for module in modules if module]
@@ -1,49 +1,59 @@
-import pkgutil
 import importlib
-import nxc.protocols
+from importlib.machinery import SourceFileLoader
+from os import listdir
+from os.path import dirname, exists
+from os.path import join as path_join
+from types import ModuleType
 
+import nxc.protocols
 
-class ProtocolLoader:
-    def get_protocols(self):
-        protocols = {}
-        pkg_path = nxc.protocols.__path__
+PROTOCOLS_PATH = dirname(nxc.protocols.__file__)
 
-        for module_info in pkgutil.iter_modules(pkg_path):
-            # 🔴 CRITICAL FIX: only protocol PACKAGES (smb/, ldap/, etc)
-            if not module_info.ispkg:
-                continue
+# Optional modules in the package next to a protocol implementation (smb.py -> smb/database.py, ...)
+PROTOCOL_MODULES = {
+    "dbpath": "database",
+    "nvpath": "db_navigator",
+    "argspath": "proto_args",
+}
 
-            name = module_info.name
-            base = f"nxc.protocols.{name}"
 
-            try:
-                importlib.import_module(base)
-            except Exception:
-                continue
+def build_manifest(protocols_path=PROTOCOLS_PATH):
+    """Protocols found in the files of nxc/protocols, without importing any of them"""
+    protocols = {}
+    for file_name in sorted(listdir(protocols_path)):
+        name, extension = file_name[:-3], file_name[-3:]
+        if extension != ".py" or name == "__init__":
+            continue
 
-            proto = {"path": base}
+        proto = {"path": path_join(protocols_path, file_name)}
+        for key, module in PROTOCOL_MODULES.items():
+            if exists(path_join(protocols_path, name, f"{module}.py")):
+                proto[key] = f"nxc.protocols.{name}.{module}"
+        protocols[name] = proto
+    return protocols
 
-            try:
-                importlib.import_module(f"{base}.database")
-                proto["dbpath"] = f"{base}.database"
-            except Exception:
-                pass
 
-            try:
-                importlib.import_module(f"{base}.db_navigator")
-                proto["nvpath"] = f"{base}.db_navigator"
-            except Exception:
-                pass
+class ProtocolLoader:
+    """Static manifest of the protocols, built from the file layout once per process.
 
-            try:
-                importlib.import_module(f"{base}.proto_args")
-                proto["argspath"] = f"{base}.proto_args"
-            except Exception:
-                pass
+    Listing protocols, registering their arguments or checking their databases never imports a
+    protocol, load_protocol() imports one module on demand. The implementations (impacket,
+    paramiko, pypsrp...) are only imported for the protocol that is actually run.
+    """
 
-            protocols[name] = proto
+    manifest = None
 
-        return protocols
+    def get_protocols(self):
+        if ProtocolLoader.manifest is None:
+            ProtocolLoader.manifest = build_manifest()
+        return {name: dict(proto) for name, proto in ProtocolLoader.manifest.items()}
 
     def load_protocol(self, module_path):
+        """Import a module of the manifest: the implementation by file path, its database/navigator/args modules by name"""
+        if module_path.endswith(".py"):
+            # The implementation shares its name with the package next to it, so it is loaded from its file
+            loader = SourceFileLoader("protocol", module_path)
+            protocol = ModuleType(loader.name)
+            loader.exec_module(protocol)
+            return protocol
         return importlib.import_module(module_path)
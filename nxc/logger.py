@@ -3,7 +3,8 @@ from logging import LogRecord
 from logging.handlers import RotatingFileHandler
 import os.path
 import sys
-from nxc.console import nxc_console
+from nxc.console import nxc_console, output
+from nxc.helpers import events
 from nxc.paths import NXC_PATH
 from termcolor import colored
 from datetime import datetime
@@ -75,10 +76,50 @@ def no_debug(func):
             formatted_text = Text.from_ansi(self.format(msg, *args, **kwargs)[0])
             caller_frame = inspect.currentframe().f_back
             create_temp_logger(caller_frame, formatted_text, args, kwargs)
-            self.log_console_to_file(formatted_text, *args, **kwargs)
+            self.log_console_to_file(formatted_text, caller_frame, *args, **kwargs)
     return wrapper
 
 
+def plain(text, *args, **kwargs):
+    """Stand-in for termcolor.colored when rendering for a sink which is not a TTY"""
+    return text
+
+
+def format_line(extra, msg, color=colored):
+    """Line of a NXCAdapter with the given extra, prefixed with the protocol or module columns"""
+    if extra is None:
+        return f"{msg}"
+
+    module_name = extra.get("module_name")
+    if module_name is not None and len(module_name) > 11:
+        module_name = module_name[:8] + "..."
+
+    # If the logger is being called when hooking the 'options' module function
+    if len(extra) == 1 and module_name is not None:
+        return f"{color(module_name, 'cyan', attrs=['bold']):<64} {msg}"
+
+    # If the logger is being called from a protocol
+    module_name = color(module_name, "cyan", attrs=["bold"]) if module_name is not None else color(extra["protocol"], "blue", attrs=["bold"])
+
+    return f"{module_name:<24} {extra['host']:<15} {extra['port']:<6} {extra['hostname'] if extra['hostname'] else 'NONE':<16} {msg}"
+
+
+def event_columns(extra):
+    """Columns of a NXCAdapter's extra (protocol or module, host, port, hostname) as event fields"""
+    if not extra:
+        return {}
+    columns = {"protocol": extra.get("protocol"), "module": extra.get("module_name"), "host": extra.get("host"), "port": extra.get("port"), "hostname": extra.get("hostname")}
+    return {key: value.lower() if key in ("protocol", "module") else value for key, value in columns.items() if value is not None}
+
+
+def render_line(data, tty):
+    """Render a queued display/success/highlight/fail line, with colors only for a TTY"""
+    extra, marker, color, msg = data
+    colorize = colored if tty else plain
+    msg = f"{colorize(marker, color, attrs=['bold'])} {msg}" if marker else colorize(msg, color, attrs=["bold"])
+    return format_line(extra, msg, colorize)
+
+
 class NXCAdapter(logging.LoggerAdapter):
     def __init__(self, extra=None, merge_extra=False):
         logging.basicConfig(
@@ -113,60 +154,70 @@ class NXCAdapter(logging.LoggerAdapter):
 
         This is used instead of process() since process() applies to _all_ messages, including debug calls
         """
-        if self.extra is None:
-            return f"{msg}", kwargs
-
-        if "module_name" in self.extra and len(self.extra["module_name"]) > 11:
-            self.extra["module_name"] = self.extra["module_name"][:8] + "..."
+        return format_line(self.extra, msg), kwargs
 
-        # If the logger is being called when hooking the 'options' module function
-        if len(self.extra) == 1 and ("module_name" in self.extra):
-            return (f"{colored(self.extra['module_name'], 'cyan', attrs=['bold']):<64} {msg}", kwargs)
+    def log(self, level, msg, *args, **kwargs):
+        # Queued console output is written first, so it keeps its order with regular log records
+        if self.isEnabledFor(level):
+            output.flush()
+        super().log(level, msg, *args, **kwargs)
 
-        # If the logger is being called from a protocol
-        module_name = colored(self.extra["module_name"], "cyan", attrs=["bold"]) if "module_name" in self.extra else colored(self.extra["protocol"], "blue", attrs=["bold"])
-
-        return (f"{module_name:<24} {self.extra['host']:<15} {self.extra['port']:<6} {self.extra['hostname'] if self.extra['hostname'] else 'NONE':<16} {msg}", kwargs)
+    def output(self, marker, color, msg, args, kwargs):
+        """Queue a display/success/highlight/fail line for the output writer thread"""
+        # output() <- display() and co. <- their no_debug wrapper <- the caller
+        caller_frame = inspect.currentframe().f_back.f_back.f_back
+        if args or kwargs:
+            # Arguments for rich's print, rendered right away like any other rich output
+            output.flush()
+            msg, kwargs = self.format(f"{colored(marker, color, attrs=['bold'])} {msg}" if marker else colored(msg, color, attrs=["bold"]), kwargs)
+            text = Text.from_ansi(msg)
+            nxc_console.print(text, *args, **kwargs)
+            self.log_console_to_file(text, caller_frame, *args, **kwargs)
+            return
+
+        log = None
+        if self.logger.handlers:
+            log = (tuple(self.logger.handlers), caller_frame.f_code.co_filename, caller_frame.f_lineno)
+        output.put(sys.stdout, render_line, (dict(self.extra) if self.extra else self.extra, marker, color, msg), log)
+
+    def event(self, event, msg=None, highlight=False, **fields):
+        """Structured result for the --jsonl stream, tagged with the protocol/module and target of this logger
+
+        e.g. context.log.event("credential", f"Found {username}:{password}", username=username, password=password)
+        msg, when given, is displayed like success(), or like highlight() with highlight=True
+        """
+        if msg is not None:
+            (self.highlight if highlight else self.success)(msg)
+        if events.stream is not None:
+            events.stream.emit(event, **{**event_columns(self.extra), **fields})
 
     @no_debug
     def display(self, msg, *args, **kwargs):
         """Display text to console, formatted for nxc"""
-        msg, kwargs = self.format(f"{colored('[*]', 'blue', attrs=['bold'])} {msg}", kwargs)
-        text = Text.from_ansi(msg)
-        nxc_console.print(text, *args, **kwargs)
-        self.log_console_to_file(text, *args, **kwargs)
+        self.output("[*]", "blue", msg, args, kwargs)
 
     @no_debug
     def success(self, msg, color="green", *args, **kwargs):
         """Prints some sort of success to the user"""
-        msg, kwargs = self.format(f"{colored('[+]', color, attrs=['bold'])} {msg}", kwargs)
-        text = Text.from_ansi(msg)
-        nxc_console.print(text, *args, **kwargs)
-        self.log_console_to_file(text, *args, **kwargs)
+        self.output("[+]", color, msg, args, kwargs)
 
     @no_debug
     def highlight(self, msg, *args, **kwargs):
         """Prints a completely yellow highlighted message to the user"""
-        msg, kwargs = self.format(f"{colored(msg, 'yellow', attrs=['bold'])}", kwargs)
-        text = Text.from_ansi(msg)
-        nxc_console.print(text, *args, **kwargs)
-        self.log_console_to_file(text, *args, **kwargs)
+        self.output(None, "yellow", msg, args, kwargs)
 
     @no_debug
     def fail(self, msg, color="red", *args, **kwargs):
         """Prints a failure (may or may not be an error) - e.g. login creds didn't work"""
-        msg, kwargs = self.format(f"{colored('[-]', color, attrs=['bold'])} {msg}", kwargs)
-        text = Text.from_ansi(msg)
-        nxc_console.print(text, *args, **kwargs)
-        self.log_console_to_file(text, *args, **kwargs)
+        self.output("[-]", color, msg, args, kwargs)
 
-    def log_console_to_file(self, text, *args, **kwargs):
+    def log_console_to_file(self, text, caller_frame, *args, **kwargs):
         """Log the console output to a file
 
         If debug or info logging is not enabled, we still want display/success/fail logged to the file specified,
         so we create a custom LogRecord and pass it to all the additional handlers (which will be all the file handlers)
+        caller_frame is the frame of the display/success/highlight/fail call, for the record's file and line
         """
-        caller_frame = inspect.currentframe().f_back.f_back.f_back
         if len(self.logger.handlers):  # will be 0 if it's just the console output, so only do this if we actually have file loggers
             try:
                 for handler in self.logger.handlers:
@@ -53,11 +53,11 @@ class NXCModule:
             if self.outputfile is not None:
                 with open(self.outputfile, "a+") as fd:
                     for mkhash in [mkhash for masterkey in masterkeys_triage.all_looted_masterkeys for mkhash in masterkey.generate_hash()]:
-                        context.log.highlight(mkhash)
+                        context.log.event("masterkey_hash", mkhash, highlight=True, hash=mkhash)
                         fd.write(f"{mkhash}\n")
             else:
                 for mkhash in [mkhash for masterkey in masterkeys_triage.all_looted_masterkeys for mkhash in masterkey.generate_hash()]:
-                    context.log.highlight(mkhash)
+                    context.log.event("masterkey_hash", mkhash, highlight=True, hash=mkhash)
 
         except Exception as e:
             context.log.debug(f"Could not get masterkeys: {e}")
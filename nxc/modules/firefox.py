@@ -52,7 +52,7 @@ class NXCModule:
         def firefox_callback(secret):
             if isinstance(secret, FirefoxData):
                 url = secret.url + " -" if secret.url != "" else "-"
-                context.log.highlight(f"[{secret.winuser}] {url} {secret.username}:{secret.password}")
+                context.log.event("dpapi_secret", f"[{secret.winuser}] {url} {secret.username}:{secret.password}", highlight=True, source="firefox", winuser=secret.winuser, url=secret.url, username=secret.username, password=secret.password)
                 context.db.add_dpapi_secrets(
                     target.address,
                     "FIREFOX",
@@ -62,7 +62,7 @@ class NXCModule:
                     secret.url,
                 )
             elif isinstance(secret, FirefoxCookie):
-                context.log.highlight(f"[{secret.winuser}] {secret.host}{secret.path} {secret.cookie_name}:{secret.cookie_value}")
+                context.log.event("dpapi_secret", f"[{secret.winuser}] {secret.host}{secret.path} {secret.cookie_name}:{secret.cookie_value}", highlight=True, source="firefox_cookie", winuser=secret.winuser, url=f"{secret.host}{secret.path}", username=secret.cookie_name, password=secret.cookie_value)
 
         try:
             # Collect Firefox stored secrets
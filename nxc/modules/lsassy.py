@@ -224,10 +224,12 @@ class NXCModule:
 
     @staticmethod
     def print_credentials(context, domain, username, password, lmhash, nthash):
+        cred_type = "plaintext"
         if password is None:
+            cred_type = "hash"
             password = ":".join(h for h in [lmhash, nthash] if h is not None)
         output = f"{domain}\\{username} {password}"
-        context.log.highlight(output)
+        context.log.event("credential", output, highlight=True, domain=domain, username=username, cred_type=cred_type, secret=password)
 
     @staticmethod
     def save_credentials(context, connection, domain, username, password, lmhash, nthash):
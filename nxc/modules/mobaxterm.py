@@ -49,11 +49,13 @@ class NXCModule:
         context.log.success(f"Got {highlight(len(self.masterkeys))} decrypted masterkeys. Looting MobaXterm secrets")
 
         def mobaxterm_callback(credential):
+            name = None
             if isinstance(credential, MobaXtermCredential):
+                name = credential.name
                 log_text = "{} - {}:{}".format(credential.name, credential.username, credential.password.decode("latin-1"))
             elif isinstance(credential, MobaXtermPassword):
                 log_text = "{}:{}".format(credential.username, credential.password.decode("latin-1"))
-            context.log.highlight(f"[{credential.winuser}] {log_text}")
+            context.log.event("dpapi_secret", f"[{credential.winuser}] {log_text}", highlight=True, source="mobaxterm", winuser=credential.winuser, name=name, username=credential.username, password=credential.password.decode("latin-1"))
 
         try:
             triage = MobaXtermTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys)
@@ -237,7 +237,7 @@ class NXCModule:
                                     else:
                                         credtype = "hash"
                                         credential = NThash
-                                    self.context.log.highlight(f"{domain}\\{username}:{credential}")
+                                    self.context.log.event("credential", f"{domain}\\{username}:{credential}", highlight=True, domain=domain, username=username, cred_type=credtype, secret=credential)
                                     host_id = self.context.db.get_hosts(self.connection.host)[0][0]
                                     self.context.db.add_credential(
                                         credtype,
@@ -1,3 +1,4 @@
+import contextlib
 import os
 import shutil
 import tempfile
@@ -114,10 +115,10 @@ class NXCModule:
             if context.enabled:
                 if "Enabled" in ntds_hash:
                     ntds_hash = ntds_hash.split(" ")[0]
-                    context.log.highlight(ntds_hash)
+                    context.log.event("ntds_hash", ntds_hash, highlight=True, hash=ntds_hash)
             else:
                 ntds_hash = ntds_hash.split(" ")[0]
-                context.log.highlight(ntds_hash)
+                context.log.event("ntds_hash", ntds_hash, highlight=True, hash=ntds_hash)
             if ntds_hash.find("$") == -1:
                 if ntds_hash.find("\\") != -1:
                     domain, clean_hash = ntds_hash.split("\\")
@@ -162,7 +163,8 @@ class NXCModule:
 
         try:
             context.log.success("Dumping the NTDS, this could take a while so go grab a redbull...")
-            NTDS.dump()
+            with context.db.batched_writes() if context.db is not None else contextlib.nullcontext():
+                NTDS.dump()
             context.log.success(f"Dumped {highlight(add_ntds_hash.ntds_hashes)} NTDS hashes to {connection.output_filename}.ntds of which {highlight(add_ntds_hash.added_to_db)} were added to the database")
 
             context.log.display("To extract only enabled accounts from the output file, run the following command: ")
@@ -58,7 +58,7 @@ class NXCModule:
                     log_text = f"{rdg_cred.username}:{rdg_cred.password.decode('latin-1')}"
                     if isinstance(rdg_cred, RDGServerProfile):
                         log_text = f"{rdg_cred.server_name} - {log_text}"
-                        context.log.highlight(f"[{rdcman_file.winuser}][{rdg_cred.profile_name}] {log_text}")
+                        context.log.event("dpapi_secret", f"[{rdcman_file.winuser}][{rdg_cred.profile_name}] {log_text}", highlight=True, source="rdcman", winuser=rdcman_file.winuser, name=rdg_cred.profile_name, server=rdg_cred.server_name, username=rdg_cred.username, password=rdg_cred.password.decode("latin-1"))
             for rdgfile in rdgfiles:
                 if rdgfile is None:
                     continue
@@ -66,6 +66,6 @@ class NXCModule:
                     log_text = f"{rdg_cred.username}:{rdg_cred.password.decode('latin-1')}"
                     if isinstance(rdg_cred, RDGServerProfile):
                         log_text = f"{rdg_cred.server_name} - {log_text}"
-                    context.log.highlight(f"[{rdcman_file.winuser}][{rdg_cred.profile_name}] {log_text}")
+                    context.log.event("dpapi_secret", f"[{rdcman_file.winuser}][{rdg_cred.profile_name}] {log_text}", highlight=True, source="rdcman", winuser=rdcman_file.winuser, name=rdg_cred.profile_name, server=getattr(rdg_cred, "server_name", None), username=rdg_cred.username, password=rdg_cred.password.decode("latin-1"))
         except Exception as e:
             context.log.debug(f"Could not loot RDCMan secrets: {e}")
@@ -58,7 +58,7 @@ class NXCModule:
                         decoded_token = jwt.decode(access_token, options={"verify_signature": False})
                         if "preferred_username" in decoded_token:
                             # Assuming that if there is no preferred_username key, this is not a valid Entra/M365 Access Token
-                            context.log.highlight(f"[{token.winuser}] {decoded_token['preferred_username']}: {access_token}")
+                            context.log.event("dpapi_secret", f"[{token.winuser}] {decoded_token['preferred_username']}: {access_token}", highlight=True, source="wam", winuser=token.winuser, username=decoded_token["preferred_username"], password=access_token)
 
         try:
             triage = WamTriage(target=target, conn=conn, masterkeys=self.masterkeys, per_token_callback=token_callback)
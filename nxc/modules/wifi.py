@@ -53,20 +53,26 @@ class NXCModule:
         except Exception as e:
             context.log.debug(f"Error while looting wifi: {e}")
         for wifi_cred in wifi_creds:
-            if wifi_cred.auth.upper() == "OPEN":
-                context.log.highlight(f"[OPEN] {wifi_cred.ssid}")
-            elif wifi_cred.auth.upper() in ["WPAPSK", "WPA2PSK", "WPA3SAE"]:
+            auth = wifi_cred.auth.upper()
+            if auth == "OPEN":
+                self.wifi_event(context, wifi_cred, f"[OPEN] {wifi_cred.ssid}")
+            elif auth in ["WPAPSK", "WPA2PSK", "WPA3SAE"]:
                 try:
-                    context.log.highlight(f"[{wifi_cred.auth.upper()}] {wifi_cred.ssid} - Passphrase: {wifi_cred.password.decode('latin-1')}")
+                    passphrase = wifi_cred.password.decode("latin-1")
                 except Exception:
-                    context.log.highlight(f"[{wifi_cred.auth.upper()}] {wifi_cred.ssid} - Passphrase: {wifi_cred.password}")
-            elif wifi_cred.auth.upper() in ["WPA", "WPA2"]:
+                    passphrase = wifi_cred.password
+                self.wifi_event(context, wifi_cred, f"[{auth}] {wifi_cred.ssid} - Passphrase: {passphrase}", password=passphrase)
+            elif auth in ["WPA", "WPA2"]:
                 try:
                     if self.eap_username is not None and self.eap_password is not None:
-                        context.log.highlight(f"[{wifi_cred.auth.upper()}] {wifi_cred.ssid} - {wifi_cred.eap_type} - Identifier: {wifi_cred.eap_username}:{wifi_cred.eap_password}")
+                        self.wifi_event(context, wifi_cred, f"[{auth}] {wifi_cred.ssid} - {wifi_cred.eap_type} - Identifier: {wifi_cred.eap_username}:{wifi_cred.eap_password}", username=wifi_cred.eap_username, password=wifi_cred.eap_password)
                     else:
-                        context.log.highlight(f"[{wifi_cred.auth.upper()}] {wifi_cred.ssid} - {wifi_cred.eap_type}")
+                        self.wifi_event(context, wifi_cred, f"[{auth}] {wifi_cred.ssid} - {wifi_cred.eap_type}")
                 except Exception:
-                    context.log.highlight(f"[{wifi_cred.auth.upper()}] {wifi_cred.ssid} - Passphrase: {wifi_cred.password}")
+                    self.wifi_event(context, wifi_cred, f"[{auth}] {wifi_cred.ssid} - Passphrase: {wifi_cred.password}", password=wifi_cred.password)
             else:
-                context.log.highlight(f"[WPA-EAP] {wifi_cred.ssid} - {wifi_cred.eap_type}")
+                self.wifi_event(context, wifi_cred, f"[WPA-EAP] {wifi_cred.ssid} - {wifi_cred.eap_type}")
+
+    @staticmethod
+    def wifi_event(context, wifi_cred, msg, username=None, password=None):
+        context.log.event("dpapi_secret", msg, highlight=True, source="wifi", ssid=wifi_cred.ssid, auth=wifi_cred.auth.upper(), eap_type=getattr(wifi_cred, "eap_type", None), username=username, password=password)
@@ -3,28 +3,36 @@ import io
 import sys
 from contextlib import redirect_stdout, redirect_stderr
 from nxc.helpers.logger import highlight
-from nxc.helpers.misc import identify_target_file, display_modules
-from nxc.parsers.ip import parse_targets
-from nxc.parsers.nmap import parse_nmap_xml
-from nxc.parsers.nessus import parse_nessus_file
-from nxc.cli import gen_cli_args
+from nxc.helpers.checkpoint import CheckpointJournal, SkipFinished, new_journal_path
+from nxc.helpers.concurrency import AdaptiveWindow, record_connect_errors
+from nxc.helpers import events, ratelimit
+from nxc.helpers.credentials import CredentialPlan
+from nxc.helpers.events import EventStream
+from nxc.helpers.misc import display_modules
+from nxc.helpers.ratelimit import FailedLogins, RateLimiter
+from nxc.helpers.sweep import LivenessSweep, sweep_ports
+from nxc.parsers.targets import TargetStream
+from nxc.cli import build_cli_parser, parse_cli_args
 from nxc.cli import ArgParseExit
 from nxc.loaders.protocolloader import ProtocolLoader
-from nxc.loaders.moduleloader import ModuleLoader
+from nxc.loaders.moduleloader import ModuleIndex, ModuleLoader, ModuleRegistry
 from nxc.first_run import first_run_setup
 from nxc.paths import NXC_PATH, WORKSPACE_DIR
-from nxc.logger import nxc_logger
+from nxc.logger import nxc_logger, setup_debug_logging
 from nxc.config import nxc_config, nxc_workspace, config_log
-from nxc.database import create_db_engine
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from heapq import heappop, heappush
+from itertools import count
+from time import monotonic, sleep
 import asyncio
 from nxc.helpers import powershell
 import shutil
 import os
-from os.path import exists, join as path_join
+import threading
+from os.path import join as path_join
 from rich.progress import Progress
 import platform
-from nxc.console import make_console
+from nxc.console import make_console, output
 from nxc import console
 class ArgParseExit(Exception):
     pass
@@ -44,155 +52,345 @@ if platform.system() != "Windows":
     resource.setrlimit(resource.RLIMIT_NOFILE, tuple(file_limit))
 
 
-async def start_run(protocol_obj, args, db, targets):
-    futures = []
+def handle_finished(future):
+    """Seconds after which the target of the finished future is submitted again, None once it is done"""
+    try:
+        return getattr(future.result(), "retry_after", None)
+    except Exception:
+        nxc_logger.exception("Execution error")
+
+
+def run_targets(executor, protocol_obj, args, db, targets, on_finished=None, window=None):
+    """Feed targets into the executor, keeping at most 2 * threads of them in flight
+
+    Targets are pulled from the (lazy) iterable only when a slot frees up,
+    so the number of live Future objects is bounded regardless of the scope size.
+    With an AdaptiveWindow (--adaptive) the bound is its current limit instead.
+    A target whose remaining logins are all rate limited ends its pass and frees its slot, it is
+    submitted again once its delay passed, so no worker thread sleeps on the rate limiter.
+    """
+    max_in_flight = max(args.threads, 1) * 2
+    in_flight = {}  # future -> target
+    rescheduled = []  # heap of (due time, sequence, target)
+    sequence = count()
+
+    def slots():
+        return (window.limit if window else max_in_flight) - len(in_flight)
+
+    def submit(target):
+        in_flight[executor.submit(protocol_obj, args, db, target)] = target
+
+    def submit_due():
+        while rescheduled and rescheduled[0][0] <= monotonic() and slots() > 0:
+            submit(heappop(rescheduled)[2])
+
+    def collect(timeout=None):
+        done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+        finished = 0
+        for future in done:
+            target = in_flight.pop(future)
+            retry_after = handle_finished(future)
+            if retry_after is None:
+                finished += 1
+            else:
+                heappush(rescheduled, (monotonic() + retry_after, next(sequence), target))
+        if on_finished and finished:
+            on_finished(finished)
+
+    for target in targets:
+        submit_due()
+        while slots() <= 0:
+            collect()
+            submit_due()
+        submit(target)
+
+    while in_flight or rescheduled:
+        submit_due()
+        timeout = max(rescheduled[0][0] - monotonic(), 0) if rescheduled else None
+        if in_flight:
+            collect(timeout)
+        else:
+            # Only rate limited targets are left
+            sleep(timeout)
+
 
-    if args.no_progress or len(targets) == 1:
+async def start_run(protocol_obj, args, db, targets):
+    window = protocol_obj.adaptive_window
+    if args.no_progress or targets.total() == 1:
         with ThreadPoolExecutor(max_workers=args.threads) as executor:
-            futures = [executor.submit(protocol_obj, args, db, t) for t in targets]
+            run_targets(executor, protocol_obj, args, db, targets, window=window)
     else:
         with Progress(console=console.nxc_console) as progress, ThreadPoolExecutor(max_workers=args.threads) as executor:
             task = progress.add_task(
-                f"[green]Running nxc against {len(targets)} target(s)",
-                total=len(targets),
+                f"[green]Running nxc against ~{targets.total()} target(s)",
+                total=targets.total(),
             )
-            futures = [executor.submit(protocol_obj, args, db, t) for t in targets]
-            for _ in as_completed(futures):
-                progress.update(task, advance=1)
-
-    for future in as_completed(futures):
-        try:
-            future.result()
-        except Exception:
-            nxc_logger.exception("Execution error")
-
-
-def run_engine(argv, stdout, stderr):
-    old_argv = sys.argv
-    sys.argv = ["nxc"] + list(argv)
-
-    try:
-        console.nxc_console = make_console(stdout)
-
-        with redirect_stdout(stdout), redirect_stderr(stderr):
-            first_run_setup(nxc_logger)
 
-            try:
-                args, version_info = gen_cli_args(argv)
-            except (SystemExit,ArgParseExit):
-                return
+            def advance(count):
+                if window:
+                    progress.update(task, description=f"[green]Running nxc against ~{targets.total()} target(s), window {window.limit}/{args.threads}")
+                progress.update(task, advance=count, total=targets.total())
 
-            if config_log:
-                nxc_logger.add_file_log()
-            if getattr(args, "log", None):
-                nxc_logger.add_file_log(args.log)
+            run_targets(executor, protocol_obj, args, db, targets, on_finished=advance, window=window)
 
-            if not args.protocol:
-                return
 
-            if args.protocol == "ssh" and args.key_file and not args.password:
-                nxc_logger.fail("Password required with key file")
-                return
+class Engine:
+    """Long lived NetExec runner for embedding, run() many times without paying the startup again
 
-            if getattr(args, "use_kcache", False) and not os.environ.get("KRB5CCNAME"):
-                nxc_logger.error("KRB5CCNAME not set")
-                return
+    The argument parser, the loaded protocols and their database engines, the module index and the
+    console are built on the first run and reused by the following ones. Each run writes to its own
+    stdout/stderr. Runs are serialized, as sys.argv and the redirected sys.stdout are process wide.
+    """
 
-            targets = []
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.parser = None
+        self.console = None
+        self.protocols = {}
+        self.db_engines = {}
+        self.module_index = None
 
-            if getattr(args, "cred_id", None):
-                for cid in list(args.cred_id):
-                    if "-" in str(cid):
-                        start, end = cid.split("-")
-                        args.cred_id.remove(cid)
-                        args.cred_id.extend(range(int(start), int(end) + 1))
+    def run(self, argv):
+        """Run nxc with the arguments of argv, returns its return code and captured output like run_netexec"""
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        try:
+            self.execute(argv, stdout, stderr)
+            return {"returncode": 0, "stdout": stdout.getvalue(), "stderr": stderr.getvalue()}
+        except Exception as e:
+            return {"returncode": 1, "stdout": stdout.getvalue(), "stderr": str(e)}
 
-            if getattr(args, "target", None):
-                for target in args.target:
-                    try:
-                        if exists(target) and os.path.isfile(target):
-                            ftype = identify_target_file(target)
-                            if ftype == "nmap":
-                                targets.extend(parse_nmap_xml(target, args.protocol))
-                            elif ftype == "nessus":
-                                targets.extend(parse_nessus_file(target, args.protocol))
-                            else:
-                                with open(target) as f:
-                                    for line in f:
-                                        targets.extend(parse_targets(line.strip()))
-                        else:
-                            targets.extend(parse_targets(target))
-                    except Exception as e:
-                        nxc_logger.fail(f"Failed to parse target {target}: {e}")
-
-            if getattr(args, "clear_obfscripts", False):
-                obf = os.path.join(NXC_PATH, "obfuscated_scripts")
-                shutil.rmtree(obf, ignore_errors=True)
-                os.mkdir(obf)
-                nxc_logger.success("Cleared obfuscated scripts")
-
-            if getattr(args, "obfs", False):
-                powershell.obfuscate_ps_scripts = True
+    def load_protocol(self, protocol):
+        """Protocol class, database module and database engine of a protocol
 
+        The implementation is imported and the database schema checked once per Engine.
+        """
+        if protocol not in self.protocols:
             loader = ProtocolLoader()
-            proto_info = loader.get_protocols()[args.protocol]
-
-            # protocol_module = loader.load_protocol(proto_info["path"])
-            # protocol_object = None
-            # for attr_name in dir(protocol_module):
-            #     if attr_name.startswith("_"):
-            #         continue
+            proto_info = loader.get_protocols()[protocol]
 
-            #     attr = getattr(protocol_module, attr_name)
-            #     if isinstance(attr, type):
-            #         protocol_object = attr
-            #         break
-
-            # if protocol_object is None:
-            #     raise RuntimeError(
-            #         f"No protocol class found in {proto_info['path']}"
-            #     )
-
-            # Load protocol module (smb.py, ldap.py, etc)
+            # Load protocol module (smb.py, ldap.py, etc), the only protocol implementation imported by the run
             protocol_module = loader.load_protocol(proto_info["path"])
-            protocol_object = protocol_module
+            protocol_object = getattr(protocol_module, protocol)
 
             # Load protocol database module (database.py)
             protocol_db_module = None
             if "dbpath" in proto_info:
                 protocol_db_module = loader.load_protocol(proto_info["dbpath"])
 
-            db_path = path_join(WORKSPACE_DIR, nxc_workspace, f"{args.protocol}.db")
+            # SQLAlchemy is only imported once a protocol actually runs, not for --help or --version
+            from nxc.database import create_db_engine
+
+            db_path = path_join(WORKSPACE_DIR, nxc_workspace, f"{protocol}.db")
             db_engine = create_db_engine(db_path)
 
-            # Initialize DB schema ONCE
+            # Initialize DB schema ONCE, a no-op when the database is stamped with the current schema version
             if hasattr(protocol_db_module, "db_schema"):
                 protocol_db_module.db_schema(db_engine)
 
-            # NetExec DOES NOT instantiate DB objects
-            db = None
-            if protocol_db_module and hasattr(protocol_db_module, "db_schema"):
-                protocol_db_module.db_schema(db_engine)
+            self.db_engines[db_path] = db_engine
+            self.protocols[protocol] = (protocol_object, protocol_db_module, db_engine)
+        return self.protocols[protocol]
+
+    def close(self):
+        for db_engine in self.db_engines.values():
+            db_engine.dispose()
+        self.db_engines.clear()
+        self.protocols.clear()
 
-            protocol_object.config = nxc_config
+    def execute(self, argv, stdout, stderr):
+        with self.lock:
+            self._execute(argv, stdout, stderr)
 
-            if args.module or args.list_modules is not None:
-                mod_loader = ModuleLoader(args, db, nxc_logger)
-                modules = mod_loader.list_modules()
+    def _execute(self, argv, stdout, stderr):
+        old_argv = sys.argv
+        sys.argv = ["nxc"] + list(argv)
+        log_handlers = list(nxc_logger.logger.handlers)
+        db = None
 
-            if args.list_modules is not None:
-                low = {m: p for m, p in modules.items() if not p["requires_admin"]}
-                high = {m: p for m, p in modules.items() if p["requires_admin"]}
-                nxc_logger.highlight("LOW PRIVILEGE MODULES")
-                display_modules(args, low)
-                nxc_logger.highlight("\nHIGH PRIVILEGE MODULES")
-                display_modules(args, high)
-                return
+        try:
+            if self.console is None:
+                self.console = make_console(stdout)
+            else:
+                self.console.file = stdout
+            console.nxc_console = self.console
+
+            with redirect_stdout(stdout), redirect_stderr(stderr):
+                if self.parser is None:
+                    first_run_setup(nxc_logger)
+                    self.parser = build_cli_parser()
+
+                try:
+                    setup_debug_logging()
+                    args, version_info = parse_cli_args(*self.parser, argv)
+                except (SystemExit,ArgParseExit):
+                    return
+
+                if config_log:
+                    nxc_logger.add_file_log()
+                if getattr(args, "log", None):
+                    nxc_logger.add_file_log(args.log)
+                if getattr(args, "jsonl", None):
+                    events.stream = EventStream(args.jsonl)
+
+                if not args.protocol:
+                    return
+
+                if args.protocol == "ssh" and args.key_file and not args.password:
+                    nxc_logger.fail("Password required with key file")
+                    return
+
+                if getattr(args, "use_kcache", False) and not os.environ.get("KRB5CCNAME"):
+                    nxc_logger.error("KRB5CCNAME not set")
+                    return
+
+                if getattr(args, "cred_id", None):
+                    for cid in list(args.cred_id):
+                        if "-" in str(cid):
+                            start, end = cid.split("-")
+                            args.cred_id.remove(cid)
+                            args.cred_id.extend(range(int(start), int(end) + 1))
+
+                targets = TargetStream(getattr(args, "target", None) or [], args.protocol)
+
+                if getattr(args, "clear_obfscripts", False):
+                    obf = os.path.join(NXC_PATH, "obfuscated_scripts")
+                    shutil.rmtree(obf, ignore_errors=True)
+                    os.mkdir(obf)
+                    nxc_logger.success("Cleared obfuscated scripts")
+
+                powershell.obfuscate_ps_scripts = getattr(args, "obfs", False)
+
+                # Listing modules, their options and the protocols they support is answered from the module index,
+                # before any protocol implementation or module code is imported
+                if args.module or args.list_modules is not None:
+                    if self.module_index is None:
+                        self.module_index = ModuleIndex()
+                    mod_loader = ModuleLoader(args, None, nxc_logger)
+                    modules = mod_loader.list_modules(self.module_index)
+
+                if args.list_modules is not None:
+                    low = {m: p for m, p in modules.items() if not p["requires_admin"]}
+                    high = {m: p for m, p in modules.items() if p["requires_admin"]}
+                    nxc_logger.highlight("LOW PRIVILEGE MODULES")
+                    display_modules(args, low)
+                    nxc_logger.highlight("\nHIGH PRIVILEGE MODULES")
+                    display_modules(args, high)
+                    return
+
+                if args.module:
+                    module_paths = []
+                    for module_name in map(str.lower, args.module):
+                        if module_name not in modules:
+                            nxc_logger.error(f"Module not found: {module_name}")
+                            return
+                        if args.show_module_options:
+                            nxc_logger.display(f"{module_name} module options:\n{modules[module_name]['options']}")
+                            continue
+                        if args.protocol not in modules[module_name]["supported_protocols"]:
+                            nxc_logger.error(f"Module {module_name} not supported for protocol {args.protocol}")
+                            return
+                        module_paths.append(modules[module_name]["path"])
+                    if args.show_module_options:
+                        return
+
+                protocol_object, protocol_db_module, db_engine = self.load_protocol(args.protocol)
+
+                # One database object per run, its write-behind queue is flushed by shutdown_db() when the run ends
+                if hasattr(protocol_db_module, "database"):
+                    db = protocol_db_module.database(db_engine)
+
+                protocol_object.config = nxc_config
+                # The protocol class is reused by every run of an Engine, reset the state of the previous run
+                protocol_object.module_paths = []
+                protocol_object.module_registry = protocol_object.adaptive_window = protocol_object.checkpoint = None
+                protocol_object.rescheduled = {}
+
+                if args.module:
+                    # Modules are imported and their options parsed once, targets get cheap copies
+                    protocol_object.module_paths = module_paths
+                    protocol_object.module_registry = ModuleRegistry(args, db, nxc_logger)
+                    protocol_object.module_registry.load(protocol_object.module_paths)
+
+                protocol_object.rate_limiter = RateLimiter.from_args(args)
+                # Lockout counters start from zero on every run, --workers children proxy to this instance
+                ratelimit.login_failures = FailedLogins(window=getattr(args, "fail_window", None))
+
+                # Wordlists and --cred-id are resolved once here instead of once per target
+                protocol_object.credential_plan = CredentialPlan.from_args(args, db, nxc_logger)
+
+                journal = None
+                if getattr(args, "resume", None) or getattr(args, "checkpoint", False):
+                    journal_path = args.resume or new_journal_path(nxc_workspace, args.protocol)
+                    try:
+                        journal = CheckpointJournal(journal_path, args.protocol, protocol_object.credential_plan.fingerprint())
+                    except (OSError, ValueError) as e:
+                        nxc_logger.fail(f"Could not open checkpoint journal: {e}")
+                        return
+                    nxc_logger.info(f"Checkpoint journal: {journal_path}")
+                    protocol_object.checkpoint = journal
+                    if journal.done:
+                        targets = SkipFinished(targets, journal)
+
+                # Finished targets of a resumed run are dropped before they are resolved or swept
+                if getattr(args, "dns_server", None) or getattr(args, "dns_tcp", False):
+                    # Hostnames are resolved in asynchronous batches ahead of the workers, which then hit the DNS cache
+                    from nxc.helpers.resolver import DNSPrefetch
+
+                    targets = DNSPrefetch(targets, args)
+                if getattr(args, "pre_sweep", False):
+                    ports = sweep_ports(args)
+                    if ports:
+                        targets = LivenessSweep(targets, ports, args.sweep_timeout, args.sweep_concurrency)
+                    else:
+                        nxc_logger.debug(f"No known port for protocol {args.protocol}, skipping the liveness sweep")
+
+                if getattr(args, "adaptive", False):
+                    record_connect_errors()
+                    # Targets left by the liveness sweep all answered, each of their timeouts is congestion
+                    protocol_object.adaptive_window = AdaptiveWindow(args.threads, hosts_answered=isinstance(targets, LivenessSweep))
+
+                workers = getattr(args, "workers", 1)
+                if workers > 1:
+                    # Imported with the database, only when a run is sharded
+                    from nxc.helpers.workers import sharding_supported, start_sharded_run
+
+                    if not sharding_supported():
+                        nxc_logger.fail("--workers requires fork() support, running in a single process")
+                        workers = 1
+
+                completed = False
+                try:
+                    if workers > 1:
+                        start_sharded_run(protocol_object, args, db, targets)
+                    else:
+                        asyncio.run(start_run(protocol_object, args, db, targets))
+                    completed = True
+                finally:
+                    if journal is not None:
+                        journal.close()
+                        # An interrupted run, or one that left targets unfinished, keeps its journal for --resume
+                        if completed and not journal.unfinished:
+                            journal.remove()
+
+        finally:
+            if db is not None:
+                db.shutdown_db()
+            # Every line of the run is in its stdout (and log files) when it returns
+            output.flush()
+            if events.stream is not None:
+                events.stream.close()
+                events.stream = None
+            sys.argv = old_argv
+            for handler in set(nxc_logger.logger.handlers) - set(log_handlers):
+                nxc_logger.logger.removeHandler(handler)
+                handler.close()
 
-            try:
-                asyncio.run(start_run(protocol_object, args, db, targets))
-            finally:
-                db_engine.dispose()
 
+def run_engine(argv, stdout, stderr):
+    """Cold run: parses, loads and checks everything again, use an Engine for repeated runs"""
+    engine = Engine()
+    try:
+        engine.execute(argv, stdout, stderr)
     finally:
-        sys.argv = old_argv
+        engine.close()
@@ -1,5 +1,6 @@
 import cmd
 import csv
+import json
 import sys
 import os
 import argparse
@@ -13,7 +14,12 @@ from termcolor import colored
 
 from nxc.loaders.protocolloader import ProtocolLoader
 from nxc.paths import CONFIG_PATH, WORKSPACE_DIR
-from nxc.database import create_db_engine, open_config, get_workspace, get_db, write_configfile, create_workspace, set_workspace
+from nxc.database import create_db_engine, open_config, get_workspace, get_db, write_configfile, create_workspace, merge_workspaces, set_workspace
+from nxc.workspace_db import open_workspace_db
+
+
+# Rows per table when a navigator renders a query page by page
+PAGE_SIZE = 100
 
 
 class UserExitedProto(Exception):
@@ -44,6 +50,21 @@ def write_csv(filename, headers, entries):
             csv_file.writerow(entry)
 
 
+def write_jsonl(filename, headers, entries):
+    """Writes one JSON object per entry, keyed by the headers, for tools that read records rather than CSV"""
+    with open(os.path.expanduser(filename), "w") as export_file:
+        for entry in entries:
+            export_file.write(json.dumps(dict(zip(headers, entry, strict=True)), default=str) + "\n")
+
+
+def write_rows(filename, headers, entries):
+    """Writes the entries as JSON lines if the filename ends with .jsonl, as CSV otherwise"""
+    if filename.lower().endswith(".jsonl"):
+        write_jsonl(filename, headers, entries)
+    else:
+        write_csv(filename, headers, entries)
+
+
 def write_list(filename, entries):
     """Writes a file with a simple list"""
     with open(os.path.expanduser(filename), "w") as export_file:
@@ -101,14 +122,28 @@ class DatabaseNavigator(cmd.Cmd):
     def do_back(self, line):
         raise UserExitedProto
 
+    @staticmethod
+    def display_pages(pages, display):
+        """Render the pages of an iter_pages() query one table at a time, on a terminal the next page is only fetched on request"""
+        page = []
+        for page_number, page in enumerate(pages, 1):
+            display(page)
+            if len(page) == PAGE_SIZE and sys.stdin.isatty() and input(f"[*] Page {page_number}, press enter for more or q to stop: ").strip().lower() == "q":
+                return
+        if not page:
+            display(page)
+
     def do_export(self, line):
         if not line:
             print("[-] not enough arguments")
             return
         line = line.split()
         command = line[0].lower()
+        # Exports stream joined queries from the database, see the export_* functions of nxc/protocols/smb/database.py
+        if command in ("creds", "hosts", "shares", "local_admins", "dpapi", "wcc") and not hasattr(self.db, "export_hosts"):
+            print(f"[-] Exporting {command} is not supported for the {self.proto} protocol")
+            return
         # Need to use if/elif/else to keep compatibility with py3.8/3.9
-        # Reference DB Function nxc/protocols/smb/database.py
         # Users
         if command == "creds":
             if len(line) < 3:
@@ -116,7 +151,6 @@ class DatabaseNavigator(cmd.Cmd):
                 return
 
             filename = line[2]
-            creds = self.db.get_credentials()
             csv_header = (
                 "id",
                 "domain",
@@ -127,33 +161,11 @@ class DatabaseNavigator(cmd.Cmd):
             )
 
             if line[1].lower() == "simple":
-                write_csv(filename, csv_header, creds)
+                write_rows(filename, csv_header, self.db.export_credentials())
             elif line[1].lower() == "detailed":
-                formatted_creds = []
-
-                for cred in creds:
-                    entry = [
-                        cred[0],  # ID
-                        cred[1],  # Domain
-                        cred[2],  # Username
-                        cred[3],  # Password/Hash
-                        cred[4],  # Cred Type
-                    ]
-                    if cred[5] is None:
-                        entry.append("")
-                    else:
-                        entry.append(self.db.get_hosts(cred[5])[0][2])
-                    formatted_creds.append(entry)
-                write_csv(filename, csv_header, formatted_creds)
+                write_rows(filename, csv_header, self.db.export_credentials(detailed=True))
             elif line[1].lower() == "hashcat":
-                usernames = []
-                passwords = []
-                for cred in creds:
-                    if cred[4] == "hash":
-                        usernames.append(cred[2])
-                        passwords.append(cred[3])
-                output_list = [":".join(combination) for combination in zip(usernames, passwords, strict=True)]
-                write_list(filename, output_list)
+                write_list(filename, (f"{username}:{password}" for username, password in self.db.export_hashes()))
             else:
                 print(f"[-] No such export option: {line[1]}")
                 return
@@ -190,17 +202,12 @@ class DatabaseNavigator(cmd.Cmd):
             filename = line[2]
 
             if line[1].lower() == "simple":
-                hosts = self.db.get_hosts()
-                simple_hosts = [host[:8] for host in hosts]
-                write_csv(filename, csv_header_simple, simple_hosts)
+                write_rows(filename, csv_header_simple, self.db.export_hosts())
             # TODO: maybe add more detail like who is an admin on it, shares discovered, etc
             elif line[1].lower() == "detailed":
-                hosts = self.db.get_hosts()
-                write_csv(filename, csv_header_detailed, hosts)
+                write_rows(filename, csv_header_detailed, self.db.export_hosts(detailed=True))
             elif line[1].lower() == "signing":
-                hosts = self.db.get_hosts("signing")
-                signing_hosts = [host[1] for host in hosts]
-                write_list(filename, signing_hosts)
+                write_list(filename, (host.ip for host in self.db.export_hosts(filter_term="signing")))
             else:
                 print(f"[-] No such export option: {line[1]}")
                 return
@@ -211,31 +218,15 @@ class DatabaseNavigator(cmd.Cmd):
                 print("[-] invalid arguments, export shares <simple|detailed> <filename>")
                 return
 
-            shares = self.db.get_shares()
             csv_header = ("id", "host", "userid", "name", "remark", "read", "write")
             filename = line[2]
 
             if line[1].lower() == "simple":
-                write_csv(filename, csv_header, shares)
+                write_rows(filename, csv_header, self.db.export_shares())
                 print("[+] shares exported")
             # Detailed view gets hostname, usernames, and true false statement
             elif line[1].lower() == "detailed":
-                formatted_shares = []
-                for share in shares:
-                    user = self.db.get_users(share[2])[0]
-                    share_host = self.db.get_hosts(share[1])[0][2] if self.db.get_hosts(share[1]) else "ERROR"
-
-                    entry = (
-                        share[0],  # shareID
-                        share_host,  # hosts
-                        f"{user[1]}\\{user[2]}",  # userID
-                        share[3],  # name
-                        share[4],  # remark
-                        bool(share[5]),  # read
-                        bool(share[6]),  # write
-                    )
-                    formatted_shares.append(entry)
-                write_csv(filename, csv_header, formatted_shares)
+                write_rows(filename, csv_header, self.db.export_shares(detailed=True))
                 print("[+] Shares exported")
             else:
                 print(f"[-] No such export option: {line[1]}")
@@ -247,25 +238,13 @@ class DatabaseNavigator(cmd.Cmd):
                 return
 
             # These values don't change between simple and detailed
-            local_admins = self.db.get_admin_relations()
             csv_header = ("id", "userid", "host")
             filename = line[2]
 
             if line[1].lower() == "simple":
-                write_csv(filename, csv_header, local_admins)
+                write_rows(filename, csv_header, self.db.export_admin_relations())
             elif line[1].lower() == "detailed":
-                formatted_local_admins = []
-                for entry in local_admins:
-                    user = self.db.get_users(filter_term=entry[1])[0]
-
-                    formatted_entry = (
-                        entry[0],  # Entry ID
-                        f"{user[1]}/{user[2]}",  # DOMAIN/Username
-                        self.db.get_hosts(filter_term=entry[2])[0][2],  # Hostname
-                    )
-                    # Can't modify a tuple which is what self.db.get_admin_relations() returns
-                    formatted_local_admins.append(formatted_entry)
-                write_csv(filename, csv_header, formatted_local_admins)
+                write_rows(filename, csv_header, self.db.export_admin_relations(detailed=True))
             else:
                 print(f"[-] No such export option: {line[1]}")
                 return
@@ -276,7 +255,6 @@ class DatabaseNavigator(cmd.Cmd):
                 return
 
             # These values don't change between simple and detailed
-            dpapi_secrets = self.db.get_dpapi_secrets()
             csv_header = (
                 "id",
                 "host",
@@ -289,22 +267,9 @@ class DatabaseNavigator(cmd.Cmd):
             filename = line[2]
 
             if line[1].lower() == "simple":
-                write_csv(filename, csv_header, dpapi_secrets)
+                write_rows(filename, csv_header, self.db.export_dpapi_secrets())
             elif line[1].lower() == "detailed":
-                formatted_dpapi_secret = []
-                for entry in dpapi_secrets:
-                    formatted_entry = (
-                        entry[0],  # Entry ID
-                        self.db.get_hosts(filter_term=entry[1])[0][2],  # Hostname
-                        entry[2],  # DPAPI type
-                        entry[3],  # Windows User
-                        entry[4],  # Username
-                        entry[5],  # Password
-                        entry[6],  # URL
-                    )
-                    # Can't modify a tuple which is what self.db.get_admin_relations() returns
-                    formatted_dpapi_secret.append(formatted_entry)
-                write_csv(filename, csv_header, formatted_dpapi_secret)
+                write_rows(filename, csv_header, self.db.export_dpapi_secrets(detailed=True))
             else:
                 print(f"[-] No such export option: {line[1]}")
                 return
@@ -328,45 +293,15 @@ class DatabaseNavigator(cmd.Cmd):
             )
             csv_header_detailed = ("id", "ip", "hostname", "check", "description", "status", "reasons")
             filename = line[2]
-            host_mapping = {}
-            check_mapping = {}
-
-            hosts = self.db.get_hosts()
-            checks = self.db.get_checks()
-            check_results = self.db.get_check_results()
-            rows = []
-
-            for result_id, hostid, checkid, secure, reasons in check_results:
-                row = [result_id]
-                if hostid in host_mapping:
-                    row.extend(host_mapping[hostid])
-                else:
-                    for host_id, ip, hostname, _, _, _, _, _, _, _, _ in hosts:
-                        if host_id == hostid:
-                            row.extend([ip, hostname])
-                            host_mapping[hostid] = [ip, hostname]
-                            break
-                if checkid in check_mapping:
-                    row.extend(check_mapping[checkid])
-                else:
-                    for check in checks:
-                        check_id, name, description = check
-                        if check_id == checkid:
-                            row.extend([name, description])
-                            check_mapping[checkid] = [name, description]
-                            break
-                row.extend(("OK" if secure else "KO", reasons))
-                rows.append(row)
 
             if line[1].lower() == "simple":
-                simple_rows = [(row[0], row[1], row[2], row[3], row[5]) for row in rows]
-                write_csv(filename, csv_header_simple, simple_rows)
+                rows = ((result_id, ip, hostname, name, "OK" if secure else "KO") for result_id, ip, hostname, name, _, secure, _ in self.db.export_check_results())
+                write_rows(filename, csv_header_simple, rows)
             elif line[1].lower() == "detailed":
-                write_csv(filename, csv_header_detailed, rows)
+                rows = ((result_id, ip, hostname, name, description, "OK" if secure else "KO", reasons) for result_id, ip, hostname, name, description, secure, reasons in self.db.export_check_results())
+                write_rows(filename, csv_header_detailed, rows)
             elif line[1].lower() == "signing":
-                hosts = self.db.get_hosts("signing")
-                signing_hosts = [host[1] for host in hosts]
-                write_list(filename, signing_hosts)
+                write_list(filename, (host.ip for host in self.db.export_hosts(filter_term="signing")))
             else:
                 print(f"[-] No such export option: {line[1]}")
                 return
@@ -384,6 +319,7 @@ class DatabaseNavigator(cmd.Cmd):
         hosts where signing is enabled
         * keys' third option is either "all" or an id of a key to export
             export keys [all|id] [filename]
+        * CSV exports are written as JSON lines (one object per row) instead if the filename ends with .jsonl
         """
         print_help(help_string)
 
@@ -455,8 +391,8 @@ class NXCDBMenu(cmd.Cmd):
         proto_db_path = path_join(WORKSPACE_DIR, self.workspace, f"{proto}.db")
         if exists(proto_db_path):
             self.conn = create_db_engine(proto_db_path)
-            db_nav_object = proto_info.get("navigator")
-            db_object = proto_info.get("db")
+            db_nav_object = self.p_loader.load_protocol(proto_info["nvpath"])
+            db_object = self.p_loader.load_protocol(proto_info["dbpath"])
             self.config.set("nxc", "last_used_db", proto)
             write_configfile(self.config, self.config_path)
             try:
@@ -514,6 +450,72 @@ class NXCDBMenu(cmd.Cmd):
         """
         print_help(help_string)
 
+    def do_merge(self, line):
+        sources = line.split()
+        if not sources:
+            self.help_merge()
+            return
+        for source in sources:
+            if not exists(path_join(WORKSPACE_DIR, source)):
+                print(f"[-] Workspace {source} does not exist")
+                return
+        print(f"[*] Merging {', '.join(sources)} into workspace '{self.workspace}'")
+        merged = {proto: count for proto, count in merge_workspaces(self.workspace, sources, self.p_loader).items() if count}
+        for proto, count in merged.items():
+            print(f"[+] {proto.upper()}: {count} row(s) merged")
+        if not merged:
+            print("[*] Nothing to merge")
+
+    @staticmethod
+    def help_merge():
+        help_string = """
+        merge <workspace> [<workspace> ...]
+        Merges the protocol databases of the given workspaces into the current one, e.g. scans run from several boxes
+        Hosts and credentials found in both are matched (ip, domain/username/credtype), known rows only get their empty columns filled
+        """
+        print_help(help_string)
+
+    def do_unified(self, line):
+        args = line.split()
+        if not args:
+            self.help_unified()
+            return
+        subcommand = args[0]
+
+        db = open_workspace_db(self.workspace)
+        try:
+            if subcommand == "sync":
+                db.sync_workspace(self.workspace, [proto for proto, proto_info in self.protocols.items() if "dbpath" in proto_info])
+                print(f"[+] Workspace store synced: {len(db.get_hosts())} host(s), {len(db.get_credentials())} credential(s)")
+            elif subcommand == "hosts":
+                data = [["HostID", "IP", "Hostname", "Domain", "OS", "Protocols"]]
+                data.extend([host.id, host.ip, host.hostname, host.domain, host.os, host.protocols] for host in db.get_hosts(filter_term=args[1] if len(args) > 1 else None))
+                print_table(data, title="Hosts")
+            elif subcommand == "creds":
+                data = [["CredID", "CredType", "Domain", "UserName", "Password", "Protocols"]]
+                data.extend([cred.id, cred.credtype, cred.domain, cred.username, cred.password, cred.protocols] for cred in db.get_credentials(filter_term=args[1] if len(args) > 1 else None))
+                print_table(data, title="Credentials")
+            elif subcommand in ("admins", "logins"):
+                source, target = ([arg if arg != "all" else None for arg in args[1:3]] + [None, None])[:2]
+                data = [["CredID", "CredType", "Domain", "UserName", "Password", "IP", "Hostname", "Protocol"]]
+                data.extend(list(row) for row in db.get_access(relation="admin" if subcommand == "admins" else "loggedin", source=source, target=target))
+                print_table(data, title="Admin access" if subcommand == "admins" else "Logins")
+            else:
+                self.help_unified()
+        finally:
+            db.shutdown_db()
+            db.db_engine.dispose()
+
+    @staticmethod
+    def help_unified():
+        help_string = """
+        unified [sync | hosts [filter] | creds [filter] | admins [sourceProto|all] [targetProto|all] | logins [sourceProto|all] [targetProto|all]]
+        Cross-protocol view of the workspace, kept in workspace.db next to the protocol databases
+        sync: rebuilds it from every protocol database, run it after a scan
+        admins ldap smb: hosts where credentials found over LDAP have admin rights over SMB
+        """
+        print_help(help_string)
+
     @staticmethod
     def do_exit(line):
         sys.exit()
@@ -554,6 +556,13 @@ def main():
         "--set-workspace",
         help="set the current workspace",
     )
+    parser.add_argument(
+        "-mw",
+        "--merge-workspace",
+        nargs="+",
+        metavar="WORKSPACE",
+        help="merge the given workspaces into the current workspace",
+    )
     args = parser.parse_args()
 
     if args.create_workspace:
@@ -562,6 +571,9 @@ def main():
     if args.set_workspace:
         set_workspace(CONFIG_PATH, args.set_workspace)
         sys.exit()
+    if args.merge_workspace:
+        NXCDBMenu(CONFIG_PATH).do_merge(" ".join(args.merge_workspace))
+        sys.exit()
     if args.get_workspace:
         current_workspace = get_workspace(open_config(CONFIG_PATH))
         for workspace in listdir(path_join(WORKSPACE_DIR)):
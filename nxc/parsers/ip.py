@@ -23,3 +23,23 @@ def parse_targets(target):
                     yield str(ip)
     except ValueError:
         yield str(target)
+
+
+def estimate_targets(target):
+    """Return the number of addresses parse_targets() would yield for target, without expanding it"""
+    try:
+        if "-" in target:
+            start_ip, end_ip = target.split("-")
+            try:
+                end_ip = ip_address(end_ip)
+            except ValueError:
+                first_three_octets = start_ip.split(".")[:-1]
+                first_three_octets.append(end_ip)
+                end_ip = ip_address(".".join(first_three_octets))
+            return max(int(end_ip) - int(ip_address(start_ip)) + 1, 0)
+        elif ip_interface(target).ip.version == 6 and ip_address(target).is_link_local:
+            return 1
+        else:
+            return ip_network(target, strict=False).num_addresses
+    except ValueError:
+        return 1
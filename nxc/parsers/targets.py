@@ -0,0 +1,79 @@
+from os.path import isfile
+
+from nxc.helpers.misc import identify_target_file
+from nxc.logger import nxc_logger
+from nxc.parsers.ip import parse_targets, estimate_targets
+from nxc.parsers.nessus import parse_nessus_file
+from nxc.parsers.nmap import parse_nmap_xml
+
+
+def count_lines(path):
+    """Count the lines of a file in large binary chunks, without decoding or keeping them"""
+    lines = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            lines += chunk.count(b"\n")
+    return lines
+
+
+class TargetStream:
+    """Lazily yields the targets given on the command line
+
+    Targets can be IPs, hostnames, CIDRs, ranges, target files or nmap/nessus reports.
+    Nothing is expanded up front, so memory stays flat no matter how large the scope is.
+    Nmap and nessus reports only contain hosts with a matching open port, so they are parsed eagerly.
+
+    ``estimate`` is the expected number of targets, used for the progress bar.
+    Target files are estimated with one target per line, ``yielded`` counts what was actually produced.
+    """
+
+    def __init__(self, target_args, protocol):
+        self.sources = []
+        self.estimate = 0
+        self.yielded = 0
+
+        for target in target_args:
+            try:
+                if isfile(target):
+                    ftype = identify_target_file(target)
+                    if ftype == "nmap":
+                        hosts = parse_nmap_xml(target, protocol)
+                        self.sources.append(("hosts", hosts))
+                        self.estimate += len(hosts)
+                    elif ftype == "nessus":
+                        hosts = parse_nessus_file(target, protocol)
+                        self.sources.append(("hosts", hosts))
+                        self.estimate += len(hosts)
+                    else:
+                        self.sources.append(("file", target))
+                        self.estimate += count_lines(target)
+                else:
+                    self.sources.append(("target", target))
+                    self.estimate += estimate_targets(target)
+            except Exception as e:
+                nxc_logger.fail(f"Failed to parse target {target}: {e}")
+
+    def __iter__(self):
+        for kind, value in self.sources:
+            try:
+                if kind == "hosts":
+                    yield from self._count(value)
+                elif kind == "file":
+                    with open(value) as f:
+                        for line in f:
+                            line = line.strip()
+                            if line:
+                                yield from self._count(parse_targets(line))
+                else:
+                    yield from self._count(parse_targets(value))
+            except Exception as e:
+                nxc_logger.fail(f"Failed to parse target {value}: {e}")
+
+    def _count(self, targets):
+        for target in targets:
+            self.yielded += 1
+            yield target
+
+    def total(self):
+        """Best known total: the estimate, corrected upwards once more targets have been produced"""
+        return max(self.estimate, self.yielded)
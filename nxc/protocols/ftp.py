@@ -67,11 +67,8 @@ class ftp(connection):
         # 230 is "User logged in, proceed" response, ftplib raises an exception on failed login
         if "230" in resp:
             self.logger.debug(f"Host: {self.host} Port: {self.port}")
-            self.db.add_host(self.host, self.port, self.remote_version)
-
+            host_id = self.db.add_host(self.host, self.port, self.remote_version)[0]
             cred_id = self.db.add_credential(username, password)
-
-            host_id = self.db.get_hosts(self.host)[0].id
             self.db.add_loggedin_relation(cred_id, host_id)
 
             if username in ["anonymous", ""]:
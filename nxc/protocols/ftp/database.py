@@ -1,9 +1,8 @@
 
-from sqlalchemy import Column, ForeignKeyConstraint, Integer, PrimaryKeyConstraint, String, select, delete, func
-from sqlalchemy.dialects.sqlite import Insert
+from sqlalchemy import Column, ForeignKeyConstraint, Index, Integer, PrimaryKeyConstraint, String, select, delete, func
 from sqlalchemy.orm import declarative_base
 
-from nxc.database import BaseDB, format_host_query
+from nxc.database import BaseDB, format_host_query, create_schema
 from nxc.logger import nxc_logger
 
 Base = declarative_base()
@@ -25,6 +24,7 @@ class database(BaseDB):
 
         __table_args__ = (
             PrimaryKeyConstraint("id"),
+            Index("ix_credentials_credential", func.lower(username), func.lower(password), unique=True),
         )
 
     class Host(Base):
@@ -36,6 +36,7 @@ class database(BaseDB):
 
         __table_args__ = (
             PrimaryKeyConstraint("id"),
+            Index("ix_hosts_host", "host", unique=True),
         )
 
     class LoggedInRelation(Base):
@@ -48,6 +49,7 @@ class database(BaseDB):
             PrimaryKeyConstraint("id"),
             ForeignKeyConstraint(["credid"], ["credentials.id"]),
             ForeignKeyConstraint(["hostid"], ["hosts.id"]),
+            Index("ix_loggedin_relations_cred_host", "credid", "hostid", unique=True),
         )
 
     class DirectoryListing(Base):
@@ -63,7 +65,7 @@ class database(BaseDB):
 
     @staticmethod
     def db_schema(db_conn):
-        Base.metadata.create_all(db_conn)
+        create_schema(db_conn, Base.metadata)
 
     def reflect_tables(self):
         self.CredentialsTable = self.reflect_table(self.Credential)
@@ -72,94 +74,24 @@ class database(BaseDB):
         self.DirectoryListingsTable = self.reflect_table(self.DirectoryListing)
 
     def add_host(self, host, port, banner):
-        """Check if this host is already in the DB, if not add it"""
-        hosts = []
-        updated_ids = []
-
-        q = select(self.HostsTable).filter(self.HostsTable.c.host == host)
-        results = self.db_execute(q).all()
-
-        # create new host
-        if not results:
-            new_host = {
-                "host": host,
-                "port": port,
-                "banner": banner,
-            }
-            hosts = [new_host]
-        # update existing hosts data
-        else:
-            for host_result in results:
-                host_data = host_result._asdict()
-                nxc_logger.debug(f"host: {host_result}")
-                nxc_logger.debug(f"host_data: {host_data}")
-                # only update column if it is being passed in
-                if host is not None:
-                    host_data["host"] = host
-                if port is not None:
-                    host_data["port"] = port
-                if banner is not None:
-                    host_data["banner"] = banner
-                # only add host to be updated if it has changed
-                if host_data not in hosts:
-                    hosts.append(host_data)
-                    updated_ids.append(host_data["id"])
-        nxc_logger.debug(f"Hosts: {hosts}")
-
-        # TODO: find a way to abstract this away to a single Upsert call
-        q = Insert(self.HostsTable)  # .returning(self.HostsTable.c.id)
-        update_columns = {col.name: col for col in q.excluded if col.name not in "id"}
-        q = q.on_conflict_do_update(index_elements=self.HostsTable.primary_key, set_=update_columns)
-
-        self.db_execute(q, hosts)  # .scalar()
-        # we only return updated IDs for now - when RETURNING clause is allowed we can return inserted
-        if updated_ids:
-            nxc_logger.debug(f"add_host() - Host IDs Updated: {updated_ids}")
-            return updated_ids
+        """Add the host or update the columns passed in (None keeps the stored value), returns its id in a list"""
+        host_data = {
+            "host": host,
+            "port": port,
+            "banner": banner,
+        }
+        host_id = self.upsert(self.HostsTable, host_data, ["host"])
+        nxc_logger.debug(f"add_host() - Host ID: {host_id}")
+        return [host_id]
 
     def add_credential(self, username, password):
-        """Check if this credential has already been added to the database, if not add it in."""
-        credentials = []
-
-        q = select(self.CredentialsTable).filter(func.lower(self.CredentialsTable.c.username) == func.lower(username),
-                                                 func.lower(self.CredentialsTable.c.password) == func.lower(password))
-        results = self.db_execute(q).all()
-
-        # add new credential
-        if not results:
-            new_cred = {
-                "username": username,
-                "password": password,
-            }
-            credentials = [new_cred]
-        # update existing cred data
-        else:
-            for creds in results:
-                # this will include the id, so we don't touch it
-                cred_data = creds._asdict()
-                # only update column if it is being passed in
-                if username is not None:
-                    cred_data["username"] = username
-                if password is not None:
-                    cred_data["password"] = password
-                # only add cred to be updated if it has changed
-                if cred_data not in credentials:
-                    credentials.append(cred_data)
-
-        # TODO: find a way to abstract this away to a single Upsert call
-        q_users = Insert(self.CredentialsTable)  # .returning(self.CredentialsTable.c.id)
-        update_columns_users = {col.name: col for col in q_users.excluded if col.name not in "id"}
-        q_users = q_users.on_conflict_do_update(index_elements=self.CredentialsTable.primary_key,
-                                                set_=update_columns_users)
-        nxc_logger.debug(f"Adding credentials: {credentials}")
-
-        self.db_execute(q_users, credentials)  # .scalar()
-
-        # hacky way to get cred_id since we can't use returning() yet
-        if len(credentials) == 1:
-            return self.get_credential(username, password)
-        else:
-            return credentials
+        """Add the credential or update the one matching it case-insensitively, returns its id"""
+        credential = {
+            "username": username,
+            "password": password,
+        }
+        nxc_logger.debug(f"Adding credential: {credential}")
+        return self.upsert(self.CredentialsTable, credential, [func.lower(self.CredentialsTable.c.username), func.lower(self.CredentialsTable.c.password)])
 
     def remove_credentials(self, creds_id):
         """Removes a credential ID from the database"""
@@ -248,26 +180,12 @@ class database(BaseDB):
         return self.db_execute(q).all()
 
     def add_loggedin_relation(self, cred_id, host_id):
-        relation_query = select(self.LoggedinRelationsTable).filter(
-            self.LoggedinRelationsTable.c.credid == cred_id,
-            self.LoggedinRelationsTable.c.hostid == host_id,
-        )
-        results = self.db_execute(relation_query).all()
-
-        # only add one if one doesn't already exist
-        if not results:
-            relation = {"credid": cred_id, "hostid": host_id}
-            try:
-                nxc_logger.debug(f"Inserting loggedin_relations: {relation}")
-                # TODO: find a way to abstract this away to a single Upsert call
-                q = Insert(self.LoggedinRelationsTable)  # .returning(self.LoggedinRelationsTable.c.id)
-
-                self.db_execute(q, [relation])  # .scalar()
-                inserted_id_results = self.get_loggedin_relations(cred_id, host_id)
-                nxc_logger.debug(f"Checking if relation was added: {inserted_id_results}")
-                return inserted_id_results[0].id
-            except Exception as e:
-                nxc_logger.debug(f"Error inserting LoggedinRelation: {e}")
+        relation = {"credid": cred_id, "hostid": host_id}
+        try:
+            nxc_logger.debug(f"Inserting loggedin_relations: {relation}")
+            return self.upsert(self.LoggedinRelationsTable, relation, ["credid", "hostid"])
+        except Exception as e:
+            nxc_logger.debug(f"Error inserting LoggedinRelation: {e}")
 
     def get_loggedin_relations(self, cred_id=None, host_id=None):
         q = select(self.LoggedinRelationsTable)  # .returning(self.LoggedinRelationsTable.c.id)
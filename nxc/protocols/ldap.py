@@ -347,6 +347,9 @@ class ldap(connection):
         except Exception as e:
             self.logger.debug(f"Error adding host {self.host} into db: {e!s}")
 
+    def host_info(self):
+        return {"domain": self.domain, "os": self.server_os, "signing_required": self.signing_required, "channel_binding": self.cbt_status}
+
     def print_host_info(self):
         self.logger.debug("Printing host info for LDAP")
         signing = colored("signing:Enforced", host_info_colors[0], attrs=["bold"]) if self.signing_required else colored("signing:None", host_info_colors[1], attrs=["bold"])
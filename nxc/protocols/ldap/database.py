@@ -1,9 +1,8 @@
 
-from sqlalchemy import Boolean, Column, ForeignKeyConstraint, Integer, PrimaryKeyConstraint, String, func, select, delete
-from sqlalchemy.dialects.sqlite import Insert  # used for upsert
+from sqlalchemy import Boolean, Column, ForeignKeyConstraint, Index, Integer, PrimaryKeyConstraint, String, func, select, delete
 from sqlalchemy.orm import declarative_base
 
-from nxc.database import BaseDB, format_host_query
+from nxc.database import BaseDB, credential_index, format_host_query, create_schema
 from nxc.logger import nxc_logger
 
 Base = declarative_base()
@@ -28,6 +27,7 @@ class database(BaseDB):
         __table_args__ = (
             PrimaryKeyConstraint("id"),
             ForeignKeyConstraint(["pillaged_from_hostid"], ["hosts.id"]),
+            Index("ix_users_credential", func.lower(username), func.lower(domain), func.lower(credtype), unique=True),
         )
 
     class Host(Base):
@@ -42,127 +42,46 @@ class database(BaseDB):
 
         __table_args__ = (
             PrimaryKeyConstraint("id"),
+            Index("ix_hosts_ip", "ip", unique=True),
         )
 
     @staticmethod
     def db_schema(db_conn):
-        Base.metadata.create_all(db_conn)
+        create_schema(db_conn, Base.metadata)
 
     def reflect_tables(self):
         self.UsersTable = self.reflect_table(self.User)
         self.HostsTable = self.reflect_table(self.Host)
 
     def add_host(self, ip, hostname, domain, os, signing_required, channel_binding):
-        """Check if this host has already been added to the database, if not, add it in."""
-        hosts = []
-        updated_ids = []
-
-        q = select(self.HostsTable).filter(self.HostsTable.c.ip == ip)
-        results = self.db_execute(q).all()
-
-        # create new host
-        if not results:
-            new_host = {
-                "ip": ip,
-                "hostname": hostname,
-                "domain": domain,
-                "os": os,
-                "signing_required": signing_required,
-                "channel_binding": channel_binding
-            }
-            hosts = [new_host]
-        # update existing hosts data
-        else:
-            for host in results:
-                host_data = host._asdict()
-                # only update column if it is being passed in
-                if ip is not None:
-                    host_data["ip"] = ip
-                if hostname is not None:
-                    host_data["hostname"] = hostname
-                if domain is not None:
-                    host_data["domain"] = domain
-                if os is not None:
-                    host_data["os"] = os
-                if signing_required is not None:
-                    host_data["signing_required"] = signing_required
-                if channel_binding is not None:
-                    host_data["channel_binding"] = channel_binding
-                # only add host to be updated if it has changed
-                if host_data not in hosts:
-                    hosts.append(host_data)
-                    updated_ids.append(host_data["id"])
-        nxc_logger.debug(f"Update Hosts: {hosts}")
-
-        # TODO: find a way to abstract this away to a single Upsert call
-        q = Insert(self.HostsTable)  # .returning(self.HostsTable.c.id)
-        update_columns = {col.name: col for col in q.excluded if col.name not in "id"}
-        q = q.on_conflict_do_update(index_elements=self.HostsTable.primary_key, set_=update_columns)
-
-        self.db_execute(q, hosts)  # .scalar()
-        # we only return updated IDs for now - when RETURNING clause is allowed we can return inserted
-        if updated_ids:
-            nxc_logger.debug(f"add_host() - Host IDs Updated: {updated_ids}")
-            return updated_ids
+        """Add the host or update the columns passed in (None keeps the stored value), returns its id in a list"""
+        host = {
+            "ip": ip,
+            "hostname": hostname,
+            "domain": domain,
+            "os": os,
+            "signing_required": signing_required,
+            "channel_binding": channel_binding,
+        }
+        host_id = self.upsert(self.HostsTable, host, ["ip"])
+        nxc_logger.debug(f"add_host() - Host ID: {host_id}")
+        return [host_id]
 
     def add_credential(self, credtype, domain, username, password, pillaged_from=None):
-        """Check if this credential has already been added to the database, if not add it in."""
-        credentials = []
-        groups = []
-
+        """Add the credential or update the one matching it case-insensitively, returns its id"""
         if pillaged_from and not self.is_host_valid(pillaged_from):
             nxc_logger.debug("Invalid host")
-            return
-
-        q = select(self.UsersTable).filter(
-            func.lower(self.UsersTable.c.domain) == func.lower(domain),
-            func.lower(self.UsersTable.c.username) == func.lower(username),
-            func.lower(self.UsersTable.c.credtype) == func.lower(credtype),
-        )
-        results = self.db_execute(q).all()
-
-        # add new credential
-        if not results:
-            new_cred = {
-                "credtype": credtype,
-                "domain": domain,
-                "username": username,
-                "password": password,
-                "pillaged_from": pillaged_from,
-            }
-            credentials = [new_cred]
-        # update existing cred data
-        else:
-            for creds in results:
-                # this will include the id, so we don't touch it
-                cred_data = creds._asdict()
-                # only update column if it is being passed in
-                if credtype is not None:
-                    cred_data["credtype"] = credtype
-                if domain is not None:
-                    cred_data["domain"] = domain
-                if username is not None:
-                    cred_data["username"] = username
-                if password is not None:
-                    cred_data["password"] = password
-                if pillaged_from is not None:
-                    cred_data["pillaged_from"] = pillaged_from
-                # only add cred to be updated if it has changed
-                if cred_data not in credentials:
-                    credentials.append(cred_data)
-
-        # TODO: find a way to abstract this away to a single Upsert call
-        q_users = Insert(self.UsersTable)  # .returning(self.UsersTable.c.id)
-        update_columns_users = {col.name: col for col in q_users.excluded if col.name not in "id"}
-        q_users = q_users.on_conflict_do_update(index_elements=self.UsersTable.primary_key, set_=update_columns_users)
-        nxc_logger.debug(f"Adding credentials: {credentials}")
-
-        self.db_execute(q_users, credentials)  # .scalar()
-
-        if groups:
-            q_groups = Insert(self.GroupRelationsTable)
-
-            self.db_execute(q_groups, groups)
+            return None
+
+        credential = {
+            "credtype": credtype,
+            "domain": domain,
+            "username": username,
+            "password": password,
+            "pillaged_from_hostid": pillaged_from,
+        }
+        nxc_logger.debug(f"Adding credential: {credential}")
+        return self.upsert(self.UsersTable, credential, credential_index(self.UsersTable))
 
     def remove_credentials(self, creds_id):
         """Removes a credential ID from the database"""
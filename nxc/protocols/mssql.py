@@ -131,6 +131,8 @@ class mssql(connection):
             self.logger.debug(f"NTLM challenge: {challenge!s}")
         except Exception as e:
             self.logger.info(f"Failed to receive NTLM challenge, reason: {e!s}")
+            # Recorded by its address only, the logins still link their credentials to the host id
+            self.host_id = self.db.add_host(self.host, None, None, None, len(self.mssql_instances))[0]
             return False
         else:
             ntlm_info = parse_challenge(challenge)
@@ -138,7 +140,7 @@ class mssql(connection):
             self.hostname = ntlm_info["hostname"]
             self.server_os = ntlm_info["os_version"]
             self.logger.extra["hostname"] = self.hostname
-            self.db.add_host(self.host, self.hostname, self.targetDomain, self.server_os, len(self.mssql_instances),)
+            self.host_id = self.db.add_host(self.host, self.hostname, self.targetDomain, self.server_os, len(self.mssql_instances),)[0]
 
         if self.args.domain:
             self.domain = self.args.domain
@@ -219,15 +221,13 @@ class mssql(connection):
                 raise
             self.check_if_admin()
             self.logger.success(f"{self.domain}\\{self.username}:{process_secret(self.password)} {self.mark_pwned()}")
-            self.db.add_credential("plaintext", self.domain, self.username, self.password)
-            user_id = self.db.get_credential("plaintext", domain, self.username, self.password)
-            host_id = self.db.get_hosts(self.host)[0].id
-            self.db.add_loggedin_relation(user_id, host_id)
+            user_id = self.db.add_credential("plaintext", self.domain, self.username, self.password)
+            self.db.add_loggedin_relation(user_id, self.host_id)
 
             if not self.args.local_auth and self.username != "":
                 add_user_bh(self.username, self.domain, self.logger, self.config)
             if self.admin_privs:
-                self.db.add_admin_user("plaintext", domain, self.username, self.password, self.host, user_id=user_id)
+                self.db.add_admin_user("plaintext", domain, self.username, self.password, self.host, user_id=user_id, host_id=self.host_id)
                 add_user_bh(f"{self.hostname}$", self.domain, self.logger, self.config)
             return True
         except BrokenPipeError:
@@ -256,15 +256,13 @@ class mssql(connection):
                 raise
             self.check_if_admin()
             self.logger.success(f"{self.domain}\\{self.username}:{process_secret(self.nthash)} {self.mark_pwned()}")
-            self.db.add_credential("hash", self.domain, self.username, self.nthash)
-            user_id = self.db.get_credential("hash", domain, self.username, self.nthash)
-            host_id = self.db.get_hosts(self.host)[0].id
-            self.db.add_loggedin_relation(user_id, host_id)
+            user_id = self.db.add_credential("hash", self.domain, self.username, self.nthash)
+            self.db.add_loggedin_relation(user_id, self.host_id)
 
             if not self.args.local_auth and self.username != "":
                 add_user_bh(self.username, self.domain, self.logger, self.config)
             if self.admin_privs:
-                self.db.add_admin_user("hash", domain, self.username, self.nthash, self.host, user_id=user_id)
+                self.db.add_admin_user("hash", domain, self.username, self.nthash, self.host, user_id=user_id, host_id=self.host_id)
                 add_user_bh(f"{self.hostname}$", self.domain, self.logger, self.config)
             return True
         except BrokenPipeError:
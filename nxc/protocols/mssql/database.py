@@ -1,11 +1,11 @@
 import warnings
 
-from sqlalchemy import Column, ForeignKeyConstraint, Integer, PrimaryKeyConstraint, String, func, select, insert, update, delete
+from sqlalchemy import Column, ForeignKeyConstraint, Index, Integer, PrimaryKeyConstraint, String, func, select, delete
 from sqlalchemy.dialects.sqlite import Insert  # used for upsert
 from sqlalchemy.exc import SAWarning
 from sqlalchemy.orm import declarative_base
 
-from nxc.database import BaseDB, format_host_query
+from nxc.database import BaseDB, credential_index, format_host_query, create_schema
 from nxc.logger import nxc_logger
 
 # if there is an issue with SQLAlchemy and a connection cannot be cleaned up properly it spews out annoying warnings
@@ -33,6 +33,7 @@ class database(BaseDB):
 
         __table_args__ = (
             PrimaryKeyConstraint("id"),
+            Index("ix_hosts_ip", "ip", unique=True),
         )
 
     class AdminRelation(Base):
@@ -45,6 +46,7 @@ class database(BaseDB):
             PrimaryKeyConstraint("id"),
             ForeignKeyConstraint(["userid"], ["users.id"]),
             ForeignKeyConstraint(["hostid"], ["hosts.id"]),
+            Index("ix_admin_relations_user_host", "userid", "hostid", unique=True),
         )
 
     class User(Base):
@@ -59,6 +61,7 @@ class database(BaseDB):
         __table_args__ = (
             PrimaryKeyConstraint("id"),
             ForeignKeyConstraint(["pillaged_from_hostid"], ["hosts.id"]),
+            Index("ix_users_credential", func.lower(username), func.lower(domain), func.lower(credtype), unique=True),
         )
 
     class LoggedInRelation(Base):
@@ -71,11 +74,12 @@ class database(BaseDB):
             PrimaryKeyConstraint("id"),
             ForeignKeyConstraint(["userid"], ["users.id"]),
             ForeignKeyConstraint(["hostid"], ["hosts.id"]),
+            Index("ix_loggedin_relations_user_host", "userid", "hostid", unique=True),
         )
 
     @staticmethod
     def db_schema(db_conn):
-        Base.metadata.create_all(db_conn)
+        create_schema(db_conn, Base.metadata)
 
     def reflect_tables(self):
         self.HostsTable = self.reflect_table(self.Host)
@@ -84,92 +88,32 @@ class database(BaseDB):
         self.LoggedinRelationsTable = self.reflect_table(self.LoggedInRelation)
 
     def add_host(self, ip, hostname, domain, os, instances):
-        """
-        Check if this host has already been added to the database, if not, add it in.
-        TODO: return inserted or updated row ids as a list
-        """
+        """Add the host or update the columns passed in (None keeps the stored value), returns its id in a list"""
         nxc_logger.debug(f"{domain} {ip} {os} {instances}")
         if not domain:
             domain = ""
-        hosts = []
-
-        q = select(self.HostsTable).filter(self.HostsTable.c.ip == ip)
-        results = self.db_execute(q).all()
-        nxc_logger.debug(f"mssql add_host() - hosts returned: {results}")
-
-        host_data = {
+        host = {
             "ip": ip,
             "hostname": hostname,
             "domain": domain,
             "os": os,
             "instances": instances,
         }
-
-        if not results:
-            hosts = [host_data]
-        else:
-            for host in results:
-                host_data = host._asdict()
-                if ip is not None:
-                    host_data["ip"] = ip
-                if hostname is not None:
-                    host_data["hostname"] = hostname
-                if domain is not None:
-                    host_data["domain"] = domain
-                if os is not None:
-                    host_data["os"] = os
-                if instances is not None:
-                    host_data["instances"] = instances
-                if host_data not in hosts:
-                    hosts.append(host_data)
-
-        nxc_logger.debug(f"Update Hosts: {hosts}")
-
-        # TODO: find a way to abstract this away to a single Upsert call
-        q = Insert(self.HostsTable)
-        update_columns = {col.name: col for col in q.excluded if col.name not in "id"}
-        q = q.on_conflict_do_update(index_elements=self.HostsTable.primary_key, set_=update_columns)
-        self.db_execute(q, hosts)
+        host_id = self.upsert(self.HostsTable, host, ["ip"])
+        nxc_logger.debug(f"add_host() - Host ID: {host_id}")
+        return [host_id]
 
     def add_credential(self, credtype, domain, username, password, pillaged_from=None):
-        """Check if this credential has already been added to the database, if not add it in."""
-        credential_data = {}
-        if credtype is not None:
-            credential_data["credtype"] = credtype
-        if domain is not None:
-            credential_data["domain"] = domain
-        if username is not None:
-            credential_data["username"] = username
-        if password is not None:
-            credential_data["password"] = password
-        if pillaged_from is not None:
-            credential_data["pillaged_from"] = pillaged_from
-
-        q = select(self.UsersTable).filter(
-            func.lower(self.UsersTable.c.domain) == func.lower(domain),
-            func.lower(self.UsersTable.c.username) == func.lower(username),
-            func.lower(self.UsersTable.c.credtype) == func.lower(credtype),
-        )
-        results = self.db_execute(q).all()
-
-        if not results:
-            user_data = {
-                "domain": domain,
-                "username": username,
-                "password": password,
-                "credtype": credtype,
-                "pillaged_from_hostid": pillaged_from,
-            }
-            q = insert(self.UsersTable).values(user_data)  # .returning(self.UsersTable.c.id)
-            self.db_execute(q)  # .first()
-        else:
-            for user in results:
-                # might be able to just remove this if check, but leaving it in for now
-                if not user[3] and not user[4] and not user[5]:
-                    q = update(self.UsersTable).values(credential_data)  # .returning(self.UsersTable.c.id)
-                    results = self.db_execute(q)  # .first()
-
-        nxc_logger.debug(f"add_credential(credtype={credtype}, domain={domain}, username={username}, password={password}, pillaged_from={pillaged_from})")
+        """Add the credential or update the one matching it case-insensitively, returns its id"""
+        credential = {
+            "credtype": credtype,
+            "domain": domain,
+            "username": username,
+            "password": password,
+            "pillaged_from_hostid": pillaged_from,
+        }
+        nxc_logger.debug(f"Adding credential: {credential}")
+        return self.upsert(self.UsersTable, credential, credential_index(self.UsersTable))
 
     def remove_credentials(self, creds_id):
         """Removes a credential ID from the database"""
@@ -179,7 +123,11 @@ class database(BaseDB):
             del_hosts.append(q)
         self.db_execute(q)
 
-    def add_admin_user(self, credtype, domain, username, password, host, user_id=None):
+    def add_admin_user(self, credtype, domain, username, password, host, user_id=None, host_id=None):
+        """Link the user to the host(s) as admin. With both ids known, as after a login, this is a single statement."""
+        if user_id and host_id:
+            return self.upsert(self.AdminRelationsTable, {"userid": user_id, "hostid": host_id}, ["userid", "hostid"])
+
         if user_id:
             q = select(self.UsersTable).filter(self.UsersTable.c.id == user_id)
             users = self.db_execute(q).all()
@@ -203,15 +151,7 @@ class database(BaseDB):
                 user_id = user[0]
                 host_id = host[0]
                 link = {"userid": user_id, "hostid": host_id}
-
-                q = select(self.AdminRelationsTable).filter(
-                    self.AdminRelationsTable.c.userid == user_id,
-                    self.AdminRelationsTable.c.hostid == host_id,
-                )
-                links = self.db_execute(q).all()
-
-                if not links:
-                    self.db_execute(insert(self.AdminRelationsTable).values(link))
+                self.db_execute(Insert(self.AdminRelationsTable).values(link).on_conflict_do_nothing())
 
     def get_admin_relations(self, user_id=None, host_id=None):
         if user_id:
@@ -297,26 +237,12 @@ class database(BaseDB):
         return self.db_execute(q).all()
 
     def add_loggedin_relation(self, user_id, host_id):
-        relation_query = select(self.LoggedinRelationsTable).filter(
-            self.LoggedinRelationsTable.c.userid == user_id,
-            self.LoggedinRelationsTable.c.hostid == host_id,
-        )
-        results = self.db_execute(relation_query).all()
-
-        # only add one if one doesn't already exist
-        if not results:
-            relation = {"userid": user_id, "hostid": host_id}
-            try:
-                nxc_logger.debug(f"Inserting loggedin_relations: {relation}")
-                # TODO: find a way to abstract this away to a single Upsert call
-                q = Insert(self.LoggedinRelationsTable)  # .returning(self.LoggedinRelationsTable.c.id)
-
-                self.db_execute(q, [relation])  # .scalar()
-                inserted_id_results = self.get_loggedin_relations(user_id, host_id)
-                nxc_logger.debug(f"Checking if relation was added: {inserted_id_results}")
-                return inserted_id_results[0].id
-            except Exception as e:
-                nxc_logger.debug(f"Error inserting LoggedinRelation: {e}")
+        relation = {"userid": user_id, "hostid": host_id}
+        try:
+            nxc_logger.debug(f"Inserting loggedin_relations: {relation}")
+            return self.upsert(self.LoggedinRelationsTable, relation, ["userid", "hostid"])
+        except Exception as e:
+            nxc_logger.debug(f"Error inserting LoggedinRelation: {e}")
 
     def get_loggedin_relations(self, user_id=None, host_id=None):
         q = select(self.LoggedinRelationsTable)  # .returning(self.LoggedinRelationsTable.c.id)
@@ -2,7 +2,7 @@ from sqlalchemy import Column, ForeignKeyConstraint, Integer, PrimaryKeyConstrai
 from sqlalchemy.orm import declarative_base
 
 
-from nxc.database import BaseDB
+from nxc.database import BaseDB, create_schema
 
 Base = declarative_base()
 
@@ -62,7 +62,7 @@ class database(BaseDB):
 
     @staticmethod
     def db_schema(db_conn):
-        Base.metadata.create_all(db_conn)
+        create_schema(db_conn, Base.metadata)
 
     def reflect_tables(self):
         self.CredentialsTable = self.reflect_table(self.Credential)
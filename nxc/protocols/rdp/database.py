@@ -1,8 +1,7 @@
 from sqlalchemy import Column, Boolean, UniqueConstraint, Integer, PrimaryKeyConstraint, String, select
-from sqlalchemy.dialects.sqlite import Insert
 from sqlalchemy.orm import declarative_base
 
-from nxc.database import BaseDB, format_host_query
+from nxc.database import BaseDB, format_host_query, create_schema
 from nxc.logger import nxc_logger
 
 BaseTable = declarative_base()
@@ -31,60 +30,24 @@ class database(BaseDB):
 
     @staticmethod
     def db_schema(db_conn):
-        BaseTable.metadata.create_all(db_conn)
+        create_schema(db_conn, BaseTable.metadata)
 
     def reflect_tables(self):
         self.HostsTable = self.reflect_table(self.Host)
 
     def add_host(self, ip, port, hostname, domain, os, nla):
-        """
-        Check if this host has already been added to the database, if not, add it in.
-        TODO: return inserted or updated row ids as a list
-        """
-        hosts = []
-
-        q = select(self.HostsTable).filter(self.HostsTable.c.ip == ip)
-        results = self.db_execute(q).all()
-        nxc_logger.debug(f"rdp add_host() - hosts returned: {results}")
-
-        # create new host
-        if not results:
-            new_host = {
-                "ip": ip,
-                "port": port,
-                "hostname": hostname,
-                "domain": domain,
-                "os": os,
-                "nla": nla
-            }
-            hosts = [new_host]
-        # update existing hosts data
-        else:
-            for host in results:
-                host_data = host._asdict()
-                # only update column if it is being passed in
-                if ip is not None:
-                    host_data["ip"] = ip
-                if port is not None:
-                    host_data["port"] = port
-                if hostname is not None:
-                    host_data["hostname"] = hostname
-                if domain is not None:
-                    host_data["domain"] = domain
-                if os is not None:
-                    host_data["os"] = os
-                if nla is not None:
-                    host_data["nla"] = nla
-                # only add host to be updated if it has changed
-                if host_data not in hosts:
-                    hosts.append(host_data)
-        nxc_logger.debug(f"Update Hosts: {hosts}")
-
-        # TODO: find a way to abstract this away to a single Upsert call
-        q = Insert(self.HostsTable)
-        update_columns = {col.name: col for col in q.excluded if col.name not in "id"}
-        q = q.on_conflict_do_update(index_elements=self.HostsTable.primary_key, set_=update_columns)
-        self.db_execute(q, hosts)
+        """Add the host or update the columns passed in (None keeps the stored value), returns its id in a list"""
+        host = {
+            "ip": ip,
+            "port": port,
+            "hostname": hostname,
+            "domain": domain,
+            "os": os,
+            "nla": nla,
+        }
+        host_id = self.upsert(self.HostsTable, host, ["ip"])
+        nxc_logger.debug(f"rdp add_host() - Host ID: {host_id}")
+        return [host_id]
 
     def get_hosts(self, filter_term=None, domain=None):
         """Return hosts from the database."""
@@ -39,7 +39,8 @@ from impacket.smb3structs import FILE_SHARE_WRITE, FILE_SHARE_DELETE, SMB2_0_IOC
 from impacket.dcerpc.v5 import tsts as TSTS
 
 from nxc.config import process_secret, host_info_colors, check_guest_account
-from nxc.connection import connection, sem, requires_admin, dcom_FirewallChecker
+from nxc.connection import connection, requires_admin, dcom_FirewallChecker
+from nxc.helpers import events
 from nxc.helpers.misc import gen_random_string, validate_ntlm
 from nxc.logger import NXCAdapter
 from nxc.protocols.smb.dpapi import collect_masterkeys_from_target, get_domain_backup_key, upgrade_to_dploot_connection
@@ -69,9 +70,11 @@ from dploot.triage.sccm import SCCMTriage, SCCMCred, SCCMSecret, SCCMCollection
 from time import time, ctime, sleep
 from traceback import format_exc
 from termcolor import colored
+from threading import Lock
 import contextlib
 
 smb_share_name = gen_random_string(5).upper()
+relay_list_lock = Lock()
 
 smb_error_status = [
     "STATUS_ACCOUNT_DISABLED",
@@ -270,7 +273,7 @@ class smb(connection):
             self.logger.debug(f"Error logging off system: {e}")
 
         try:
-            self.db.add_host(
+            host_ids = self.db.add_host(
                 self.host,
                 self.hostname,
                 self.domain,
@@ -278,6 +281,7 @@ class smb(connection):
                 self.smbv1,
                 self.signing,
             )
+            self.host_id = host_ids[0] if host_ids else None
         except Exception as e:
             self.logger.debug(f"Error adding host {self.host} into db: {e!s}")
 
@@ -290,6 +294,9 @@ class smb(connection):
             self.kdcHost = result["host"] if result else None
             self.logger.info(f"Resolved domain: {self.domain} with dns, kdcHost: {self.kdcHost}")
 
+    def host_info(self):
+        return {"domain": self.targetDomain, "os": self.server_os, "os_arch": self.os_arch, "signing": self.signing, "smbv1": self.smbv1, "null_auth": self.null_auth, "guest": self.is_guest, "dc": self.isdc}
+
     def print_host_info(self):
         signing = colored(f"signing:{self.signing}", host_info_colors[0], attrs=["bold"]) if self.signing else colored(f"signing:{self.signing}", host_info_colors[1], attrs=["bold"])
         smbv1 = colored(f"SMBv1:{self.smbv1}", host_info_colors[2], attrs=["bold"]) if self.smbv1 else colored(f"SMBv1:{self.smbv1}", host_info_colors[3], attrs=["bold"])
@@ -447,10 +454,8 @@ class smb(connection):
                 self.check_if_admin()
 
             self.logger.debug(f"Adding credential: {domain}/{self.username}:{self.password}")
-            self.db.add_credential("plaintext", domain, self.username, self.password)
-            user_id = self.db.get_credential("plaintext", domain, self.username, self.password)
-            host_id = self.db.get_hosts(self.host)[0].id
-            self.db.add_loggedin_relation(user_id, host_id)
+            user_id = self.db.add_credential("plaintext", domain, self.username, self.password)
+            self.db.add_loggedin_relation(user_id, self.host_id)
 
             out = f"{domain}\\{self.username}:{process_secret(self.password)} {self.mark_guest()}{self.mark_pwned()}"
             self.logger.success(out)
@@ -459,7 +464,7 @@ class smb(connection):
                 add_user_bh(self.username, self.domain, self.logger, self.config)
             if self.admin_privs:
                 self.logger.debug(f"Adding admin user: {self.domain}/{self.username}:{self.password}@{self.host}")
-                self.db.add_admin_user("plaintext", domain, self.username, self.password, self.host, user_id=user_id)
+                self.db.add_admin_user("plaintext", domain, self.username, self.password, self.host, user_id=user_id, host_id=self.host_id)
                 add_user_bh(f"{self.hostname}$", domain, self.logger, self.config)
 
             # check https://github.com/byt3bl33d3r/CrackMapExec/issues/321
@@ -512,10 +517,8 @@ class smb(connection):
             if "Unix" not in self.server_os:
                 self.check_if_admin()
 
-            self.db.add_credential("hash", domain, self.username, self.hash)
-            user_id = self.db.get_credential("hash", domain, self.username, self.hash)
-            host_id = self.db.get_hosts(self.host)[0].id
-            self.db.add_loggedin_relation(user_id, host_id)
+            user_id = self.db.add_credential("hash", domain, self.username, self.hash)
+            self.db.add_loggedin_relation(user_id, self.host_id)
 
             out = f"{domain}\\{self.username}:{process_secret(self.hash)} {self.mark_guest()}{self.mark_pwned()}"
             self.logger.success(out)
@@ -523,7 +526,7 @@ class smb(connection):
             if not self.args.local_auth and self.username != "":
                 add_user_bh(self.username, self.domain, self.logger, self.config)
             if self.admin_privs:
-                self.db.add_admin_user("hash", domain, self.username, nthash, self.host, user_id=user_id)
+                self.db.add_admin_user("hash", domain, self.username, nthash, self.host, user_id=user_id, host_id=self.host_id)
                 add_user_bh(f"{self.hostname}$", domain, self.logger, self.config)
 
             # check https://github.com/byt3bl33d3r/CrackMapExec/issues/321
@@ -654,7 +657,7 @@ class smb(connection):
 
     def gen_relay_list(self):
         if self.server_os.lower().find("windows") != -1 and self.signing is False:
-            with sem, open(self.args.gen_relay_list, "a+") as relay_list:
+            with relay_list_lock, open(self.args.gen_relay_list, "a+") as relay_list:
                 if self.host not in relay_list.read():
                     relay_list.write(self.host + "\n")
 
@@ -1491,6 +1494,8 @@ class smb(connection):
             if self.args.shares and self.args.shares.lower() not in perms.lower():
                 continue
             self.logger.highlight(f"{name:<15} {perms:<15} {remark}")
+            if events.stream is not None:
+                self.logger.event("share", share=name, access=share["access"], remark=remark, username=self.username, domain=self.domain)
         return permissions
 
     def dir(self):
@@ -2388,7 +2393,9 @@ class smb(connection):
 
         try:
             self.logger.success("Dumping the NTDS, this could take a while so go grab a redbull...")
-            NTDS.dump()
+            # add_hash() is called per secret, queue the credentials and write them in large transactions
+            with self.db.batched_writes() if self.db is not None else contextlib.nullcontext():
+                NTDS.dump()
             ntds_outfile = f"{self.output_filename}.ntds"
             self.logger.success(f"Dumped {highlight(add_hash.nt_lm_secrets)} NTDS hashes to {ntds_outfile} of which {highlight(add_hash.added_to_db)} were added to the database")
             if self.args.kerberos_keys:
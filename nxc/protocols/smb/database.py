@@ -1,25 +1,28 @@
 import base64
 import threading
-import warnings
 from datetime import datetime
 
-from sqlalchemy import Boolean, Column, ForeignKeyConstraint, Integer, PrimaryKeyConstraint, String, UniqueConstraint, func, select, delete
+from sqlalchemy import Boolean, Column, ForeignKeyConstraint, Index, Integer, PrimaryKeyConstraint, String, UniqueConstraint, func, select, delete
 from sqlalchemy.dialects.sqlite import Insert  # used for upsert
-from sqlalchemy.exc import (
-    SAWarning
-)
 from sqlalchemy.orm import declarative_base
 
-from nxc.database import BaseDB, format_host_query
+from nxc.database import BaseDB, credential_index, format_host_query, create_schema, upsert_set
 from nxc.logger import nxc_logger
 
-# if there is an issue with SQLAlchemy and a connection cannot be cleaned up properly it spews out annoying warnings
-warnings.filterwarnings("ignore", category=SAWarning)
-
 BaseTable = declarative_base()
 
+# A credential keeps the first host it was pillaged from, later dumps only fill it when empty
+PILLAGED_FROM_KEPT = ("pillaged_from_hostid",)
+
+
+def credential_key(credtype, domain, username):
+    """Credentials are matched case insensitively on these three columns"""
+    return (str(credtype).lower(), str(domain).lower(), str(username).lower())
+
 
 class database(BaseDB):
+    batched_calls = ("add_credential",)
+
     def __init__(self, db_engine):
         self.HostsTable = None
         self.UsersTable = None
@@ -56,6 +59,7 @@ class database(BaseDB):
         __table_args__ = (
             PrimaryKeyConstraint("id"),
             UniqueConstraint("ip"),
+            Index("ix_hosts_domain", func.lower(domain)),
         )
 
     class ConfCheck(BaseTable):
@@ -80,6 +84,7 @@ class database(BaseDB):
             PrimaryKeyConstraint("id"),
             ForeignKeyConstraint(["host_id"], ["hosts.id"]),
             ForeignKeyConstraint(["check_id"], ["conf_checks.id"]),
+            Index("ix_conf_checks_results_host", "host_id", "check_id"),
         )
 
     class User(BaseTable):
@@ -94,6 +99,8 @@ class database(BaseDB):
         __table_args__ = (
             PrimaryKeyConstraint("id"),
             ForeignKeyConstraint(["pillaged_from_hostid"], ["hosts.id"]),
+            # Credentials are matched case-insensitively, username first since it is the most selective
+            Index("ix_users_credential", func.lower(username), func.lower(domain), func.lower(credtype), unique=True),
         )
 
     class Group(BaseTable):
@@ -107,6 +114,8 @@ class database(BaseDB):
 
         __table_args__ = (
             PrimaryKeyConstraint("id"),
+            # Groups are matched case-insensitively, the conflict target of add_group()
+            Index("ix_groups_name", func.lower(name), func.lower(domain), unique=True),
         )
 
     class AdminRelation(BaseTable):
@@ -119,6 +128,7 @@ class database(BaseDB):
             PrimaryKeyConstraint("id"),
             ForeignKeyConstraint(["userid"], ["users.id"]),
             ForeignKeyConstraint(["hostid"], ["hosts.id"]),
+            Index("ix_admin_relations_user_host", "userid", "hostid", unique=True),
         )
 
     class GroupRelation(BaseTable):
@@ -131,6 +141,7 @@ class database(BaseDB):
             PrimaryKeyConstraint("id"),
             ForeignKeyConstraint(["userid"], ["users.id"]),
             ForeignKeyConstraint(["groupid"], ["groups.id"]),
+            Index("ix_group_relations_user_group", "userid", "groupid", unique=True),
         )
 
     class Share(BaseTable):
@@ -160,6 +171,7 @@ class database(BaseDB):
             PrimaryKeyConstraint("id"),
             ForeignKeyConstraint(["userid"], ["users.id"]),
             ForeignKeyConstraint(["hostid"], ["hosts.id"]),
+            Index("ix_loggedin_relations_user_host", "userid", "hostid", unique=True),
         )
 
     class DpapiSecret(BaseTable):
@@ -190,7 +202,7 @@ class database(BaseDB):
 
     @staticmethod
     def db_schema(db_conn):
-        BaseTable.metadata.create_all(db_conn)
+        create_schema(db_conn, BaseTable.metadata)
 
     def reflect_tables(self):
         self.HostsTable = self.reflect_table(self.Host)
@@ -219,139 +231,88 @@ class database(BaseDB):
         petitpotam=None,
         dc=None,
     ):
-        """Check if this host has already been added to the database, if not, add it in."""
-        hosts = []
-        updated_ids = []
-
-        q = select(self.HostsTable).filter(self.HostsTable.c.ip == ip)
-        results = self.db_execute(q).all()
-
-        # create new host
-        if not results:
-            new_host = {
-                "ip": ip,
-                "hostname": hostname,
-                "domain": domain,
-                "os": os if os is not None else "",
-                "dc": dc,
-                "smbv1": smbv1,
-                "signing": signing,
-                "spooler": spooler,
-                "zerologon": zerologon,
-                "petitpotam": petitpotam,
-            }
-            hosts = [new_host]
-        # update existing hosts data
-        else:
-            for host in results:
-                host_data = host._asdict()
-                # only update column if it is being passed in
-                if ip is not None:
-                    host_data["ip"] = ip
-                if hostname is not None:
-                    host_data["hostname"] = hostname
-                if domain is not None:
-                    host_data["domain"] = domain
-                if os is not None:
-                    host_data["os"] = os
-                if smbv1 is not None:
-                    host_data["smbv1"] = smbv1
-                if signing is not None:
-                    host_data["signing"] = signing
-                if spooler is not None:
-                    host_data["spooler"] = spooler
-                if zerologon is not None:
-                    host_data["zerologon"] = zerologon
-                if petitpotam is not None:
-                    host_data["petitpotam"] = petitpotam
-                if dc is not None:
-                    host_data["dc"] = dc
-                # only add host to be updated if it has changed
-                if host_data not in hosts:
-                    hosts.append(host_data)
-                    updated_ids.append(host_data["id"])
-        nxc_logger.debug(f"Update Hosts: {hosts}")
-
-        # TODO: find a way to abstract this away to a single Upsert call
-        q = Insert(self.HostsTable)  # .returning(self.HostsTable.c.id)
-        update_columns = {col.name: col for col in q.excluded if col.name not in "id"}
-        q = q.on_conflict_do_update(index_elements=["ip"], set_=update_columns)
-
-        self.db_execute(q, hosts)  # .scalar()
-        # we only return updated IDs for now - when RETURNING clause is allowed we can return inserted
-        if updated_ids:
-            nxc_logger.debug(f"add_host() - Host IDs Updated: {updated_ids}")
-            return updated_ids
+        """Add the host or update the columns passed in (None keeps the stored value), returns its id in a list"""
+        host = {
+            "ip": ip,
+            "hostname": hostname,
+            "domain": domain,
+            "os": os if os is not None else "",
+            "dc": dc,
+            "smbv1": smbv1,
+            "signing": signing,
+            "spooler": spooler,
+            "zerologon": zerologon,
+            "petitpotam": petitpotam,
+        }
+        update_columns = [column for column in host if column != "os" or os is not None]
+        host_id = self.upsert(self.HostsTable, host, ["ip"], update_columns)
+        nxc_logger.debug(f"add_host() - Host ID: {host_id}")
+        return [host_id]
 
     def add_credential(self, credtype, domain, username, password, group_id=None, pillaged_from=None):
-        """Check if this credential has already been added to the database, if not add it in."""
-        credentials = []
-        groups = []
+        """Add the credential or update the one matching it case-insensitively, returns its id.
+
+        Inside batched_writes() credentials without a group are queued and written by write_credentials(), which returns None.
+        """
+        key = credential_key(credtype, domain, username)
+        secret = (credtype, domain, username, password)
+        if group_id is None:
+            # Already written with the same secret, the row keeps the first host it was pillaged from
+            user_id = self.credential_cache.get(key, (*secret, True)) if pillaged_from else self.credential_cache.get(key, (*secret, True), (*secret, False))
+            if user_id is not None:
+                return user_id
+
+        writer = self.writer
+        if writer is not None and group_id is None:
+            row = {"credtype": credtype, "domain": domain, "username": username, "password": password, "pillaged_from_hostid": pillaged_from}
+            if writer.submit(self.write_credentials, key, row, PILLAGED_FROM_KEPT):
+                return None
 
         if (group_id and not self.is_group_valid(group_id)) or (pillaged_from and not self.is_host_valid(pillaged_from)):
             nxc_logger.debug("Invalid group or host")
+            return None
+
+        credential = {
+            "credtype": credtype,
+            "domain": domain,
+            "username": username,
+            "password": password,
+            "pillaged_from_hostid": pillaged_from,
+        }
+        nxc_logger.debug(f"Adding credential: {credential}")
+        user_id = self.upsert(self.UsersTable, credential, credential_index(self.UsersTable), keep_columns=PILLAGED_FROM_KEPT)
+        self.credential_cache.put(key, (*secret, bool(pillaged_from)), user_id)
+
+        if group_id is not None:
+            self.upsert(self.GroupRelationsTable, {"userid": user_id, "groupid": group_id}, ["userid", "groupid"])
+        return user_id
+
+    def write_credentials(self, conn, rows):
+        """WriteBehind handler for add_credential(): a single executemany of the same upsert"""
+        host_ids = {row["pillaged_from_hostid"] for row in rows} - {None}
+        if host_ids:
+            valid_ids = set(conn.execute(select(self.HostsTable.c.id).where(self.HostsTable.c.id.in_(host_ids))).scalars())
+            rows = [row for row in rows if row["pillaged_from_hostid"] is None or row["pillaged_from_hostid"] in valid_ids]
+        if not rows:
             return
 
-        q = select(self.UsersTable).filter(
-            func.lower(self.UsersTable.c.domain) == func.lower(domain),
-            func.lower(self.UsersTable.c.username) == func.lower(username),
-            func.lower(self.UsersTable.c.credtype) == func.lower(credtype),
+        nxc_logger.debug(f"Batched credentials: {len(rows)} upserted")
+        q = Insert(self.UsersTable)
+        q = q.on_conflict_do_update(
+            index_elements=credential_index(self.UsersTable),
+            set_=upsert_set(q, self.UsersTable, rows[0], PILLAGED_FROM_KEPT),
         )
-        results = self.db_execute(q).all()
-
-        # add new credential
-        if not results:
-            new_cred = {
-                "credtype": credtype,
-                "domain": domain,
-                "username": username,
-                "password": password,
-                "groupid": group_id,
-                "pillaged_from": pillaged_from,
-            }
-            credentials = [new_cred]
-        # update existing cred data
-        else:
-            for creds in results:
-                # this will include the id, so we don't touch it
-                cred_data = creds._asdict()
-                # only update column if it is being passed in
-                if credtype is not None:
-                    cred_data["credtype"] = credtype
-                if domain is not None:
-                    cred_data["domain"] = domain
-                if username is not None:
-                    cred_data["username"] = username
-                if password is not None:
-                    cred_data["password"] = password
-                if group_id is not None:
-                    cred_data["groupid"] = group_id
-                    groups.append({"userid": cred_data["id"], "groupid": group_id})
-                if pillaged_from is not None:
-                    cred_data["pillaged_from"] = pillaged_from
-                # only add cred to be updated if it has changed
-                if cred_data not in credentials:
-                    credentials.append(cred_data)
-
-        # TODO: find a way to abstract this away to a single Upsert call
-        q_users = Insert(self.UsersTable)  # .returning(self.UsersTable.c.id)
-        update_columns_users = {col.name: col for col in q_users.excluded if col.name not in "id"}
-        q_users = q_users.on_conflict_do_update(index_elements=self.UsersTable.primary_key, set_=update_columns_users)
-        nxc_logger.debug(f"Adding credentials: {credentials}")
-
-        self.db_execute(q_users, credentials)  # .scalar()
-
-        if groups:
-            q_groups = Insert(self.GroupRelationsTable)
-
-            self.db_execute(q_groups, groups)
+        conn.execute(q, rows)
 
     def remove_credentials(self, creds_id):
         """Removes a credential ID from the database"""
         self.db_execute(delete(self.UsersTable).where(self.UsersTable.c.id.in_(creds_id)))
+        self.credential_cache.clear()
 
-    def add_admin_user(self, credtype, domain, username, password, host, user_id=None):
-        add_links = []
+    def add_admin_user(self, credtype, domain, username, password, host, user_id=None, host_id=None):
+        """Link the user to the host(s) as admin. With both ids known, as after a login, this is a single statement."""
+        if user_id and host_id:
+            return self.upsert(self.AdminRelationsTable, {"userid": user_id, "hostid": host_id}, ["userid", "hostid"])
 
         creds_q = select(self.UsersTable)
         creds_q = creds_q.filter(self.UsersTable.c.id == user_id) if user_id else creds_q.filter(
@@ -364,23 +325,8 @@ class database(BaseDB):
 
         if users and hosts:
             nxc_logger.debug(f"users: {users}, hosts: {hosts}")
-            for user, host in zip(users, hosts, strict=True):
-                user_id = user[0]
-                host_id = host[0]
-                link = {"userid": user_id, "hostid": host_id}
-                admin_relations_select = select(self.AdminRelationsTable).filter(
-                    self.AdminRelationsTable.c.userid == user_id,
-                    self.AdminRelationsTable.c.hostid == host_id,
-                )
-                links = self.db_execute(admin_relations_select).all()
-
-                if not links:
-                    add_links.append(link)
-
-        admin_relations_insert = Insert(self.AdminRelationsTable)
-
-        if add_links:
-            self.db_execute(admin_relations_insert, add_links)
+            links = [{"userid": user[0], "hostid": host[0]} for user, host in zip(users, hosts, strict=True)]
+            self.db_execute(Insert(self.AdminRelationsTable).on_conflict_do_nothing(), links)
 
     def get_admin_relations(self, user_id=None, host_id=None):
         if user_id:
@@ -428,12 +374,16 @@ class database(BaseDB):
 
         return self.db_execute(q).all()
 
+    def iter_credentials(self, page_size=500, **filters):
+        """Pages of credentials filtered by column (e.g. credtype="hash", domain="corp")"""
+        return self.iter_pages(self.UsersTable, page_size, **filters)
+
     def get_credential(self, cred_type, domain, username, password):
         q = select(self.UsersTable).filter(
-            self.UsersTable.c.domain == domain,
-            self.UsersTable.c.username == username,
+            func.lower(self.UsersTable.c.username) == func.lower(username),
+            func.lower(self.UsersTable.c.domain) == func.lower(domain),
+            func.lower(self.UsersTable.c.credtype) == func.lower(cred_type),
             self.UsersTable.c.password == password,
-            self.UsersTable.c.credtype == cred_type,
         )
         results = self.db_execute(q).first()
         return results.id
@@ -489,6 +439,10 @@ class database(BaseDB):
         nxc_logger.debug(f"smb hosts() - results: {results}")
         return results
 
+    def iter_hosts(self, page_size=500, **filters):
+        """Pages of hosts filtered by column (e.g. dc=True, domain="corp", os="2019"), see BaseDB.iter_pages()"""
+        return self.iter_pages(self.HostsTable, page_size, **filters)
+
     def is_group_valid(self, group_id):
         """Check if this group ID is valid."""
         q = select(self.GroupsTable).filter(self.GroupsTable.c.id == group_id)
@@ -500,67 +454,17 @@ class database(BaseDB):
         return valid
 
     def add_group(self, domain, name, rid=None, member_count_ad=None):
-        results = self.get_groups(group_name=name, group_domain=domain)
-
-        groups = []
-        updated_ids = []
-
-        group_data = {
+        """Add the group or update the one matching it case-insensitively, returns a list holding its id"""
+        group = {
             "domain": domain,
             "name": name,
             "rid": rid,
             "member_count_ad": member_count_ad,
-            "last_query_time": None,
+            "last_query_time": datetime.now().isoformat() if member_count_ad is not None else None,
         }
-
-        if not results:
-            if member_count_ad is not None:
-                group_data["member_count_ad"] = member_count_ad
-                today = datetime.now()
-                iso_date = today.isoformat()
-                group_data["last_query_time"] = iso_date
-            groups = [group_data]
-
-            # insert the group and get the returned id right away, this can be refactored when we can use RETURNING
-            q = Insert(self.GroupsTable)
-
-            self.db_execute(q, groups)
-            new_group_data = self.get_groups(group_name=group_data["name"], group_domain=group_data["domain"])
-            returned_id = [new_group_data[0].id]
-            nxc_logger.debug(f"Inserted group with ID: {returned_id[0]}")
-            return returned_id
-        else:
-            for group in results:
-                g_data = group._asdict()
-                if domain is not None:
-                    g_data["domain"] = domain
-                if name is not None:
-                    g_data["name"] = name
-                if rid is not None:
-                    g_data["rid"] = rid
-                if member_count_ad is not None:
-                    g_data["member_count_ad"] = member_count_ad
-                    today = datetime.now()
-                    iso_date = today.isoformat()
-                    g_data["last_query_time"] = iso_date
-                # only add it to the upsert query if it's changed to save query execution time
-                if g_data not in groups:
-                    groups.append(g_data)
-                    updated_ids.append(g_data["id"])
-
-        nxc_logger.debug(f"Update Groups: {groups}")
-
-        # TODO: find a way to abstract this away to a single Upsert call
-        q = Insert(self.GroupsTable)  # .returning(self.GroupsTable.c.id)
-        update_columns = {col.name: col for col in q.excluded if col.name not in "id"}
-        q = q.on_conflict_do_update(index_elements=self.GroupsTable.primary_key, set_=update_columns)
-
-        self.db_execute(q, groups)
-        # TODO: always return a list and fix code references to not expect a single integer
-        #
-        if updated_ids:
-            nxc_logger.debug(f"Updated groups with IDs: {updated_ids}")
-        return updated_ids
+        group_id = self.upsert(self.GroupsTable, group, [func.lower(self.GroupsTable.c.name), func.lower(self.GroupsTable.c.domain)])
+        nxc_logger.debug(f"Upserted group with ID: {group_id}")
+        return [group_id]
 
     def get_groups(self, filter_term=None, group_name=None, group_domain=None):
         """Return groups from the database"""
@@ -650,10 +554,7 @@ class database(BaseDB):
             "read": read,
             "write": write,
         }
-        self.db_execute(
-            Insert(self.SharesTable).on_conflict_do_nothing(),  # .returning(self.SharesTable.c.id),
-            share_data,
-        )  # .scalar_one()
+        return self.upsert(self.SharesTable, share_data, ["hostid", "userid", "name"])
 
     def get_shares(self, filter_term=None):
         if self.is_share_valid(filter_term):
@@ -665,6 +566,10 @@ class database(BaseDB):
             q = select(self.SharesTable)
         return self.db_execute(q).all()
 
+    def iter_shares(self, page_size=500, **filters):
+        """Pages of shares filtered by column (e.g. hostid=1, write=True)"""
+        return self.iter_pages(self.SharesTable, page_size, **filters)
+
     def get_shares_by_access(self, permissions, share_id=None):
         permissions = permissions.lower()
         q = select(self.SharesTable)
@@ -797,26 +702,12 @@ class database(BaseDB):
         return results
 
     def add_loggedin_relation(self, user_id, host_id):
-        relation_query = select(self.LoggedinRelationsTable).filter(
-            self.LoggedinRelationsTable.c.userid == user_id,
-            self.LoggedinRelationsTable.c.hostid == host_id,
-        )
-        results = self.db_execute(relation_query).all()
-
-        # only add one if one doesn't already exist
-        if not results:
-            relation = {"userid": user_id, "hostid": host_id}
-            try:
-                nxc_logger.debug(f"Inserting loggedin_relations: {relation}")
-                # TODO: find a way to abstract this away to a single Upsert call
-                q = Insert(self.LoggedinRelationsTable)  # .returning(self.LoggedinRelationsTable.c.id)
-
-                self.db_execute(q, [relation])  # .scalar()
-                inserted_id_results = self.get_loggedin_relations(user_id, host_id)
-                nxc_logger.debug(f"Checking if relation was added: {inserted_id_results}")
-                return inserted_id_results[0].id
-            except Exception as e:
-                nxc_logger.debug(f"Error inserting LoggedinRelation: {e}")
+        relation = {"userid": user_id, "hostid": host_id}
+        try:
+            nxc_logger.debug(f"Inserting loggedin_relations: {relation}")
+            return self.upsert(self.LoggedinRelationsTable, relation, ["userid", "hostid"])
+        except Exception as e:
+            nxc_logger.debug(f"Error inserting LoggedinRelation: {e}")
 
     def get_loggedin_relations(self, user_id=None, host_id=None):
         q = select(self.LoggedinRelationsTable)  # .returning(self.LoggedinRelationsTable.c.id)
@@ -842,6 +733,100 @@ class database(BaseDB):
         q = select(self.ConfChecksResultsTable)
         return self.db_execute(q).all()
 
+    # Exports stream a single joined query, hostnames and usernames are resolved by SQLite instead of a lookup per row
+
+    def export_credentials(self, detailed=False):
+        users, hosts = self.UsersTable, self.HostsTable
+        if not detailed:
+            return self.stream(select(users).order_by(users.c.id))
+        q = select(
+            users.c.id,
+            users.c.domain,
+            users.c.username,
+            users.c.password,
+            users.c.credtype,
+            func.coalesce(hosts.c.hostname, "").label("pillaged_from"),
+        ).outerjoin(hosts, hosts.c.id == users.c.pillaged_from_hostid)
+        return self.stream(q.order_by(users.c.id))
+
+    def export_hashes(self):
+        q = select(self.UsersTable.c.username, self.UsersTable.c.password).filter(self.UsersTable.c.credtype == "hash")
+        return self.stream(q.order_by(self.UsersTable.c.id))
+
+    def export_hosts(self, detailed=False, filter_term=None):
+        hosts = self.HostsTable
+        columns = hosts.c if detailed else [hosts.c.id, hosts.c.ip, hosts.c.hostname, hosts.c.domain, hosts.c.os, hosts.c.dc, hosts.c.smbv1, hosts.c.signing]
+        q = select(*columns)
+        if filter_term == "signing":
+            q = q.filter(hosts.c.signing == False)  # noqa: E712
+        return self.stream(q.order_by(hosts.c.id))
+
+    def export_shares(self, detailed=False):
+        shares, hosts, users = self.SharesTable, self.HostsTable, self.UsersTable
+        if not detailed:
+            return self.stream(select(shares).order_by(shares.c.id))
+        q = (
+            select(
+                shares.c.id,
+                func.coalesce(hosts.c.hostname, "ERROR").label("host"),
+                (users.c.domain + "\\" + users.c.username).label("user"),
+                shares.c.name,
+                shares.c.remark,
+                func.coalesce(shares.c.read, False).label("read"),
+                func.coalesce(shares.c.write, False).label("write"),
+            )
+            .outerjoin(hosts, hosts.c.id == shares.c.hostid)
+            .outerjoin(users, users.c.id == shares.c.userid)
+        )
+        return self.stream(q.order_by(shares.c.id))
+
+    def export_admin_relations(self, detailed=False):
+        relations, hosts, users = self.AdminRelationsTable, self.HostsTable, self.UsersTable
+        if not detailed:
+            return self.stream(select(relations).order_by(relations.c.id))
+        q = (
+            select(
+                relations.c.id,
+                (users.c.domain + "/" + users.c.username).label("user"),
+                hosts.c.hostname,
+            )
+            .join(users, users.c.id == relations.c.userid)
+            .join(hosts, hosts.c.id == relations.c.hostid)
+        )
+        return self.stream(q.order_by(relations.c.id))
+
+    def export_dpapi_secrets(self, detailed=False):
+        secrets, hosts = self.DpapiSecretsTable, self.HostsTable
+        if not detailed:
+            return self.stream(select(secrets).order_by(secrets.c.id))
+        q = select(
+            secrets.c.id,
+            func.coalesce(hosts.c.hostname, secrets.c.host).label("host"),
+            secrets.c.dpapi_type,
+            secrets.c.windows_user,
+            secrets.c.username,
+            secrets.c.password,
+            secrets.c.url,
+        ).outerjoin(hosts, hosts.c.ip == secrets.c.host)
+        return self.stream(q.order_by(secrets.c.id))
+
+    def export_check_results(self):
+        results, hosts, checks = self.ConfChecksResultsTable, self.HostsTable, self.ConfChecksTable
+        q = (
+            select(
+                results.c.id,
+                hosts.c.ip,
+                hosts.c.hostname,
+                checks.c.name,
+                checks.c.description,
+                results.c.secure,
+                results.c.reasons,
+            )
+            .outerjoin(hosts, hosts.c.id == results.c.host_id)
+            .outerjoin(checks, checks.c.id == results.c.check_id)
+        )
+        return self.stream(q.order_by(results.c.id))
+
     def insert_data(self, table, select_results=None, **new_row):
         """
         Insert a new row in the given table.
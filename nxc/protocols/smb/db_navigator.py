@@ -1,11 +1,33 @@
 from nxc.helpers.misc import validate_ntlm
-from nxc.nxcdb import DatabaseNavigator, print_table, print_help
+from nxc.nxcdb import DatabaseNavigator, print_table, print_help, PAGE_SIZE
 from termcolor import colored
 import functools
 
 help_header = functools.partial(colored, color="cyan", attrs=["bold"])
 help_kw = functools.partial(colored, color="green", attrs=["bold"])
 
+# Host filters that can be combined, e.g. "hosts dc domain corp.local os 2019". Signing matches hosts where it is disabled
+HOST_FLAGS = {"dc": True, "smbv1": True, "signing": False, "spooler": True, "zerologon": True, "petitpotam": True}
+HOST_TERMS = ("domain", "os")
+
+
+def parse_host_filters(line):
+    """Filters for iter_hosts() if the line only consists of host filters, None otherwise"""
+    filters = {}
+    words = iter(line.split())
+    for word in words:
+        word = word.lower()
+        if word in HOST_FLAGS:
+            filters[word] = HOST_FLAGS[word]
+        elif word in HOST_TERMS:
+            value = next(words, None)
+            if value is None:
+                return None
+            filters[word] = value
+        else:
+            return None
+    return filters
+
 
 class navigator(DatabaseNavigator):
     def display_creds(self, creds):
@@ -143,8 +165,7 @@ class navigator(DatabaseNavigator):
         filter_term = line.strip()
 
         if filter_term == "":
-            shares = self.db.get_shares()
-            self.display_shares(shares)
+            self.display_pages(self.db.iter_shares(PAGE_SIZE), self.display_shares)
         elif filter_term in ["r", "w", "rw"]:
             shares = self.db.get_shares_by_access(line)
             self.display_shares(shares)
@@ -260,9 +281,9 @@ class navigator(DatabaseNavigator):
     def do_hosts(self, line):
         filter_term = line.strip()
 
-        if filter_term == "":
-            hosts = self.db.get_hosts()
-            self.display_hosts(hosts)
+        filters = parse_host_filters(filter_term)
+        if filters is not None:
+            self.display_pages(self.db.iter_hosts(PAGE_SIZE, **filters), self.display_hosts)
         else:
             hosts = self.db.get_hosts(filter_term=filter_term)
 
@@ -412,15 +433,19 @@ class navigator(DatabaseNavigator):
 
     def help_hosts(self):
         help_string = """
-        hosts [dc|spooler|zerologon|petitpotam|filter_term]
-        By default prints all hosts
+        hosts [dc|smbv1|signing|spooler|zerologon|petitpotam|domain <domain>|os <os>|filter_term]
+        By default prints all hosts, page by page
         Table format:
         | 'HostID', 'IP', 'Hostname', 'Domain', 'OS', 'DC', 'SMBv1', 'Signing', 'Spooler', 'Zerologon', 'PetitPotam' |
-        Subcommands:
+        Subcommands (can be combined, e.g. `hosts dc domain corp.local os 2019`):
             dc - list all domain controllers
+            smbv1 - list all hosts with SMBv1 enabled
+            signing - list all hosts with SMB signing disabled
             spooler - list all hosts with Spooler service enabled
             zerologon - list all hosts vulnerable to zerologon
             petitpotam - list all hosts vulnerable to petitpotam
+            domain <domain> - list all hosts whose domain contains <domain>
+            os <os> - list all hosts whose OS contains <os>
             filter_term - filters hosts with filter_term
                 If a single host is returned (e.g. `hosts 15`, it prints the following tables:
                     Host | 'HostID', 'IP', 'Hostname', 'Domain', 'OS', 'DC', 'SMBv1', 'Signing', 'Spooler', 'Zerologon', 'PetitPotam' |
@@ -584,8 +609,7 @@ class navigator(DatabaseNavigator):
         filter_term = line.strip()
 
         if filter_term == "":
-            creds = self.db.get_credentials()
-            self.display_creds(creds)
+            self.display_pages(self.db.iter_credentials(PAGE_SIZE), self.display_creds)
         elif filter_term.split()[0].lower() == "add":
             # add format: "domain username password <notes> <credType> <sid>
             args = filter_term.split()[1:]
@@ -607,12 +631,8 @@ class navigator(DatabaseNavigator):
             else:
                 self.db.remove_credentials(args)
                 self.db.remove_admin_relation(user_ids=args)
-        elif filter_term.split()[0].lower() == "plaintext":
-            creds = self.db.get_credentials(cred_type="plaintext")
-            self.display_creds(creds)
-        elif filter_term.split()[0].lower() == "hash":
-            creds = self.db.get_credentials(cred_type="hash")
-            self.display_creds(creds)
+        elif filter_term.split()[0].lower() in ("plaintext", "hash"):
+            self.display_pages(self.db.iter_credentials(PAGE_SIZE, credtype=filter_term.split()[0].lower()), self.display_creds)
         else:
             creds = self.db.get_credentials(filter_term=filter_term)
             if len(creds) != 1:
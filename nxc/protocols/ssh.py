@@ -56,6 +56,9 @@ class ssh(connection):
             }
         )
 
+    def host_info(self):
+        return {"version": self.remote_version}
+
     def print_host_info(self):
         self.logger.display(self.remote_version if self.remote_version != "Unknown SSH Version" else f"{self.remote_version}, skipping...")
 
@@ -63,7 +66,7 @@ class ssh(connection):
         if self.conn._transport.remote_version:
             self.remote_version = self.conn._transport.remote_version
         self.logger.debug(f"Remote version: {self.remote_version}")
-        self.db.add_host(self.host, self.port, self.remote_version)
+        self.host_id = self.db.add_host(self.host, self.port, self.remote_version)[0]
 
     def create_conn_obj(self):
         self.conn = paramiko.SSHClient()
@@ -140,7 +143,7 @@ class ssh(connection):
         return False
 
     def check_shell(self, cred_id):
-        host_id = self.db.get_hosts(self.host)[0].id
+        host_id = self.host_id
 
         # Some IOT devices will not raise exception in self.conn._transport.auth_password / self.conn._transport.auth_publickey
         # Check Linux
@@ -1,10 +1,10 @@
 import configparser
 
-from sqlalchemy import Boolean, Column, ForeignKeyConstraint, Integer, PrimaryKeyConstraint, String, select, func, delete
+from sqlalchemy import Boolean, Column, ForeignKeyConstraint, Index, Integer, PrimaryKeyConstraint, String, select, func, delete
 from sqlalchemy.dialects.sqlite import Insert
 from sqlalchemy.orm import declarative_base
 
-from nxc.database import BaseDB, format_host_query
+from nxc.database import BaseDB, format_host_query, create_schema
 from nxc.logger import nxc_logger
 from nxc.paths import CONFIG_PATH
 
@@ -47,6 +47,7 @@ class database(BaseDB):
 
         __table_args__ = (
             PrimaryKeyConstraint("id"),
+            Index("ix_hosts_host", "host", unique=True),
         )
 
     class LoggedInRelation(Base):
@@ -60,6 +61,7 @@ class database(BaseDB):
             PrimaryKeyConstraint("id"),
             ForeignKeyConstraint(["credid"], ["credentials.id"]),
             ForeignKeyConstraint(["hostid"], ["hosts.id"]),
+            Index("ix_loggedin_relations_cred_host", "credid", "hostid", unique=True),
         )
 
     # "admin" access with SSH means we have root access, which implies shell access since we run commands to check
@@ -73,6 +75,7 @@ class database(BaseDB):
             PrimaryKeyConstraint("id"),
             ForeignKeyConstraint(["credid"], ["credentials.id"]),
             ForeignKeyConstraint(["hostid"], ["hosts.id"]),
+            Index("ix_admin_relations_cred_host", "credid", "hostid", unique=True),
         )
 
     class Key(Base):
@@ -84,11 +87,12 @@ class database(BaseDB):
         __table_args__ = (
             PrimaryKeyConstraint("id"),
             ForeignKeyConstraint(["credid"], ["credentials.id"]),
+            Index("ix_keys_credid", "credid", unique=True),
         )
 
     @staticmethod
     def db_schema(db_conn):
-        Base.metadata.create_all(db_conn)
+        create_schema(db_conn, Base.metadata)
 
     def reflect_tables(self):
         self.CredentialsTable = self.reflect_table(self.Credential)
@@ -98,119 +102,43 @@ class database(BaseDB):
         self.KeysTable = self.reflect_table(self.Key)
 
     def add_host(self, host, port, banner, os=None):
-        """Check if this host has already been added to the database, if not, add it in."""
-        hosts = []
-        updated_ids = []
-
-        q = select(self.HostsTable).filter(self.HostsTable.c.host == host)
-        results = self.db_execute(q).all()
-        nxc_logger.debug(f"add_host(): Initial hosts results: {results}")
-
-        # create new host
-        if not results:
-            new_host = {
-                "host": host,
-                "port": port,
-                "banner": banner if banner is not None else "",
-                "os": os if os is not None else "",
-            }
-            hosts = [new_host]
-        # update existing hosts data
-        else:
-            for host_result in results:
-                host_data = host_result._asdict()
-                nxc_logger.debug(f"host: {host_result}")
-                nxc_logger.debug(f"host_data: {host_data}")
-                # only update column if it is being passed in
-                if host is not None:
-                    host_data["host"] = host
-                if port is not None:
-                    host_data["port"] = port
-                if banner is not None:
-                    host_data["banner"] = banner
-                if os is not None:
-                    host_data["os"] = os
-                # only add host to be updated if it has changed
-                if host_data not in hosts:
-                    hosts.append(host_data)
-                    updated_ids.append(host_data["id"])
-        nxc_logger.debug(f"Hosts: {hosts}")
-
-        # TODO: find a way to abstract this away to a single Upsert call
-        q = Insert(self.HostsTable)  # .returning(self.HostsTable.c.id)
-        update_columns = {col.name: col for col in q.excluded if col.name not in "id"}
-        q = q.on_conflict_do_update(index_elements=self.HostsTable.primary_key, set_=update_columns)
-
-        self.db_execute(q, hosts)  # .scalar()
-        # we only return updated IDs for now - when RETURNING clause is allowed we can return inserted
-        if updated_ids:
-            nxc_logger.debug(f"add_host() - Host IDs Updated: {updated_ids}")
-            return updated_ids
+        """Add the host or update the columns passed in (None keeps the stored value), returns its id in a list"""
+        host_data = {
+            "host": host,
+            "port": port,
+            "banner": banner if banner is not None else "",
+            "os": os if os is not None else "",
+        }
+        # A missing banner or os is stored empty on a new host, it never overwrites a known one
+        update_columns = [column for column, value in {"host": host, "port": port, "banner": banner, "os": os}.items() if value is not None]
+        host_id = self.upsert(self.HostsTable, host_data, ["host"], update_columns)
+        nxc_logger.debug(f"add_host() - Host ID: {host_id}")
+        return [host_id]
 
     def add_credential(self, credtype, username, password, key=None):
-        """Check if this credential has already been added to the database, if not add it in."""
-        credentials = []
-
-        # a user can have multiple keys, all with passphrases, and a separate login password
+        """Add the credential or update the one it matches, returns its id.
+
+        A user can have multiple keys, all with passphrases, and a separate login password: key credentials
+        are matched by their key, the others by username and type. As these rows share no unique key the
+        match is looked up first and the upsert is on the id, a new credential being inserted with a NULL id.
+        """
+        q = select(self.CredentialsTable.c.id).filter(
+            func.lower(self.CredentialsTable.c.username) == func.lower(username),
+            func.lower(self.CredentialsTable.c.credtype) == func.lower(credtype),
+        )
         if key is not None:
-            q = (
-                select(self.CredentialsTable)
-                .join(self.KeysTable)
-                .filter(
-                    func.lower(self.CredentialsTable.c.username) == func.lower(username),
-                    func.lower(self.CredentialsTable.c.credtype) == func.lower(credtype),
-                    self.KeysTable.c.data == key,
-                )
-            )
-            results = self.db_execute(q).all()
-        else:
-            q = select(self.CredentialsTable).filter(
-                func.lower(self.CredentialsTable.c.username) == func.lower(username),
-                func.lower(self.CredentialsTable.c.credtype) == func.lower(credtype),
-            )
-            results = self.db_execute(q).all()
-
-        # add new credential
-        if not results:
-            new_cred = {
-                "credtype": credtype,
-                "username": username,
-                "password": password,
-            }
-            credentials = [new_cred]
-        # update existing cred data
-        else:
-            for creds in results:
-                # this will include the id, so we don't touch it
-                cred_data = creds._asdict()
-                # only update column if it is being passed in
-                if credtype is not None:
-                    cred_data["credtype"] = credtype
-                if username is not None:
-                    cred_data["username"] = username
-                if password is not None:
-                    cred_data["password"] = password
-                # only add cred to be updated if it has changed
-                if cred_data not in credentials:
-                    credentials.append(cred_data)
-
-        # TODO: find a way to abstract this away to a single Upsert call
-        q_users = Insert(self.CredentialsTable)  # .returning(self.CredentialsTable.c.id)
-        update_columns_users = {col.name: col for col in q_users.excluded if col.name not in "id"}
-        q_users = q_users.on_conflict_do_update(index_elements=self.CredentialsTable.primary_key,
-                                                set_=update_columns_users)
-        nxc_logger.debug(f"Adding credentials: {credentials}")
-
-        self.db_execute(q_users, credentials)  # .scalar()
-
-        # hacky way to get cred_id since we can't use returning() yet
-        if len(credentials) == 1:
-            cred_id = self.get_credential(credtype, username, password)
-            if key is not None:
-                self.add_key(cred_id, key)
-            return cred_id
-        else:
-            return credentials
+            q = q.join(self.KeysTable).filter(self.KeysTable.c.data == key)
+        credential = {
+            "id": self.db_execute(q).scalar(),
+            "credtype": credtype,
+            "username": username,
+            "password": password,
+        }
+        nxc_logger.debug(f"Adding credential: {credential}")
+        cred_id = self.upsert(self.CredentialsTable, credential, ["id"], ["credtype", "username", "password"])
+        if key is not None:
+            self.add_key(cred_id, key)
+        return cred_id
 
     def remove_credentials(self, creds_id):
         """Removes a credential ID from the database"""
@@ -221,16 +149,7 @@ class database(BaseDB):
         self.db_execute(q)
 
     def add_key(self, cred_id, key):
-        # check if key relation already exists
-        check_q = self.db_execute(select(self.KeysTable).filter(self.KeysTable.c.credid == cred_id)).all()
-        nxc_logger.debug(f"check_q: {check_q}")
-        if check_q:
-            nxc_logger.debug(f"Key already exists for cred_id {cred_id}")
-            return None
-
-        key_data = {"credid": cred_id, "data": key}
-        self.db_execute(Insert(self.KeysTable), key_data)
-        key_id = self.db_execute(select(self.KeysTable).filter(self.KeysTable.c.credid == cred_id)).all()[0].id
+        key_id = self.upsert(self.KeysTable, {"credid": cred_id, "data": key}, ["credid"])
         nxc_logger.debug(f"Key added: {key_id}")
         return key_id
 
@@ -243,6 +162,10 @@ class database(BaseDB):
         return self.db_execute(q).all()
 
     def add_admin_user(self, credtype, username, secret, host_id=None, cred_id=None):
+        """Link the credential to the host(s) as admin. With both ids known, as after a login, this is a single statement."""
+        if cred_id and host_id:
+            return self.upsert(self.AdminRelationsTable, {"credid": cred_id, "hostid": host_id}, ["credid", "hostid"])
+
         add_links = []
 
         creds_q = select(self.CredentialsTable)
@@ -378,26 +301,12 @@ class database(BaseDB):
         return self.db_execute(q).all()
 
     def add_loggedin_relation(self, cred_id, host_id, shell=False):
-        relation_query = select(self.LoggedinRelationsTable).filter(
-            self.LoggedinRelationsTable.c.credid == cred_id,
-            self.LoggedinRelationsTable.c.hostid == host_id,
-        )
-        results = self.db_execute(relation_query).all()
-
-        # only add one if one doesn't already exist
-        if not results:
-            relation = {"credid": cred_id, "hostid": host_id, "shell": shell}
-            try:
-                nxc_logger.debug(f"Inserting loggedin_relations: {relation}")
-                # TODO: find a way to abstract this away to a single Upsert call
-                q = Insert(self.LoggedinRelationsTable)  # .returning(self.LoggedinRelationsTable.c.id)
-
-                self.db_execute(q, [relation])  # .scalar()
-                inserted_id_results = self.get_loggedin_relations(cred_id, host_id)
-                nxc_logger.debug(f"Checking if relation was added: {inserted_id_results}")
-                return inserted_id_results[0].id
-            except Exception as e:
-                nxc_logger.debug(f"Error inserting LoggedinRelation: {e}")
+        relation = {"credid": cred_id, "hostid": host_id, "shell": shell}
+        try:
+            nxc_logger.debug(f"Inserting loggedin_relations: {relation}")
+            return self.upsert(self.LoggedinRelationsTable, relation, ["credid", "hostid"])
+        except Exception as e:
+            nxc_logger.debug(f"Error inserting LoggedinRelation: {e}")
 
     def get_loggedin_relations(self, cred_id=None, host_id=None, shell=None):
         q = select(self.LoggedinRelationsTable)  # .returning(self.LoggedinRelationsTable.c.id)
@@ -4,7 +4,7 @@ from sqlalchemy import Column, Integer, PrimaryKeyConstraint, String
 from sqlalchemy.exc import SAWarning
 from sqlalchemy.orm import declarative_base
 
-from nxc.database import BaseDB
+from nxc.database import BaseDB, create_schema
 
 # if there is an issue with SQLAlchemy and a connection cannot be cleaned up properly it spews out annoying warnings
 warnings.filterwarnings("ignore", category=SAWarning)
@@ -44,7 +44,7 @@ class database(BaseDB):
 
     @staticmethod
     def db_schema(db_conn):
-        Base.metadata.create_all(db_conn)
+        create_schema(db_conn, Base.metadata)
 
     def reflect_tables(self):
         self.HostsTable = self.reflect_table(self.Host)
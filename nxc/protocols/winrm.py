@@ -72,7 +72,7 @@ class winrm(connection):
         self.server_os = ntlm_info["os_version"]
         self.logger.extra["hostname"] = self.hostname
 
-        self.db.add_host(self.host, self.port, self.hostname, self.targetDomain, self.server_os)
+        self.host_id = self.db.add_host(self.host, self.port, self.hostname, self.targetDomain, self.server_os)[0]
 
         if self.args.domain:
             self.domain = self.args.domain
@@ -168,14 +168,12 @@ class winrm(connection):
             self.logger.success(f"{self.domain}\\{self.username}:{process_secret(self.password)} {self.mark_pwned()}")
 
             self.logger.debug(f"Adding credential: {domain}/{self.username}:{self.password}")
-            self.db.add_credential("plaintext", domain, self.username, self.password)
-            user_id = self.db.get_credential("plaintext", domain, self.username, self.password)
-            host_id = self.db.get_hosts(self.host)[0].id
-            self.db.add_loggedin_relation(user_id, host_id)
+            user_id = self.db.add_credential("plaintext", domain, self.username, self.password)
+            self.db.add_loggedin_relation(user_id, self.host_id)
 
             if self.admin_privs:
                 self.logger.debug("Inside admin privs")
-                self.db.add_admin_user("plaintext", domain, self.username, self.password, self.host, user_id=user_id)  # , user_id=user_id)
+                self.db.add_admin_user("plaintext", domain, self.username, self.password, self.host, user_id=user_id, host_id=self.host_id)
                 add_user_bh(f"{self.hostname}$", domain, self.logger, self.config)
 
             if not self.args.local_auth and self.username != "":
@@ -220,13 +218,11 @@ class winrm(connection):
             self.check_if_admin()
             self.logger.success(f"{self.domain}\\{self.username}:{process_secret(nthash)} {self.mark_pwned()}")
 
-            self.db.add_credential("hash", domain, self.username, ntlm_hash)
-            user_id = self.db.get_credential("hash", domain, self.username, ntlm_hash)
-            host_id = self.db.get_hosts(self.host)[0].id
-            self.db.add_loggedin_relation(user_id, host_id)
+            user_id = self.db.add_credential("hash", domain, self.username, ntlm_hash)
+            self.db.add_loggedin_relation(user_id, self.host_id)
 
             if self.admin_privs:
-                self.db.add_admin_user("hash", domain, self.username, nthash, self.host, user_id=user_id)
+                self.db.add_admin_user("hash", domain, self.username, nthash, self.host, user_id=user_id, host_id=self.host_id)
                 add_user_bh(f"{self.hostname}$", domain, self.logger, self.config)
 
             if not self.args.local_auth and self.username != "":
@@ -1,8 +1,8 @@
-from sqlalchemy import Column, ForeignKeyConstraint, Integer, PrimaryKeyConstraint, String, select, func, delete
+from sqlalchemy import Column, ForeignKeyConstraint, Index, Integer, PrimaryKeyConstraint, String, select, func, delete
 from sqlalchemy.dialects.sqlite import Insert
 from sqlalchemy.orm import declarative_base
 
-from nxc.database import BaseDB, format_host_query
+from nxc.database import BaseDB, credential_index, format_host_query, create_schema
 from nxc.logger import nxc_logger
 
 Base = declarative_base()
@@ -28,6 +28,7 @@ class database(BaseDB):
 
         __table_args__ = (
             PrimaryKeyConstraint("id"),
+            Index("ix_hosts_ip", "ip", unique=True),
         )
 
     class User(Base):
@@ -42,6 +43,7 @@ class database(BaseDB):
         __table_args__ = (
             PrimaryKeyConstraint("id"),
             ForeignKeyConstraint(["pillaged_from_hostid"], ["hosts.id"]),
+            Index("ix_users_credential", func.lower(username), func.lower(domain), func.lower(credtype), unique=True),
         )
 
     class AdminRelation(Base):
@@ -54,6 +56,7 @@ class database(BaseDB):
             PrimaryKeyConstraint("id"),
             ForeignKeyConstraint(["userid"], ["users.id"]),
             ForeignKeyConstraint(["hostid"], ["hosts.id"]),
+            Index("ix_admin_relations_user_host", "userid", "hostid", unique=True),
         )
 
     class LoggedInRelation(Base):
@@ -66,11 +69,12 @@ class database(BaseDB):
             PrimaryKeyConstraint("id"),
             ForeignKeyConstraint(["userid"], ["users.id"]),
             ForeignKeyConstraint(["hostid"], ["hosts.id"]),
+            Index("ix_loggedin_relations_user_host", "userid", "hostid", unique=True),
         )
 
     @staticmethod
     def db_schema(db_conn):
-        Base.metadata.create_all(db_conn)
+        create_schema(db_conn, Base.metadata)
 
     def reflect_tables(self):
         self.HostsTable = self.reflect_table(self.Host)
@@ -79,110 +83,29 @@ class database(BaseDB):
         self.LoggedinRelationsTable = self.reflect_table(self.LoggedInRelation)
 
     def add_host(self, ip, port, hostname, domain, os=None):
-        """
-        Check if this host has already been added to the database, if not, add it in.
-        TODO: return inserted or updated row ids as a list
-        """
-        hosts = []
-
-        q = select(self.HostsTable).filter(self.HostsTable.c.ip == ip)
-        results = self.db_execute(q).all()
-        nxc_logger.debug(f"smb add_host() - hosts returned: {results}")
-
-        # create new host
-        if not results:
-            new_host = {
-                "ip": ip,
-                "port": port,
-                "hostname": hostname,
-                "domain": domain,
-                "os": os,
-            }
-            hosts = [new_host]
-        # update existing hosts data
-        else:
-            for host in results:
-                host_data = host._asdict()
-                # only update column if it is being passed in
-                if ip is not None:
-                    host_data["ip"] = ip
-                if port is not None:
-                    host_data["port"] = port
-                if hostname is not None:
-                    host_data["hostname"] = hostname
-                if domain is not None:
-                    host_data["domain"] = domain
-                if os is not None:
-                    host_data["os"] = os
-                # only add host to be updated if it has changed
-                if host_data not in hosts:
-                    hosts.append(host_data)
-        nxc_logger.debug(f"Update Hosts: {hosts}")
-
-        # TODO: find a way to abstract this away to a single Upsert call
-        q = Insert(self.HostsTable)
-        update_columns = {col.name: col for col in q.excluded if col.name not in "id"}
-        q = q.on_conflict_do_update(index_elements=self.HostsTable.primary_key, set_=update_columns)
-        self.db_execute(q, hosts)
+        """Add the host or update the columns passed in (None keeps the stored value), returns its id in a list"""
+        host = {
+            "ip": ip,
+            "port": port,
+            "hostname": hostname,
+            "domain": domain,
+            "os": os,
+        }
+        host_id = self.upsert(self.HostsTable, host, ["ip"])
+        nxc_logger.debug(f"add_host() - Host ID: {host_id}")
+        return [host_id]
 
     def add_credential(self, credtype, domain, username, password, pillaged_from=None):
-        """Check if this credential has already been added to the database, if not add it in."""
-        credentials = []
-
-        credential_data = {}
-        if credtype is not None:
-            credential_data["credtype"] = credtype
-        if domain is not None:
-            credential_data["domain"] = domain
-        if username is not None:
-            credential_data["username"] = username
-        if password is not None:
-            credential_data["password"] = password
-        if pillaged_from is not None:
-            credential_data["pillaged_from"] = pillaged_from
-
-        q = select(self.UsersTable).filter(
-            func.lower(self.UsersTable.c.domain) == func.lower(domain),
-            func.lower(self.UsersTable.c.username) == func.lower(username),
-            func.lower(self.UsersTable.c.credtype) == func.lower(credtype),
-        )
-        results = self.db_execute(q).all()
-
-        # add new credential
-        if not results:
-            new_cred = {
-                "credtype": credtype,
-                "domain": domain,
-                "username": username,
-                "password": password,
-                "pillaged_from": pillaged_from,
-            }
-            credentials = [new_cred]
-        # update existing cred data
-        else:
-            for creds in results:
-                # this will include the id, so we don't touch it
-                cred_data = creds._asdict()
-                # only update column if it is being passed in
-                if credtype is not None:
-                    cred_data["credtype"] = credtype
-                if domain is not None:
-                    cred_data["domain"] = domain
-                if username is not None:
-                    cred_data["username"] = username
-                if password is not None:
-                    cred_data["password"] = password
-                if pillaged_from is not None:
-                    cred_data["pillaged_from"] = pillaged_from
-                # only add cred to be updated if it has changed
-                if cred_data not in credentials:
-                    credentials.append(cred_data)
-
-        # TODO: find a way to abstract this away to a single Upsert call
-        q_users = Insert(self.UsersTable)  # .returning(self.UsersTable.c.id)
-        update_columns_users = {col.name: col for col in q_users.excluded if col.name not in "id"}
-        q_users = q_users.on_conflict_do_update(index_elements=self.UsersTable.primary_key, set_=update_columns_users)
-        self.db_execute(q_users, credentials)  # .scalar()
+        """Add the credential or update the one matching it case-insensitively, returns its id"""
+        credential = {
+            "credtype": credtype,
+            "domain": domain,
+            "username": username,
+            "password": password,
+            "pillaged_from_hostid": pillaged_from,
+        }
+        nxc_logger.debug(f"Adding credential: {credential}")
+        return self.upsert(self.UsersTable, credential, credential_index(self.UsersTable))
 
     def remove_credentials(self, creds_id):
         """Removes a credential ID from the database"""
@@ -192,7 +115,11 @@ class database(BaseDB):
             del_hosts.append(q)
         self.db_execute(q)
 
-    def add_admin_user(self, credtype, domain, username, password, host, user_id=None):
+    def add_admin_user(self, credtype, domain, username, password, host, user_id=None, host_id=None):
+        """Link the user to the host(s) as admin. With both ids known, as after a login, this is a single statement."""
+        if user_id and host_id:
+            return self.upsert(self.AdminRelationsTable, {"userid": user_id, "hostid": host_id}, ["userid", "hostid"])
+
         domain = domain.split(".")[0]
         add_links = []
 
@@ -213,19 +140,10 @@ class database(BaseDB):
             for user, host in zip(users, hosts, strict=True):
                 user_id = user[0]
                 host_id = host[0]
-                link = {"userid": user_id, "hostid": host_id}
-                admin_relations_select = select(self.AdminRelationsTable).filter(
-                    self.AdminRelationsTable.c.userid == user_id,
-                    self.AdminRelationsTable.c.hostid == host_id,
-                )
-                links = self.db_execute(admin_relations_select).all()
+                add_links.append({"userid": user_id, "hostid": host_id})
 
-                if not links:
-                    add_links.append(link)
-
-        admin_relations_insert = Insert(self.AdminRelationsTable)
-
-        self.db_execute(admin_relations_insert, add_links)
+        if add_links:
+            self.db_execute(Insert(self.AdminRelationsTable).on_conflict_do_nothing(), add_links)
 
     def get_admin_relations(self, user_id=None, host_id=None):
         if user_id:
@@ -347,22 +265,12 @@ class database(BaseDB):
         return self.db_execute(q).all()
 
     def add_loggedin_relation(self, user_id, host_id):
-        relation_query = select(self.LoggedinRelationsTable).filter(
-            self.LoggedinRelationsTable.c.userid == user_id,
-            self.LoggedinRelationsTable.c.hostid == host_id,
-        )
-        results = self.db_execute(relation_query).all()
-
-        # only add one if one doesn't already exist
-        if not results:
-            relation = {"userid": user_id, "hostid": host_id}
-            try:
-                # TODO: find a way to abstract this away to a single Upsert call
-                q = Insert(self.LoggedinRelationsTable)  # .returning(self.LoggedinRelationsTable.c.id)
-
-                self.db_execute(q, [relation])  # .scalar()
-            except Exception as e:
-                nxc_logger.debug(f"Error inserting LoggedinRelation: {e}")
+        relation = {"userid": user_id, "hostid": host_id}
+        try:
+            nxc_logger.debug(f"Inserting loggedin_relations: {relation}")
+            return self.upsert(self.LoggedinRelationsTable, relation, ["userid", "hostid"])
+        except Exception as e:
+            nxc_logger.debug(f"Error inserting LoggedinRelation: {e}")
 
     def get_loggedin_relations(self, user_id=None, host_id=None):
         q = select(self.LoggedinRelationsTable)  # .returning(self.LoggedinRelationsTable.c.id)
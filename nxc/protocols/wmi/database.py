@@ -1,6 +1,6 @@
 from sqlalchemy import Column, Integer, PrimaryKeyConstraint, String
 from sqlalchemy.orm import declarative_base
-from nxc.database import BaseDB
+from nxc.database import BaseDB, create_schema
 
 Base = declarative_base()
 
@@ -35,7 +35,7 @@ class database(BaseDB):
 
     @staticmethod
     def db_schema(db_conn):
-        Base.metadata.create_all(db_conn)
+        create_schema(db_conn, Base.metadata)
 
     def reflect_tables(self):
         self.CredentialsTable = self.reflect_table(self.Credential)
@@ -0,0 +1,297 @@
+from os.path import exists
+from os.path import join as path_join
+
+from sqlalchemy import Column, ForeignKeyConstraint, Index, Integer, MetaData, PrimaryKeyConstraint, String, UniqueConstraint, and_, delete, distinct, func, literal, null, select
+from sqlalchemy.dialects.sqlite import Insert
+from sqlalchemy.orm import declarative_base
+
+from nxc.database import BaseDB, create_db_engine, create_schema, ddl_transaction, expression_indexes_skipped, format_host_query
+from nxc.logger import nxc_logger
+from nxc.paths import WORKSPACE_DIR
+
+Base = declarative_base()
+
+# The protocol schemas name the same things differently, the first name present is used
+HOST_ADDRESS_COLUMNS = ("ip", "host")
+USER_TABLES = ("users", "credentials")
+RELATION_USER_COLUMNS = ("userid", "credid", "cred_id")
+RELATION_HOST_COLUMNS = ("hostid", "host_id")
+
+
+def workspace_db_path(workspace):
+    return path_join(WORKSPACE_DIR, workspace, "workspace.db")
+
+
+def open_workspace_db(workspace):
+    """WorkspaceDB of the workspace, created on first use"""
+    db_path = workspace_db_path(workspace)
+    db_engine = create_db_engine(db_path)
+    if not exists(db_path):
+        WorkspaceDB.db_schema(db_engine)
+    return WorkspaceDB(db_engine)
+
+
+def first_column(table, names):
+    return next((table.c[name] for name in names if name in table.c), None)
+
+
+def column_or_null(table, name):
+    return table.c[name] if name in table.c else null()
+
+
+class WorkspaceDB(BaseDB):
+    """Optional cross-protocol store of a workspace (workspace.db next to the protocol databases).
+
+    Hosts are shared by address and credentials by their case-insensitive identity plus secret,
+    whichever protocol found them. Side tables map them back to the rows of each protocol
+    database and hold the admin/loggedin relations per protocol, so a question such as "which
+    SMB hosts do credentials found over LDAP admin" is one indexed join instead of a scan of
+    every protocol database. sync() rebuilds it from the protocol databases with set based
+    INSERT ... SELECT statements over an ATTACHed database.
+    """
+
+    def __init__(self, db_engine):
+        self.HostsTable = None
+        self.CredentialsTable = None
+        self.ProtocolHostsTable = None
+        self.ProtocolCredentialsTable = None
+        self.AdminRelationsTable = None
+        self.LoggedinRelationsTable = None
+
+        super().__init__(db_engine)
+
+    class Host(Base):
+        __tablename__ = "hosts"
+        id = Column(Integer)
+        ip = Column(String)
+        hostname = Column(String)
+        domain = Column(String)
+        os = Column(String)
+
+        __table_args__ = (
+            PrimaryKeyConstraint("id"),
+            Index("ix_hosts_ip", "ip", unique=True),
+            Index("ix_hosts_domain", func.lower(domain)),
+        )
+
+    class Credential(Base):
+        __tablename__ = "credentials"
+        id = Column(Integer)
+        credtype = Column(String)
+        domain = Column(String)
+        username = Column(String)
+        password = Column(String)
+
+        __table_args__ = (
+            PrimaryKeyConstraint("id"),
+            Index("ix_credentials_secret", func.lower(username), func.lower(domain), func.lower(credtype), password, unique=True),
+        )
+
+    class ProtocolHost(Base):
+        __tablename__ = "protocol_hosts"
+        id = Column(Integer)
+        protocol = Column(String)
+        protocol_id = Column(Integer)
+        host_id = Column(Integer)
+
+        __table_args__ = (
+            PrimaryKeyConstraint("id"),
+            ForeignKeyConstraint(["host_id"], ["hosts.id"]),
+            UniqueConstraint("protocol", "protocol_id"),
+            Index("ix_protocol_hosts_host", "host_id", "protocol"),
+        )
+
+    class ProtocolCredential(Base):
+        __tablename__ = "protocol_credentials"
+        id = Column(Integer)
+        protocol = Column(String)
+        protocol_id = Column(Integer)
+        credential_id = Column(Integer)
+
+        __table_args__ = (
+            PrimaryKeyConstraint("id"),
+            ForeignKeyConstraint(["credential_id"], ["credentials.id"]),
+            UniqueConstraint("protocol", "protocol_id"),
+            Index("ix_protocol_credentials_credential", "credential_id", "protocol"),
+        )
+
+    class AdminRelation(Base):
+        __tablename__ = "admin_relations"
+        id = Column(Integer)
+        protocol = Column(String)
+        credential_id = Column(Integer)
+        host_id = Column(Integer)
+
+        __table_args__ = (
+            PrimaryKeyConstraint("id"),
+            ForeignKeyConstraint(["credential_id"], ["credentials.id"]),
+            ForeignKeyConstraint(["host_id"], ["hosts.id"]),
+            UniqueConstraint("credential_id", "host_id", "protocol"),
+            Index("ix_admin_relations_host", "host_id"),
+        )
+
+    class LoggedInRelation(Base):
+        __tablename__ = "loggedin_relations"
+        id = Column(Integer)
+        protocol = Column(String)
+        credential_id = Column(Integer)
+        host_id = Column(Integer)
+
+        __table_args__ = (
+            PrimaryKeyConstraint("id"),
+            ForeignKeyConstraint(["credential_id"], ["credentials.id"]),
+            ForeignKeyConstraint(["host_id"], ["hosts.id"]),
+            UniqueConstraint("credential_id", "host_id", "protocol"),
+            Index("ix_loggedin_relations_host", "host_id"),
+        )
+
+    @staticmethod
+    def db_schema(db_conn):
+        create_schema(db_conn, Base.metadata)
+
+    def reflect_tables(self):
+        self.HostsTable = self.reflect_table(self.Host)
+        self.CredentialsTable = self.reflect_table(self.Credential)
+        self.ProtocolHostsTable = self.reflect_table(self.ProtocolHost)
+        self.ProtocolCredentialsTable = self.reflect_table(self.ProtocolCredential)
+        self.AdminRelationsTable = self.reflect_table(self.AdminRelation)
+        self.LoggedinRelationsTable = self.reflect_table(self.LoggedInRelation)
+
+    def sync_workspace(self, workspace, protocols):
+        """Rebuild the store from every protocol database of the workspace"""
+        for protocol in sorted(protocols):
+            db_path = path_join(WORKSPACE_DIR, workspace, f"{protocol}.db")
+            if exists(db_path):
+                self.sync(protocol, db_path)
+        self.prune()
+
+    def sync(self, protocol, db_path):
+        """Upsert the hosts and credentials of one protocol database and rebuild its side table rows, in one transaction"""
+        self.flush()
+        with ddl_transaction(self.db_engine, attach={"source": db_path}) as conn:
+            source = MetaData()
+            with expression_indexes_skipped():
+                source.reflect(conn, schema="source")
+
+            for table in (self.AdminRelationsTable, self.LoggedinRelationsTable, self.ProtocolHostsTable, self.ProtocolCredentialsTable):
+                conn.execute(delete(table).where(table.c.protocol == protocol))
+
+            hosts = source.tables.get("source.hosts")
+            address = first_column(hosts, HOST_ADDRESS_COLUMNS) if hosts is not None else None
+            if address is not None:
+                self.sync_hosts(conn, protocol, hosts, address)
+
+            users = next((source.tables[f"source.{name}"] for name in USER_TABLES if f"source.{name}" in source.tables), None)
+            if users is not None and "username" in users.c:
+                self.sync_credentials(conn, protocol, users)
+
+            for name, relations_table in (("admin_relations", self.AdminRelationsTable), ("loggedin_relations", self.LoggedinRelationsTable)):
+                relations = source.tables.get(f"source.{name}")
+                if relations is not None:
+                    self.sync_relations(conn, protocol, relations, relations_table)
+        nxc_logger.debug(f"Synced the {protocol} database into the workspace store")
+
+    def sync_hosts(self, conn, protocol, hosts, address):
+        columns = ("hostname", "domain", "os")
+        q = Insert(self.HostsTable).from_select(
+            ["ip", *columns],
+            # the WHERE clause also keeps SQLite from parsing ON CONFLICT as part of the SELECT
+            select(address, *(column_or_null(hosts, column) for column in columns)).where(address.is_not(None)),
+        )
+        q = q.on_conflict_do_update(
+            index_elements=["ip"],
+            set_={column: func.coalesce(q.excluded[column], self.HostsTable.c[column]) for column in columns},
+        )
+        conn.execute(q)
+
+        q = select(literal(protocol), hosts.c.id, self.HostsTable.c.id).join_from(hosts, self.HostsTable, self.HostsTable.c.ip == address)
+        conn.execute(Insert(self.ProtocolHostsTable).from_select(["protocol", "protocol_id", "host_id"], q))
+
+    def sync_credentials(self, conn, protocol, users):
+        # NULLs never conflict in a unique index, so the identity columns are normalized first
+        credtype = func.coalesce(column_or_null(users, "credtype"), "plaintext")
+        domain = func.coalesce(column_or_null(users, "domain"), "")
+        password = func.coalesce(users.c.password, "")
+        q = Insert(self.CredentialsTable).from_select(
+            ["credtype", "domain", "username", "password"],
+            select(credtype, domain, users.c.username, password).where(users.c.username.is_not(None)),
+        )
+        conn.execute(q.on_conflict_do_nothing())
+
+        credentials = self.CredentialsTable
+        q = select(literal(protocol), users.c.id, credentials.c.id).join_from(
+            users,
+            credentials,
+            and_(
+                func.lower(credentials.c.username) == func.lower(users.c.username),
+                func.lower(credentials.c.domain) == func.lower(domain),
+                func.lower(credentials.c.credtype) == func.lower(credtype),
+                credentials.c.password == password,
+            ),
+        )
+        conn.execute(Insert(self.ProtocolCredentialsTable).from_select(["protocol", "protocol_id", "credential_id"], q))
+
+    def sync_relations(self, conn, protocol, relations, relations_table):
+        user_column = first_column(relations, RELATION_USER_COLUMNS)
+        host_column = first_column(relations, RELATION_HOST_COLUMNS)
+        if user_column is None or host_column is None:
+            return
+        protocol_credentials = self.ProtocolCredentialsTable
+        protocol_hosts = self.ProtocolHostsTable
+        q = (
+            select(literal(protocol), protocol_credentials.c.credential_id, protocol_hosts.c.host_id)
+            .join_from(relations, protocol_credentials, and_(protocol_credentials.c.protocol == protocol, protocol_credentials.c.protocol_id == user_column))
+            .join(protocol_hosts, and_(protocol_hosts.c.protocol == protocol, protocol_hosts.c.protocol_id == host_column))
+            .where(user_column.is_not(None))
+        )
+        conn.execute(Insert(relations_table).from_select(["protocol", "credential_id", "host_id"], q).on_conflict_do_nothing())
+
+    def prune(self):
+        """Drop the shared hosts and credentials no protocol database holds anymore"""
+        self.db_execute(delete(self.HostsTable).where(self.HostsTable.c.id.not_in(select(self.ProtocolHostsTable.c.host_id))))
+        self.db_execute(delete(self.CredentialsTable).where(self.CredentialsTable.c.id.not_in(select(self.ProtocolCredentialsTable.c.credential_id))))
+
+    def get_hosts(self, filter_term=None, protocol=None):
+        """Return the shared hosts with the protocols that have seen them"""
+        protocols = func.group_concat(distinct(self.ProtocolHostsTable.c.protocol)).label("protocols")
+        q = select(self.HostsTable, protocols).join_from(self.HostsTable, self.ProtocolHostsTable).group_by(self.HostsTable.c.id)
+        if protocol:
+            q = q.having(func.sum(self.ProtocolHostsTable.c.protocol == protocol) > 0)
+        if filter_term:
+            q = format_host_query(q, filter_term, self.HostsTable)
+        return self.db_execute(q.order_by(self.HostsTable.c.ip)).all()
+
+    def get_credentials(self, filter_term=None, protocol=None):
+        """Return the shared credentials with the protocols that have found them"""
+        protocols = func.group_concat(distinct(self.ProtocolCredentialsTable.c.protocol)).label("protocols")
+        q = select(self.CredentialsTable, protocols).join_from(self.CredentialsTable, self.ProtocolCredentialsTable).group_by(self.CredentialsTable.c.id)
+        if protocol:
+            q = q.having(func.sum(self.ProtocolCredentialsTable.c.protocol == protocol) > 0)
+        if filter_term:
+            q = q.where(func.lower(self.CredentialsTable.c.username).like(func.lower(f"%{filter_term}%")))
+        return self.db_execute(q.order_by(func.lower(self.CredentialsTable.c.username))).all()
+
+    def get_access(self, relation="admin", source=None, target=None, filter_term=None):
+        """Return (credential, host, protocol) rows of the admin or loggedin relations.
+
+        source: only credentials found by this protocol, target: only access through this protocol
+        """
+        relations = self.AdminRelationsTable if relation == "admin" else self.LoggedinRelationsTable
+        credentials = self.CredentialsTable
+        hosts = self.HostsTable
+        q = (
+            select(credentials.c.id, credentials.c.credtype, credentials.c.domain, credentials.c.username, credentials.c.password, hosts.c.ip, hosts.c.hostname, relations.c.protocol)
+            .join_from(relations, credentials, credentials.c.id == relations.c.credential_id)
+            .join(hosts, hosts.c.id == relations.c.host_id)
+        )
+        if source:
+            found_by_source = select(self.ProtocolCredentialsTable.c.id).where(
+                self.ProtocolCredentialsTable.c.credential_id == credentials.c.id,
+                self.ProtocolCredentialsTable.c.protocol == source,
+            )
+            q = q.where(found_by_source.exists())
+        if target:
+            q = q.where(relations.c.protocol == target)
+        if filter_term:
+            q = q.where(func.lower(credentials.c.username).like(func.lower(f"%{filter_term}%")))
+        return self.db_execute(q.order_by(hosts.c.ip, func.lower(credentials.c.username))).all()
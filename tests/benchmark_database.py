@@ -0,0 +1,77 @@
+import argparse
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from sqlalchemy import create_engine
+
+from nxc.database import create_db_engine
+from nxc.protocols.smb.database import database
+
+
+def get_cli_args():
+    parser = argparse.ArgumentParser(description="Benchmark SMB database throughput (operations/sec) with concurrent threads")
+    parser.add_argument("--hosts", type=int, default=2000, help="Hosts added (and read back) per run")
+    parser.add_argument("--credentials", type=int, default=20000, help="Credentials added per run, in batches like an NTDS dump")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8, 32, 128], help="Thread counts to benchmark")
+    parser.add_argument("--legacy", action="store_true", help="Also benchmark a default journaled AUTOCOMMIT engine for comparison")
+    return parser.parse_args()
+
+
+def legacy_engine(db_path):
+    return create_engine(f"sqlite:///{db_path}", isolation_level="AUTOCOMMIT", connect_args={"check_same_thread": False}, pool_size=256, future=True)
+
+
+def host_worker(db, i):
+    ip = f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}"
+    db.add_host(ip, f"host{i}", "BENCH.LOCAL", "Windows Server 2022", False, i % 2 == 0)
+    db.get_hosts(filter_term=ip)
+
+
+def credential_worker(db, start, count):
+    with db.batched_writes():
+        for i in range(start, start + count):
+            db.add_credential("hash", "BENCH.LOCAL", f"user{i}", f"aad3b435b51404eeaad3b435b51404ee:{i:032x}")
+
+
+def run(make_engine, threads, cli_args):
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "smb.db")
+        db_engine = make_engine(db_path)
+        database.db_schema(db_engine)
+        db = database(db_engine)
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            start = perf_counter()
+            for future in [executor.submit(host_worker, db, i) for i in range(cli_args.hosts)]:
+                future.result()
+            hosts_elapsed = perf_counter() - start
+
+            chunk = max(cli_args.credentials // threads, 1)
+            start = perf_counter()
+            for future in [executor.submit(credential_worker, db, i, chunk) for i in range(0, cli_args.credentials, chunk)]:
+                future.result()
+            credentials_elapsed = perf_counter() - start
+
+        db.shutdown_db()
+        db_engine.dispose()
+    return cli_args.hosts * 2 / hosts_elapsed, cli_args.credentials / credentials_elapsed
+
+
+def main():
+    cli_args = get_cli_args()
+    engines = [("wal", create_db_engine)]
+    if cli_args.legacy:
+        engines.append(("legacy", legacy_engine))
+
+    print(f"{cli_args.hosts} hosts (add + read), {cli_args.credentials} batched credentials")
+    print(f"{'engine':>8} {'threads':>8} {'host ops/sec':>14} {'creds/sec':>12}")
+    for name, make_engine in engines:
+        for threads in cli_args.threads:
+            host_rate, credential_rate = run(make_engine, threads, cli_args)
+            print(f"{name:>8} {threads:>8} {host_rate:>14.1f} {credential_rate:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import argparse
+import io
+import statistics
+from time import perf_counter
+
+from nxc.netexec import Engine, run_engine
+
+COMMANDS = {
+    "version": ["--version"],
+    "smb-help": ["smb", "--help"],
+    "smb-list": ["smb", "-L"],
+    "smb-options": ["smb", "-M", "spider_plus", "--options"],
+}
+
+
+def get_cli_args():
+    parser = argparse.ArgumentParser(description="Benchmark repeated embedded runs: cold run_engine calls against one warm Engine")
+    parser.add_argument("--runs", type=int, default=50, help="Runs per command and per path, the median is reported")
+    return parser.parse_args()
+
+
+def cold(argv):
+    run_engine(argv, io.StringIO(), io.StringIO())
+
+
+def median_ms(function, argv, runs):
+    timings = []
+    for _ in range(runs):
+        start = perf_counter()
+        function(argv)
+        timings.append((perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    cli_args = get_cli_args()
+    engine = Engine()
+    print(f"{'command':>12} {'cold ms':>10} {'engine ms':>10} {'speedup':>8}")
+    for name, argv in COMMANDS.items():
+        # Both paths run once first, so imports and the module index are not part of the timings
+        cold(argv)
+        engine.run(argv)
+        cold_ms = median_ms(cold, argv, cli_args.runs)
+        warm_ms = median_ms(engine.run, argv, cli_args.runs)
+        print(f"{name:>12} {cold_ms:>10.2f} {warm_ms:>10.2f} {cold_ms / warm_ms:>7.1f}x")
+    engine.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import argparse
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, sleep
+
+from nxc.connection import connection
+from nxc.helpers.credentials import CredentialPlan
+
+
+def get_cli_args():
+    parser = argparse.ArgumentParser(description="Benchmark authentication throughput (logins/sec) against simulated targets")
+    parser.add_argument("--targets", type=int, default=256, help="Number of simulated targets")
+    parser.add_argument("--users", type=int, default=4, help="Usernames tried against every target")
+    parser.add_argument("--passwords", type=int, default=4, help="Passwords tried against every target")
+    parser.add_argument("--latency", type=float, default=0.01, help="Simulated round trip time of a single login in seconds")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8, 32, 128, 256], help="Thread counts to benchmark")
+    return parser.parse_args()
+
+
+class simulated(connection):
+    """Protocol stub whose logins only cost network latency, so the measured rate reflects nxc's own scheduling"""
+
+    latency = 0.01
+
+    def create_conn_obj(self):
+        return True
+
+    def plaintext_login(self, domain, username, password):
+        sleep(self.latency)
+        return False
+
+
+def build_args(cli_args):
+    return Namespace(
+        protocol="simulated",
+        kerberos=False,
+        use_kcache=False,
+        aesKey=None,
+        kdcHost=None,
+        port=0,
+        dns_server=None,
+        dns_tcp=False,
+        dns_timeout=3,
+        force_ipv6=False,
+        domain="BENCH.LOCAL",
+        username=[f"user{i}" for i in range(cli_args.users)],
+        password=[f"password{i}" for i in range(cli_args.passwords)],
+        cred_id=[],
+        no_bruteforce=False,
+        continue_on_success=True,
+        ignore_pw_decoding=False,
+        jitter=None,
+        fail_limit=None,
+        ufail_limit=None,
+        gfail_limit=None,
+        pfx_cert=None,
+        pfx_base64=None,
+        pem_cert=None,
+        module=[],
+    )
+
+
+def run(args, threads, targets):
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for future in [executor.submit(simulated, args, None, f"127.0.{i // 256}.{i % 256}") for i in range(targets)]:
+            future.result()
+    return perf_counter() - start
+
+
+def main():
+    cli_args = get_cli_args()
+    simulated.latency = cli_args.latency
+    args = build_args(cli_args)
+    simulated.credential_plan = CredentialPlan.from_args(args, None)
+    logins = cli_args.targets * cli_args.users * cli_args.passwords
+
+    print(f"{cli_args.targets} targets, {logins} logins, {cli_args.latency * 1000:.1f}ms per login")
+    print(f"{'threads':>8} {'seconds':>10} {'logins/sec':>12}")
+    for threads in cli_args.threads:
+        elapsed = run(args, threads, cli_args.targets)
+        print(f"{threads:>8} {elapsed:>10.2f} {logins / elapsed:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import argparse
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from rich.text import Text
+from termcolor import colored
+
+from nxc.console import make_console, output
+from nxc.logger import NXCAdapter
+
+
+def get_cli_args():
+    parser = argparse.ArgumentParser(description="Benchmark console output throughput (lines/sec) with concurrent threads printing share lists")
+    parser.add_argument("--lines", type=int, default=200, help="Lines printed per target")
+    parser.add_argument("--targets", type=int, default=512, help="Targets, each with its own logger")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 32, 256], help="Thread counts to benchmark")
+    parser.add_argument("--legacy", action="store_true", help="Also benchmark rendering and printing synchronously in every thread, like before the output writer")
+    return parser.parse_args()
+
+
+def legacy_display(logger, console, msg):
+    msg, _ = logger.format(f"{colored('[*]', 'blue', attrs=['bold'])} {msg}", {})
+    console.print(Text.from_ansi(msg))
+
+
+def worker(target, lines, legacy, console):
+    logger = NXCAdapter(extra={"protocol": "SMB", "host": f"10.0.{target // 256}.{target % 256}", "port": 445, "hostname": f"HOST{target}"})
+    for i in range(lines):
+        msg = f"SHARE{i:<10} READ,WRITE   Remote share {i}"
+        if legacy:
+            legacy_display(logger, console, msg)
+        else:
+            logger.display(msg)
+
+
+def run(threads, cli_args, legacy):
+    with tempfile.TemporaryDirectory() as directory, open(os.path.join(directory, "out.txt"), "w") as sink:
+        stdout, sys.stdout = sys.stdout, sink
+        console = make_console(sink)
+        try:
+            start = perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                for target in range(cli_args.targets):
+                    executor.submit(worker, target, cli_args.lines, legacy, console)
+            output.flush()
+            elapsed = perf_counter() - start
+        finally:
+            sys.stdout = stdout
+    return cli_args.targets * cli_args.lines / elapsed
+
+
+def main():
+    cli_args = get_cli_args()
+    print(f"{'threads':>8} {'writer lines/s':>16}" + (f" {'legacy lines/s':>16}" if cli_args.legacy else ""))
+    for threads in cli_args.threads:
+        line = f"{threads:>8} {run(threads, cli_args, False):>16.0f}"
+        if cli_args.legacy:
+            line += f" {run(threads, cli_args, True):>16.0f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import statistics
+import subprocess
+import sys
+from time import perf_counter
+
+# Runs in a fresh interpreter: the CLI startup of run_engine, then the protocol implementation a scan would load
+SNIPPET = """
+import io, sys
+from nxc.netexec import run_engine
+run_engine(sys.argv[2:], io.StringIO(), io.StringIO())
+if sys.argv[1]:
+    from nxc.loaders.protocolloader import ProtocolLoader
+    loader = ProtocolLoader()
+    loader.load_protocol(loader.get_protocols()[sys.argv[1]]["path"])
+"""
+
+SCENARIOS = {
+    "--help": ("", ["--help"]),
+    "smb": ("smb", ["smb", "--help"]),
+    "ssh": ("ssh", ["ssh", "--help"]),
+}
+
+
+def get_cli_args():
+    parser = argparse.ArgumentParser(description="Benchmark nxc cold start latency with python -X importtime")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per scenario, the median is reported")
+    parser.add_argument("--top", type=int, default=5, help="Slowest top level imports shown per scenario")
+    parser.add_argument("scenarios", nargs="*", help=f"Scenarios to run: {', '.join(SCENARIOS)} (default: all)")
+    cli_args = parser.parse_args()
+    unknown = set(cli_args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return cli_args
+
+
+def parse_importtime(stderr):
+    """Total import time and the cumulative time of every top level import, in ms"""
+    total = 0
+    top_level = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = (field.strip() for field in line[len("import time:"):].split("|"))
+        total += int(self_us)
+        if not name.startswith(" "):
+            top_level[name.strip()] = int(cumulative_us) / 1000
+    return total / 1000, top_level
+
+
+def run(protocol, argv):
+    start = perf_counter()
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", SNIPPET, protocol, *argv], capture_output=True, text=True)
+    elapsed = (perf_counter() - start) * 1000
+    error = process.stderr.strip().splitlines()[-1] if process.returncode else None
+    return elapsed, *parse_importtime(process.stderr), error
+
+
+def main():
+    cli_args = get_cli_args()
+    print(f"{'scenario':>10} {'wall ms':>10} {'import ms':>10}  slowest imports")
+    for scenario in cli_args.scenarios or SCENARIOS:
+        results = [run(*SCENARIOS[scenario]) for _ in range(cli_args.runs)]
+        wall = statistics.median(result[0] for result in results)
+        imports = statistics.median(result[1] for result in results)
+        slowest = sorted(results[-1][2].items(), key=lambda item: item[1], reverse=True)[:cli_args.top]
+        print(f"{scenario:>10} {wall:>10.1f} {imports:>10.1f}  {', '.join(f'{name} {ms:.0f}' for name, ms in slowest)}")
+        if results[-1][3]:
+            print(f"{'':>10} failed: {results[-1][3]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import os
+
+from nxc.database import create_db_engine
+from nxc.helpers.checkpoint import CheckpointJournal, SkipFinished
+from nxc import netexec
+from nxc.netexec import Engine
+from nxc.protocols.smb import database as smb_database_module
+from nxc.protocols.smb.database import database as smb_database
+
+
+class Targets(list):
+    def total(self):
+        return len(self)
+
+
+def test_journal_resume(tmp_path):
+    path = tmp_path / "smb.journal"
+    journal = CheckpointJournal(path, "smb", "fingerprint")
+    journal.target_done("10.0.0.1")
+    journal.attempt_failed("10.0.0.2", 0, 1)
+    journal.close()
+    # A line cut short by a crash is ignored
+    with open(path, "a") as f:
+        f.write("D\t10.0.0.2")
+
+    resumed = CheckpointJournal(path, "smb", "fingerprint")
+    assert resumed.is_done("10.0.0.1")
+    assert not resumed.is_done("10.0.0.2")
+    assert resumed.failed_attempts("10.0.0.2") == {(0, 1)}
+    assert list(SkipFinished(Targets(["10.0.0.1", "10.0.0.2", "10.0.0.3"]), resumed)) == ["10.0.0.2", "10.0.0.3"]
+    resumed.close()
+
+
+def test_load_collapses_finished_targets(tmp_path):
+    path = tmp_path / "smb.journal"
+    journal = CheckpointJournal(path, "smb", "fingerprint")
+    for secret_index in range(3):
+        journal.attempt_failed("10.0.0.1", 0, secret_index)
+    journal.attempt_failed("10.0.0.2", 0, 0)
+    journal.target_done("10.0.0.1")
+    journal.close()
+
+    resumed = CheckpointJournal(path, "smb", "fingerprint")
+    assert resumed.failed == {"10.0.0.2": {(0, 0)}}
+    resumed.close()
+    assert sorted(path.read_text().splitlines()[1:]) == ["D\t10.0.0.1", "F\t10.0.0.2\t0\t0"]
+
+
+class ResumableProtocol:
+    """Stand-in for a protocol class, the first run leaves 10.0.0.2 unfinished"""
+
+    module_paths = []
+    module_registry = None
+    adaptive_window = None
+    rate_limiter = None
+    checkpoint = None
+    credential_plan = None
+    unfinished = {"10.0.0.2"}
+    scanned = []
+
+    def __init__(self, args, db, target):
+        ResumableProtocol.scanned.append(target)
+        if target in self.unfinished:
+            self.checkpoint.target_unfinished(target)
+        else:
+            self.checkpoint.target_done(target)
+
+
+def test_run_keeps_journal_until_finished(tmp_path, monkeypatch):
+    db_engine = create_db_engine(tmp_path / "smb.db")
+    smb_database.db_schema(db_engine)
+    engine = Engine()
+    monkeypatch.setattr(engine, "load_protocol", lambda protocol: (ResumableProtocol, smb_database_module, db_engine))
+    journal = str(tmp_path / "smb.journal")
+    argv = ["smb", "10.0.0.1", "10.0.0.2", "--no-progress", "-t", "1", "--resume", journal]
+
+    ResumableProtocol.scanned = []
+    assert engine.run(argv)["returncode"] == 0
+    assert sorted(ResumableProtocol.scanned) == ["10.0.0.1", "10.0.0.2"]
+    assert os.path.exists(journal)
+
+    ResumableProtocol.scanned = []
+    ResumableProtocol.unfinished = set()
+    swept = []
+    monkeypatch.setattr(netexec, "LivenessSweep", lambda targets, *args: swept.extend(targets) or swept)
+    assert engine.run([*argv, "--pre-sweep"])["returncode"] == 0
+    # The finished target is not probed again
+    assert swept == ["10.0.0.2"]
+    assert ResumableProtocol.scanned == ["10.0.0.2"]
+    assert not os.path.exists(journal)
+    engine.close()
+    db_engine.dispose()
+
+
+class CheckpointedProtocol(ResumableProtocol):
+    checkpoints = []
+
+    def __init__(self, args, db, target):
+        CheckpointedProtocol.checkpoints.append(self.checkpoint)
+        if self.checkpoint is not None:
+            self.checkpoint.target_done(target)
+
+
+def test_journal_is_opt_in(tmp_path, monkeypatch):
+    db_engine = create_db_engine(tmp_path / "smb.db")
+    smb_database.db_schema(db_engine)
+    engine = Engine()
+    monkeypatch.setattr(engine, "load_protocol", lambda protocol: (CheckpointedProtocol, smb_database_module, db_engine))
+    monkeypatch.setattr(netexec, "new_journal_path", lambda workspace, protocol: str(tmp_path / f"{protocol}.journal"))
+    argv = ["smb", "10.0.0.1", "10.0.0.2", "--no-progress", "-t", "1"]
+
+    assert engine.run(argv)["returncode"] == 0
+    assert CheckpointedProtocol.checkpoints == [None, None]
+    CheckpointedProtocol.checkpoints = []
+    assert engine.run([*argv, "--checkpoint"])["returncode"] == 0
+    assert len(CheckpointedProtocol.checkpoints) == 2
+    assert all(isinstance(checkpoint, CheckpointJournal) for checkpoint in CheckpointedProtocol.checkpoints)
+    # Every target finished, the journal was removed
+    assert not os.path.exists(tmp_path / "smb.journal")
+    engine.close()
+    db_engine.dispose()
@@ -0,0 +1,78 @@
+import errno
+import socket
+
+import pytest
+
+from nxc.helpers.concurrency import LOCAL_ERROR, REFUSED, TIMEOUT, AdaptiveWindow, connect_errors, connect_failure, record_connect_errors, reset_connect_error
+
+
+def test_only_successful_connects_are_rtt_samples():
+    window = AdaptiveWindow(64, initial=16)
+    window.observe("10.0.0.1", 0.05)
+    # Refused or reset connects come back instantly, they must not lower the best RTT
+    window.observe("10.0.0.2", 0.0001, REFUSED)
+    assert window.min_rtt == pytest.approx(0.05)
+    assert window.srtt == pytest.approx(0.05)
+
+
+def test_slow_start_then_additive_growth():
+    window = AdaptiveWindow(256, initial=16)
+    for i in range(16):
+        window.observe(f"10.0.0.{i}", 0.01)
+    assert window.limit == 32
+    window.slow_start_threshold = 32
+    # About one more per window's worth of successes
+    for i in range(32):
+        window.observe(f"10.0.1.{i}", 0.01)
+    assert 32 < window.window < 33
+
+
+def test_sparse_range_keeps_window():
+    window = AdaptiveWindow(64, initial=16)
+    for i in range(64):
+        window.observe(f"10.0.0.{i}", 1.0, TIMEOUT if i % 2 else REFUSED)
+    assert window.limit == 16
+
+
+def test_congestion_shrinks_window():
+    window = AdaptiveWindow(64, initial=16)
+    window.observe("10.0.0.1", 0.001)
+    for _ in range(8):
+        window.observe("10.0.0.1", 1.0, TIMEOUT)
+    assert window.limit == 8
+    # At most one decrease per smoothed RTT (or second), a burst of failures is one event
+    for _ in range(8):
+        window.observe("10.0.0.2", 0.001, LOCAL_ERROR)
+    assert window.limit == 8
+    # The window grows linearly from the new threshold
+    window.samples.clear()
+    window.observe("10.0.0.1", 0.001)
+    assert window.limit == 8
+
+
+def test_swept_hosts_timeouts_are_congestion():
+    window = AdaptiveWindow(64, initial=16, hosts_answered=True)
+    for i in range(8):
+        window.observe(f"10.0.0.{i}", 1.0, TIMEOUT)
+    assert window.limit == 8
+
+
+def test_connect_failure_reasons():
+    record_connect_errors()
+    reset_connect_error()
+    assert connect_failure() == REFUSED
+
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    port = listener.getsockname()[1]
+    listener.close()
+    with socket.socket() as sock, pytest.raises(ConnectionRefusedError):
+        sock.connect(("127.0.0.1", port))
+    assert isinstance(connect_errors.last, ConnectionRefusedError)
+    assert connect_failure() == REFUSED
+
+    # Stand-ins for errors recorded by a connect that timed out and by one without a free socket
+    connect_errors.last = TimeoutError("timed out")
+    assert connect_failure() == TIMEOUT
+    connect_errors.last = OSError(errno.EMFILE, "Too many open files")
+    assert connect_failure() == LOCAL_ERROR
@@ -0,0 +1,42 @@
+from argparse import Namespace
+
+from nxc.helpers.credentials import CredentialPlan
+
+
+class CredentialsDB:
+    """Stand-in for a protocol database holding two credentials"""
+
+    credentials = {
+        1: (1, "CORP", "alice", "Password1", "plaintext", None),
+        2: (2, "CORP", "bob", "Password2", "plaintext", None),
+    }
+
+    def get_credentials(self, filter_term=None):
+        return [self.credentials[filter_term]] if filter_term in self.credentials else list(self.credentials.values())
+
+
+def credential_args(**kwargs):
+    return Namespace(**{"cred_id": None, "username": None, "password": None, "hash": None, "aesKey": None, "domain": None, "no_bruteforce": False, **kwargs})
+
+
+def test_single_password_for_cli_users():
+    args = credential_args(username=["carol", "dave"], password=["Summer2024"])
+    plan = CredentialPlan.from_args(args, None)
+    assert plan.no_bruteforce
+    assert list(plan.attempts()) == [(0, 0), (1, 1)]
+    assert plan.secrets == ("Summer2024", "Summer2024")
+
+
+def test_single_password_with_cred_ids():
+    # The database credentials keep their own secrets, only the command line users share the password
+    args = credential_args(cred_id=[1, 2], username=["carol", "dave"], password=["Summer2024"])
+    plan = CredentialPlan.from_args(args, CredentialsDB())
+    assert plan.no_bruteforce
+    pairs = [(plan.usernames[user_index], plan.secrets[secret_index]) for user_index, secret_index in plan.attempts()]
+    assert pairs == [("alice", "Password1"), ("bob", "Password2"), ("carol", "Summer2024"), ("dave", "Summer2024")]
+
+    # A single database credential is not spread over the command line users
+    args = credential_args(cred_id=[1], username=["carol", "dave"])
+    plan = CredentialPlan.from_args(args, CredentialsDB())
+    assert plan.secrets == ("Password1",)
+    assert not plan.no_bruteforce
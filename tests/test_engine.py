@@ -0,0 +1,100 @@
+from argparse import Namespace
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from nxc.helpers import ratelimit
+from nxc.database import create_db_engine
+from nxc.netexec import Engine, run_targets
+from nxc.protocols.smb import database as smb_database_module
+from nxc.protocols.smb.database import database as smb_database
+
+
+class FakeProtocol:
+    """Stand-in for a protocol class, records the database of every target"""
+
+    module_paths = []
+    module_registry = None
+    adaptive_window = None
+    rate_limiter = None
+    checkpoint = None
+    credential_plan = None
+    databases = []
+
+    def __init__(self, args, db, target):
+        FakeProtocol.databases.append(db)
+        db.add_host(target, "host", "CORP.LOCAL", "Windows", False, False)
+
+
+def fake_engine(tmp_path, monkeypatch):
+    db_engine = create_db_engine(tmp_path / "smb.db")
+    smb_database.db_schema(db_engine)
+    engine = Engine()
+    monkeypatch.setattr(engine, "load_protocol", lambda protocol: (FakeProtocol, smb_database_module, db_engine))
+    return engine, db_engine
+
+
+def test_run_creates_and_shuts_down_database(tmp_path, monkeypatch):
+    engine, db_engine = fake_engine(tmp_path, monkeypatch)
+    FakeProtocol.databases.clear()
+    result = engine.run(["smb", "10.0.0.1", "10.0.0.2", "--no-progress", "-t", "2"])
+
+    assert result["returncode"] == 0, result
+    db = FakeProtocol.databases[0]
+    assert isinstance(db, smb_database)
+    assert {id(database) for database in FakeProtocol.databases} == {id(db)}
+    assert db.connections == []
+    assert sorted(host.ip for host in smb_database(db_engine).get_hosts()) == ["10.0.0.1", "10.0.0.2"]
+    engine.close()
+    db_engine.dispose()
+
+
+class CredentialProtocol(FakeProtocol):
+    def __init__(self, args, db, target):
+        for _ in range(2):
+            db.add_credential("plaintext", "CORP", "alice", "Password1")
+
+
+def test_run_logs_credential_cache_stats(tmp_path, monkeypatch, caplog):
+    engine, db_engine = fake_engine(tmp_path, monkeypatch)
+    monkeypatch.setattr(engine, "load_protocol", lambda protocol: (CredentialProtocol, smb_database_module, db_engine))
+    result = engine.run(["smb", "10.0.0.1", "--no-progress", "--debug"])
+
+    assert result["returncode"] == 0, result
+    assert "credential cache: 1 hits, 1 misses" in caplog.text
+    engine.close()
+    db_engine.dispose()
+
+
+class FailingProtocol(FakeProtocol):
+    def __init__(self, args, db, target):
+        ratelimit.login_failures.increment("alice")
+
+
+def test_runs_start_with_fresh_lockout_counters(tmp_path, monkeypatch):
+    engine, db_engine = fake_engine(tmp_path, monkeypatch)
+    monkeypatch.setattr(engine, "load_protocol", lambda protocol: (FailingProtocol, smb_database_module, db_engine))
+    for _ in range(2):
+        result = engine.run(["smb", "10.0.0.1", "--no-progress", "--fail-window", "60"])
+        assert result["returncode"] == 0, result
+        assert ratelimit.login_failures.total == 1
+        assert ratelimit.login_failures.window == 60
+    engine.close()
+    db_engine.dispose()
+
+
+class ThrottledProtocol:
+    """Stand-in for a target whose logins are rate limited on its first two passes"""
+
+    passes = Counter()
+
+    def __init__(self, args, db, target):
+        ThrottledProtocol.passes[target] += 1
+        self.retry_after = 0.01 if ThrottledProtocol.passes[target] < 3 else None
+
+
+def test_rate_limited_targets_are_rescheduled():
+    finished = []
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        run_targets(executor, ThrottledProtocol, Namespace(threads=1), None, ["10.0.0.1", "10.0.0.2"], on_finished=finished.append)
+    assert ThrottledProtocol.passes == {"10.0.0.1": 3, "10.0.0.2": 3}
+    assert sum(finished) == 2
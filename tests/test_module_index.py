@@ -0,0 +1,78 @@
+import os
+
+from nxc.loaders import moduleloader
+from nxc.loaders.moduleloader import ModuleIndex, ModuleLoader
+from nxc.logger import NXCAdapter
+
+USER_MODULE = '''
+from nxc.helpers.misc import CATEGORY
+
+
+class NXCModule:
+    name = "spooler"
+    description = "User copy of the spooler module"
+    supported_protocols = ["smb"]
+    category = CATEGORY.ENUMERATION
+
+    def options(self, context, module_options):
+        """No options"""
+
+    def on_login(self, context, connection):
+        pass
+'''
+
+
+def test_index_invalidation(tmp_path):
+    module = tmp_path / "example.py"
+    module.write_text("first")
+    reads = []
+
+    def read_info(source):
+        reads.append(source)
+        return {"description": source.decode()}
+
+    index = ModuleIndex(tmp_path / "index.json")
+    assert index.get(str(module), read_info) == {"description": "first"}
+    assert index.get(str(module), read_info) == {"description": "first"}
+    assert reads == [b"first"]
+
+    # A new mtime with the same content is only hashed
+    stat = os.stat(module)
+    os.utime(module, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert index.get(str(module), read_info) == {"description": "first"}
+    assert reads == [b"first"]
+
+    # Changed content is read again
+    module.write_text("second")
+    os.utime(module, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10**9))
+    assert index.get(str(module), read_info) == {"description": "second"}
+    assert reads == [b"first", b"second"]
+
+    index.save([str(module)])
+    reloaded = ModuleIndex(tmp_path / "index.json")
+    assert reloaded.get(str(module), read_info) == {"description": "second"}
+    assert len(reads) == 2
+    # Entries of deleted modules are dropped
+    reloaded.save([])
+    assert ModuleIndex(tmp_path / "index.json").entries == {}
+
+
+def test_user_modules_override_bundled(tmp_path, monkeypatch):
+    user_modules = tmp_path / "modules"
+    user_modules.mkdir()
+    (user_modules / "spooler.py").write_text(USER_MODULE)
+    monkeypatch.setattr(moduleloader, "USER_MODULES_PATH", str(user_modules))
+
+    loader = ModuleLoader(None, None, NXCAdapter())
+    modules = loader.list_modules(ModuleIndex(tmp_path / "index.json"))
+    assert modules["spooler"]["path"] == str(user_modules / "spooler.py")
+    assert modules["spooler"]["description"] == "User copy of the spooler module"
+    assert not modules["spooler"]["requires_admin"]
+    # Bundled modules are still listed
+    assert modules["zerologon"]["path"] == "nxc.modules.zerologon"
+
+    # Answered from the index the next time, the override included
+    index = ModuleIndex(tmp_path / "index.json")
+    assert str(user_modules / "spooler.py") in index.entries
+    assert loader.list_modules(index)["spooler"]["path"] == str(user_modules / "spooler.py")
+    assert not index.dirty
@@ -0,0 +1,113 @@
+import inspect
+import io
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, redirect_stdout
+
+import pytest
+
+from nxc.console import output
+from nxc.helpers import events
+from nxc.helpers.events import EventStream
+from nxc.logger import NXCAdapter
+
+
+@pytest.fixture
+def logger():
+    logger = NXCAdapter(extra={"protocol": "SMB", "host": "10.0.0.1", "port": 445, "hostname": "DC01"})
+    level = logger.logger.level
+    logger.logger.setLevel(logging.ERROR)
+    yield logger
+    logger.logger.setLevel(level)
+
+
+@contextmanager
+def file_log(logger):
+    """Stand-in for a --log file handler, records where each line was logged from"""
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter("%(filename)s:%(lineno)d %(message)s"))
+    logger.logger.addHandler(handler)
+    try:
+        yield stream
+    finally:
+        output.flush()
+        logger.logger.removeHandler(handler)
+
+
+def test_plain_lines_in_call_order(logger):
+    sink = io.StringIO()
+    with redirect_stdout(sink):
+        logger.display("first")
+        logger.success("second")
+        logger.highlight("third")
+        logger.fail("fourth")
+        output.flush()
+
+    lines = sink.getvalue().splitlines()
+    assert "\x1b" not in sink.getvalue()
+    assert [line.split()[-1] for line in lines] == ["first", "second", "third", "fourth"]
+    assert lines[0].split()[:5] == ["SMB", "10.0.0.1", "445", "DC01", "[*]"]
+    assert lines[1].split()[4] == "[+]"
+    assert lines[3].split()[4] == "[-]"
+
+
+def test_threads_keep_their_order(logger):
+    sink = io.StringIO()
+
+    def worker(thread):
+        for i in range(200):
+            logger.display(f"{thread}:{i}")
+
+    with redirect_stdout(sink), ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(worker, range(8)))
+        output.flush()
+
+    seen = {}
+    for line in sink.getvalue().splitlines():
+        thread, i = map(int, line.split()[-1].split(":"))
+        assert i == seen.get(thread, -1) + 1
+        seen[thread] = i
+    assert seen == dict.fromkeys(range(8), 199)
+
+
+def test_file_log_records_the_caller_line(logger):
+    with redirect_stdout(io.StringIO()), file_log(logger) as log:
+        line = inspect.currentframe().f_lineno
+        logger.display("queued")
+        # Arguments for rich's print take the synchronous path
+        logger.display("printed", highlight=False)
+    assert log.getvalue().splitlines() == [
+        f"test_output.py:{line + 1} SMB                      10.0.0.1        445    DC01             [*] queued",
+        f"test_output.py:{line + 3} SMB                      10.0.0.1        445    DC01             [*] printed",
+    ]
+
+
+def test_file_log_records_the_caller_line_in_debug(logger):
+    logger.logger.setLevel(logging.DEBUG)
+    with redirect_stdout(io.StringIO()), file_log(logger) as log:
+        line = inspect.currentframe().f_lineno
+        logger.success("debugging")
+    assert f"test_output.py:{line + 1} " in log.getvalue()
+
+
+def test_events_written_as_json_lines(logger, tmp_path, monkeypatch):
+    path = tmp_path / "results.jsonl"
+    monkeypatch.setattr(events, "stream", EventStream(path))
+    module_log = NXCAdapter(extra={"module_name": "LSASSY", "host": "10.0.0.1", "port": 445, "hostname": "DC01"})
+    sink = io.StringIO()
+    with redirect_stdout(sink):
+        logger.event("share", share="C$", access=["READ"])
+        module_log.event("credential", "CORP\\alice Password1", highlight=True, domain="CORP", username="alice", cred_type="plaintext", secret="Password1")
+        events.stream.close()
+
+    # The message is displayed like highlight(), without a marker
+    assert sink.getvalue().split()[4:] == ["CORP\\alice", "Password1"]
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    for record in records:
+        assert record.pop("time")
+    assert records == [
+        {"event": "share", "protocol": "smb", "host": "10.0.0.1", "port": 445, "hostname": "DC01", "share": "C$", "access": ["READ"]},
+        {"event": "credential", "module": "lsassy", "host": "10.0.0.1", "port": 445, "hostname": "DC01", "domain": "CORP", "username": "alice", "cred_type": "plaintext", "secret": "Password1"},
+    ]
@@ -0,0 +1,74 @@
+import pytest
+
+from nxc.database import create_db_engine
+from nxc.protocols.ftp.database import database as ftp_database
+from nxc.protocols.rdp.database import database as rdp_database
+from nxc.protocols.ssh.database import database as ssh_database
+
+
+def open_database(tmp_path, database):
+    db_engine = create_db_engine(tmp_path / "protocol.db")
+    database.db_schema(db_engine)
+    db = database(db_engine)
+    yield db
+    db.shutdown_db()
+    db_engine.dispose()
+
+
+@pytest.fixture
+def ftp_db(tmp_path):
+    yield from open_database(tmp_path, ftp_database)
+
+
+@pytest.fixture
+def ssh_db(tmp_path):
+    yield from open_database(tmp_path, ssh_database)
+
+
+@pytest.fixture
+def rdp_db(tmp_path):
+    yield from open_database(tmp_path, rdp_database)
+
+
+def test_ftp_login_rows(ftp_db):
+    host_id = ftp_db.add_host("10.0.0.1", 21, "vsFTPd")[0]
+    assert ftp_db.add_host("10.0.0.1", 2121, None) == [host_id]
+    cred_id = ftp_db.add_credential("anonymous", "")
+    assert ftp_db.add_credential("Anonymous", "") == cred_id
+    relation_id = ftp_db.add_loggedin_relation(cred_id, host_id)
+    assert ftp_db.add_loggedin_relation(cred_id, host_id) == relation_id
+
+    host = ftp_db.get_hosts()[0]
+    assert (host.port, host.banner) == (2121, "vsFTPd")
+    assert len(ftp_db.get_credentials()) == 1
+
+
+def test_ssh_credentials(ssh_db):
+    host_id = ssh_db.add_host("10.0.0.1", 22, None)[0]
+    assert ssh_db.get_hosts()[0].banner == ""
+    assert ssh_db.add_host("10.0.0.1", 22, "SSH-2.0-OpenSSH_9.6") == [host_id]
+
+    cred_id = ssh_db.add_credential("plaintext", "root", "toor")
+    # A plaintext credential is one per user, a new password updates it
+    assert ssh_db.add_credential("plaintext", "ROOT", "Password1") == cred_id
+    # Each key is its own credential, even with the same user and passphrase
+    first_key = ssh_db.add_credential("key", "root", "", key="KEY1")
+    second_key = ssh_db.add_credential("key", "root", "", key="KEY2")
+    assert len({cred_id, first_key, second_key}) == 3
+    assert ssh_db.add_credential("key", "root", "passphrase", key="KEY1") == first_key
+    assert [key.data for key in ssh_db.get_keys(cred_id=first_key)] == ["KEY1"]
+
+    ssh_db.add_loggedin_relation(cred_id, host_id, shell=False)
+    ssh_db.add_loggedin_relation(cred_id, host_id, shell=True)
+    relations = ssh_db.get_loggedin_relations(cred_id, host_id)
+    assert [relation.shell for relation in relations] == [True]
+    ssh_db.add_admin_user("plaintext", "root", "Password1", host_id=host_id, cred_id=cred_id)
+    ssh_db.add_admin_user("plaintext", "root", "Password1", host_id=host_id, cred_id=cred_id)
+    assert len(ssh_db.get_admin_relations(cred_id=cred_id)) == 1
+
+
+def test_rdp_add_host(rdp_db):
+    host_id = rdp_db.add_host("10.0.0.1", 3389, "DC01", "CORP.LOCAL", "Windows 10", True)[0]
+    assert rdp_db.add_host("10.0.0.1", 3389, None, None, None, False) == [host_id]
+    host = rdp_db.get_hosts()[0]
+    assert (host.hostname, host.nla) == ("DC01", False)
@@ -0,0 +1,52 @@
+from nxc.loaders.protocolloader import ProtocolLoader, build_manifest
+
+
+def protocol_tree(tmp_path):
+    """Protocol layout of nxc/protocols, whose files fail if anything imports them"""
+    for name in ("alpha", "beta"):
+        (tmp_path / f"{name}.py").write_text("raise ImportError('imported while building the manifest')\n")
+    (tmp_path / "__init__.py").write_text("")
+    (tmp_path / "alpha").mkdir()
+    for module in ("database", "db_navigator", "proto_args"):
+        (tmp_path / "alpha" / f"{module}.py").write_text("raise ImportError('imported while building the manifest')\n")
+    (tmp_path / "README.md").write_text("")
+    return tmp_path
+
+
+def test_manifest_from_file_layout(tmp_path):
+    manifest = build_manifest(protocol_tree(tmp_path))
+    assert manifest == {
+        "alpha": {
+            "path": str(tmp_path / "alpha.py"),
+            "dbpath": "nxc.protocols.alpha.database",
+            "nvpath": "nxc.protocols.alpha.db_navigator",
+            "argspath": "nxc.protocols.alpha.proto_args",
+        },
+        # A protocol without a package has no optional modules
+        "beta": {"path": str(tmp_path / "beta.py")},
+    }
+
+
+def test_manifest_built_once_and_copied(monkeypatch):
+    built = []
+    monkeypatch.setattr(ProtocolLoader, "manifest", None)
+    monkeypatch.setattr("nxc.loaders.protocolloader.build_manifest", lambda: built.append(True) or {"smb": {"path": "smb.py"}})
+    protocols = ProtocolLoader().get_protocols()
+    protocols["smb"]["path"] = "changed"
+    assert ProtocolLoader().get_protocols() == {"smb": {"path": "smb.py"}}
+    assert built == [True]
+
+
+def test_real_protocols_in_manifest():
+    protocols = ProtocolLoader().get_protocols()
+    assert {"smb", "ldap", "ssh"} <= protocols.keys()
+    assert protocols["smb"]["dbpath"] == "nxc.protocols.smb.database"
+    assert protocols["smb"]["path"].endswith("smb.py")
+
+
+def test_load_protocol_by_path_and_name(tmp_path):
+    implementation = tmp_path / "gamma.py"
+    implementation.write_text("class gamma:\n    pass\n")
+    loader = ProtocolLoader()
+    assert loader.load_protocol(str(implementation)).gamma.__name__ == "gamma"
+    assert loader.load_protocol("nxc.protocols.smb.database").database.__name__ == "database"
@@ -0,0 +1,92 @@
+from time import sleep
+
+from nxc.helpers.ratelimit import AttemptScheduler, FailedLogins, RateLimiter
+
+
+def test_reserve_takes_tokens_only_when_granted():
+    limiter = RateLimiter(user_rate=1 / 3600, burst=2)
+    assert limiter.reserve("alice", "10.0.0.1") == 0
+    assert limiter.reserve("alice", "10.0.0.2") == 0
+    delay = limiter.reserve("ALICE", "10.0.0.1")
+    assert 3500 < delay <= 3600
+    # A refused reservation takes nothing, the wait does not grow
+    assert limiter.reserve("alice", "10.0.0.1") <= delay
+    assert limiter.reserve("bob", "10.0.0.1") == 0
+
+
+def test_reserve_per_subnet():
+    limiter = RateLimiter(subnet_rate=1 / 3600)
+    assert limiter.reserve("alice", "10.0.0.1") == 0
+    assert limiter.reserve("bob", "10.0.0.2") > 0
+    assert limiter.reserve("bob", "10.0.1.1") == 0
+
+
+def test_lockout_thresholds():
+    failures = FailedLogins()
+    failures.increment("alice")
+    assert not failures.over_limit("alice", None, 2)
+    failures.increment("alice")
+    assert failures.over_limit("alice", None, 2)
+    assert not failures.over_limit("bob", None, 2)
+    assert not failures.over_limit("bob", 3, None)
+    failures.increment("bob")
+    assert failures.over_limit("carol", 3, None)
+
+
+def test_lockout_window():
+    failures = FailedLogins(window=0.05)
+    failures.increment("alice")
+    assert failures.over_limit("alice", None, 1)
+    sleep(0.1)
+    assert not failures.over_limit("alice", None, 1)
+    assert failures.total == 0
+
+
+class FakeLimiter:
+    def __init__(self, throttled, delay=0.01):
+        self.throttled = set(throttled)
+        self.delay = delay
+
+    def reserve(self, username, host):
+        return self.delay if username in self.throttled else 0
+
+
+def test_scheduler_defers_throttled_user():
+    limiter = FakeLimiter({"alice"})
+    scheduler = AttemptScheduler([(0, 0), (1, 0), (0, 1), (1, 1), (0, 2)], limiter, ["alice", "bob"], "10.0.0.1")
+    assert list(scheduler) == [(1, 0), (1, 1)]
+    assert 0 < scheduler.retry_after <= 0.01
+
+    limiter.throttled.clear()
+    sleep(scheduler.retry_after)
+    # The attempts of a user keep their order
+    assert list(scheduler) == [(0, 0), (0, 1), (0, 2)]
+    assert scheduler.retry_after is None
+
+
+def test_scheduler_pulls_attempts_lazily():
+    pulled = []
+
+    def attempts():
+        for secret_index in range(1000):
+            pulled.append(secret_index)
+            yield 0, secret_index
+
+    scheduler = AttemptScheduler(attempts(), RateLimiter(user_rate=1 / 3600), ["alice"], "10.0.0.1", max_deferred=4)
+    assert list(scheduler) == [(0, 0)]
+    assert scheduler.retry_after > 3500
+    assert len(pulled) == 5
+
+
+def test_shards_split_the_limits():
+    shares = [FailedLogins(window=60).shard(index, 3) for index in range(3)]
+    assert [failures.share_of(4) for failures in shares] == [2, 1, 1]
+    assert all(failures.window == 60 for failures in shares)
+    shares[1].increment("alice")
+    assert shares[1].over_limit("alice", None, 4)
+    assert not shares[0].over_limit("alice", None, 4)
+
+    limiter = RateLimiter(user_rate=1 / 3600, burst=2).shard(2)
+    assert limiter.reserve("alice", "10.0.0.1") == 0
+    # The other half of the burst belongs to the other shard
+    assert limiter.reserve("alice", "10.0.0.1") > 3500
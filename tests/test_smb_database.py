@@ -1,13 +1,15 @@
 import os
+from contextlib import nullcontext
 import pytest
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, scoped_session
 
-from nxc.database import delete_workspace, create_workspace
+from nxc.database import create_db_engine, delete_workspace, create_workspace, get_schema_version, schema_version
 from nxc.first_run import first_run_setup
 from nxc.loaders.protocolloader import ProtocolLoader
 from nxc.logger import NXCAdapter
 from nxc.paths import WORKSPACE_DIR
+from nxc.protocols.smb.database import database as smb_database
 from sqlalchemy.dialects.sqlite import Insert
 
 
@@ -122,8 +124,85 @@ def test_update_host(db, sess):
     assert host.dc is False
 
 
-def test_add_credential():
-    pass
+def test_add_credential(db, db_engine):
+    host_id = db.add_host("127.0.0.1", "localhost", "TEST.DEV", "Windows Testing 2023", False, True)[0]
+    assert db.add_host("127.0.0.1", None, None, None, None, None) == [host_id]
+
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db_engine, "before_cursor_execute", count)
+    try:
+        user_id = db.add_credential("plaintext", "TEST.DEV", "alice", "Password1")
+        db.add_loggedin_relation(user_id, host_id)
+    finally:
+        event.remove(db_engine, "before_cursor_execute", count)
+    # a login is recorded with one upsert for the user and one for the relation
+    assert len(statements) == 2
+
+    assert db.add_credential("PLAINTEXT", "test.dev", "ALICE", "Password2") == user_id
+    assert db.add_loggedin_relation(user_id, host_id) == db.get_loggedin_relations(user_id, host_id)[0].id
+    assert db.add_admin_user("plaintext", "TEST.DEV", "alice", "Password2", "127.0.0.1", user_id=user_id, host_id=host_id)
+    assert len(db.get_admin_relations(user_id=user_id)) == 1
+    credential = db.get_credentials()[0]
+    assert (credential.username, credential.password) == ("ALICE", "Password2")
+    assert db.get_hosts()[0].hostname == "localhost"
+
+
+def test_credential_cache(db, db_engine):
+    host_ids = [db.add_host(f"10.0.0.{i}", f"host{i}", "TEST.DEV", "Windows Testing 2023", False, True)[0] for i in range(1, 4)]
+    nthash = "aad3b435b51404eeaad3b435b51404ee:00000000000000000000000000000001"
+    user_id = db.add_credential("hash", "TEST.DEV", "administrator", nthash, pillaged_from=host_ids[0])
+
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db_engine, "before_cursor_execute", count)
+    try:
+        # the same local admin hash dumped from every other host
+        for host_id in host_ids[1:]:
+            assert db.add_credential("hash", "TEST.DEV", "administrator", nthash, pillaged_from=host_id) == user_id
+        assert db.add_credential("hash", "TEST.DEV", "administrator", nthash) == user_id
+    finally:
+        event.remove(db_engine, "before_cursor_execute", count)
+    assert statements == []
+    assert db.credential_cache.hits == 3
+
+    # a new secret for the same account is written
+    assert db.add_credential("hash", "TEST.DEV", "Administrator", nthash[:-1] + "2") == user_id
+    assert db.get_credentials()[0].password.endswith("2")
+    assert db.get_credentials()[0].pillaged_from_hostid == host_ids[0]
+
+    db.remove_credentials([user_id])
+    db.add_credential("hash", "TEST.DEV", "administrator", nthash)
+    assert len(db.get_credentials()) == 1
+
+
+@pytest.mark.parametrize("batched", [False, True])
+def test_credential_keeps_first_pillaged_host(db, batched):
+    host_ids = [db.add_host(f"10.0.0.{i}", f"host{i}", "TEST.DEV", "Windows Testing 2023", False, True)[0] for i in range(1, 4)]
+    nthash = "aad3b435b51404eeaad3b435b51404ee:00000000000000000000000000000001"
+    writes = db.batched_writes() if batched else nullcontext()
+    with writes:
+        db.add_credential("hash", "TEST.DEV", "administrator", nthash, pillaged_from=host_ids[0])
+        # warm cache: answered from the cache
+        db.add_credential("hash", "TEST.DEV", "administrator", nthash, pillaged_from=host_ids[1])
+        db.credential_cache.clear()
+        # cold cache: the upsert keeps the stored host
+        db.add_credential("hash", "TEST.DEV", "administrator", nthash, pillaged_from=host_ids[2])
+    assert [cred.pillaged_from_hostid for cred in db.get_credentials()] == [host_ids[0]]
+
+    # a credential first seen without a host gets the first one it is pillaged from
+    db.add_credential("hash", "TEST.DEV", "guest", nthash)
+    db.credential_cache.clear()
+    db.add_credential("hash", "TEST.DEV", "guest", nthash, pillaged_from=host_ids[1])
+    db.credential_cache.clear()
+    db.add_credential("hash", "TEST.DEV", "guest", nthash, pillaged_from=host_ids[2])
+    assert {cred.username: cred.pillaged_from_hostid for cred in db.get_credentials()}["guest"] == host_ids[1]
 
 
 def test_update_credential():
@@ -134,6 +213,162 @@ def test_remove_credential():
     pass
 
 
+def test_batched_add_credential(db):
+    db.add_credential("hash", "TEST.DEV", "alice", "aad3b435b51404eeaad3b435b51404ee:00000000000000000000000000000001")
+    with db.batched_writes():
+        db.add_credential("hash", "test.dev", "ALICE", "aad3b435b51404eeaad3b435b51404ee:00000000000000000000000000000002")
+        db.add_credential("hash", "TEST.DEV", "bob", "aad3b435b51404eeaad3b435b51404ee:00000000000000000000000000000003")
+        db.add_credential("hash", "TEST.DEV", "Bob", "aad3b435b51404eeaad3b435b51404ee:00000000000000000000000000000004")
+        # reads flush the queued credentials first
+        assert len(db.get_credentials()) == 2
+        db.add_credential("hash", "TEST.DEV", "carol", "aad3b435b51404eeaad3b435b51404ee:00000000000000000000000000000005", pillaged_from=1234)
+    assert db.writer is None
+
+    credentials = {cred.username.lower(): cred for cred in db.get_credentials()}
+    assert len(credentials) == 2
+    assert credentials["alice"].password.endswith("2")
+    assert credentials["bob"].password.endswith("4")
+
+
+def test_export_streams_joined_rows(db):
+    host_id = db.add_host("127.0.0.1", "localhost", "TEST.DEV", "Windows Testing 2023", False, True)[0]
+    user_id = db.add_credential("hash", "TEST.DEV", "alice", "aad3b435b51404eeaad3b435b51404ee:00000000000000000000000000000001", pillaged_from=host_id)
+    db.add_credential("plaintext", "TEST.DEV", "bob", "Password1")
+    db.add_share(host_id, user_id, "C$", "Default share", True, False)
+
+    credentials = db.export_credentials(detailed=True)
+    assert not isinstance(credentials, list)
+    assert [(cred.username, cred.pillaged_from) for cred in credentials] == [("alice", "localhost"), ("bob", "")]
+    assert [tuple(row) for row in db.export_hashes()] == [("alice", "aad3b435b51404eeaad3b435b51404ee:00000000000000000000000000000001")]
+    assert [tuple(row[1:]) for row in db.export_shares(detailed=True)] == [("localhost", "TEST.DEV\\alice", "C$", "Default share", True, False)]
+    assert [host.ip for host in db.export_hosts(filter_term="signing")] == []
+
+
+def test_migrate_old_schema(tmp_path):
+    db_path = tmp_path / "smb.db"
+    db_engine = create_db_engine(db_path)
+    with db_engine.connect() as conn:
+        # users table of an older release: no pillaged_from_hostid, no indexes
+        conn.exec_driver_sql("CREATE TABLE users (id INTEGER NOT NULL, domain VARCHAR, username VARCHAR, password VARCHAR, credtype VARCHAR, groupid INTEGER, PRIMARY KEY (id))")
+        conn.exec_driver_sql("INSERT INTO users (domain, username, password, credtype, groupid) VALUES ('TEST.DEV', 'alice', 'Password1', 'plaintext', 3)")
+        conn.exec_driver_sql("INSERT INTO users (domain, username, password, credtype, groupid) VALUES ('test.dev', 'ALICE', 'Password2', 'plaintext', 3)")
+    smb_database.db_schema(db_engine)
+
+    db = smb_database(db_engine)
+    assert set(db.UsersTable.columns.keys()) == {"id", "domain", "username", "password", "credtype", "pillaged_from_hostid"}
+    # duplicates the unique credential index rejects are merged onto the oldest row
+    assert len(db.get_credentials()) == 1
+    assert db.get_credential("PLAINTEXT", "test.dev", "ALICE", "Password1") == 1
+    with db_engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index' AND name = 'ix_users_credential'").scalar()
+    assert list(tmp_path.glob("smb.db.*.bak"))
+
+    db.shutdown_db()
+    db_engine.dispose()
+
+
+def test_new_unique_index_merges_after_backup(tmp_path):
+    db_path = tmp_path / "smb.db"
+    db_engine = create_db_engine(db_path)
+    smb_database.db_schema(db_engine)
+    with db_engine.connect() as conn:
+        # current columns, written before the credential index was unique
+        conn.exec_driver_sql("DROP INDEX ix_users_credential")
+        conn.exec_driver_sql("INSERT INTO hosts (ip) VALUES ('10.0.0.1')")
+        conn.exec_driver_sql("INSERT INTO users (domain, username, password, credtype) VALUES ('TEST.DEV', 'alice', 'Password1', 'plaintext')")
+        conn.exec_driver_sql("INSERT INTO users (domain, username, password, credtype) VALUES ('test.dev', 'ALICE', 'Password2', 'plaintext')")
+        conn.exec_driver_sql("INSERT INTO admin_relations (userid, hostid) VALUES (2, 1)")
+        conn.exec_driver_sql("PRAGMA user_version = 0")
+
+    db = smb_database(db_engine)
+    assert [credential.id for credential in db.get_credentials()] == [1]
+    # the relation of the merged row now points to the kept one
+    assert [(relation.userid, relation.hostid) for relation in db.get_admin_relations()] == [(1, 1)]
+    backups = list(tmp_path.glob("smb.db.*.bak"))
+    assert len(backups) == 1
+    backup = create_db_engine(backups[0])
+    with backup.connect() as conn:
+        assert conn.exec_driver_sql("SELECT count(*) FROM users").scalar() == 2
+    backup.dispose()
+    db.shutdown_db()
+    db_engine.dispose()
+
+
+def test_schema_version_skips_reflection(tmp_path):
+    db_engine = create_db_engine(tmp_path / "smb.db")
+    smb_database.db_schema(db_engine)
+    with db_engine.connect() as conn:
+        assert get_schema_version(conn) == schema_version(smb_database.Host.metadata)
+
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db_engine, "before_cursor_execute", count)
+    try:
+        smb_database.db_schema(db_engine)
+        db = smb_database(db_engine)
+    finally:
+        event.remove(db_engine, "before_cursor_execute", count)
+    # one user_version check for db_schema and one for the database object, no table reflection
+    assert statements == ["PRAGMA user_version", "PRAGMA user_version"]
+    db.add_credential("plaintext", "TEST.DEV", "alice", "Password1")
+    assert len(db.get_credentials()) == 1
+    db.shutdown_db()
+
+    # an unstamped (or outdated) database is reflected again and stamped
+    with db_engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA user_version = 0")
+    db = smb_database(db_engine)
+    assert db.schema_current
+    with db_engine.connect() as conn:
+        assert get_schema_version(conn) == schema_version(smb_database.Host.metadata)
+    db.shutdown_db()
+    db_engine.dispose()
+
+
+def test_merge(tmp_path):
+    databases = []
+    for name in ("box1", "box2"):
+        db_engine = create_db_engine(tmp_path / f"{name}.db")
+        smb_database.db_schema(db_engine)
+        databases.append(smb_database(db_engine))
+    target, source = databases
+
+    target.add_host("10.0.0.1", "dc01", "CORP.LOCAL", "", False, True, dc=True)
+    target.add_credential("plaintext", "CORP", "alice", "Password1")
+    # the same host and user get other ids in the second database
+    source.add_host("10.0.0.2", "ws01", "CORP.LOCAL", "Windows 11", False, False)
+    dc_id = source.add_host("10.0.0.1", "dc01", "CORP.LOCAL", "Windows Server 2022", False, True)[0]
+    bob_id = source.add_credential("plaintext", "CORP", "bob", "Password2", pillaged_from=dc_id)
+    alice_id = source.add_credential("plaintext", "corp", "ALICE", "Password1")
+    for user_id in (alice_id, bob_id):
+        source.add_admin_user("plaintext", None, None, None, None, user_id=user_id, host_id=dc_id)
+    source.add_share(dc_id, bob_id, "SYSVOL", "Logon server share", True, False)
+    source.add_check("check", "description")
+    source.add_check_result(dc_id, 1, True, "reasons")
+
+    for _ in range(2):
+        target.merge(tmp_path / "box2.db")
+
+    hosts = {host.ip: host for host in target.get_hosts()}
+    users = {user.username.lower(): user for user in target.get_credentials()}
+    assert len(hosts) == 2
+    assert len(users) == 2
+    # existing rows only get their empty columns filled
+    assert hosts["10.0.0.1"].os == "Windows Server 2022"
+    assert users["alice"].username == "alice"
+    assert users["bob"].pillaged_from_hostid == hosts["10.0.0.1"].id
+    assert {(relation.userid, relation.hostid) for relation in target.get_admin_relations()} == {(users["alice"].id, hosts["10.0.0.1"].id), (users["bob"].id, hosts["10.0.0.1"].id)}
+    assert [(share.hostid, share.userid) for share in target.get_shares()] == [(hosts["10.0.0.1"].id, users["bob"].id)]
+    assert [(result.host_id, result.check_id) for result in target.get_check_results()] == [(hosts["10.0.0.1"].id, target.get_checks()[0].id)]
+
+    for db in databases:
+        db.shutdown_db()
+        db.db_engine.dispose()
+
+
 def test_add_admin_user():
     pass
 
@@ -170,12 +405,41 @@ def test_get_hosts():
     pass
 
 
+def test_iter_hosts(db):
+    for i in range(1, 8):
+        db.add_host(f"10.0.0.{i}", f"host{i}", "CORP.LOCAL" if i % 2 else "LAB.LOCAL", "Windows Server 2019" if i < 5 else "Windows 11", False, i == 1, dc=i == 1)
+
+    pages = list(db.iter_hosts(page_size=3))
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert [host.id for page in pages for host in page] == sorted(host.id for host in db.get_hosts())
+    assert [host.ip for page in db.iter_hosts(domain="corp", os="2019", signing=False) for host in page] == ["10.0.0.3"]
+    assert [host.hostname for page in db.iter_hosts(dc=True) for host in page] == ["host1"]
+    assert list(db.iter_hosts(domain="nothing")) == []
+
+
 def test_is_group_valid():
     pass
 
 
-def test_add_group():
-    pass
+def test_add_group(db, db_engine):
+    group_id = db.add_group("TEST.DEV", "Domain Admins", rid="512")[0]
+
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db_engine, "before_cursor_execute", count)
+    try:
+        assert db.add_group("test.dev", "DOMAIN ADMINS", member_count_ad=3) == [group_id]
+    finally:
+        event.remove(db_engine, "before_cursor_execute", count)
+    assert len(statements) == 1
+
+    group = db.get_groups(group_name="Domain Admins", group_domain="TEST.DEV")[0]
+    assert (group.rid, group.member_count_ad) == ("512", 3)
+    assert group.last_query_time is not None
+    assert db.add_group("TEST.DEV", "Domain Users") != [group_id]
 
 
 def test_get_groups():
@@ -0,0 +1,118 @@
+import asyncio
+import socket
+import threading
+from argparse import Namespace
+from time import monotonic
+
+from nxc.helpers import resolver
+from nxc.helpers.resolver import DNSPrefetch, dns_cache
+from nxc.helpers.sweep import LivenessSweep, sweep_ports
+
+
+class Targets(list):
+    def total(self):
+        return len(self)
+
+
+def listening_port():
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    return server, server.getsockname()[1]
+
+
+def closed_port():
+    probe = socket.socket()
+    probe.bind(("127.0.0.1", 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+
+def test_prefetch_inside_sweep(monkeypatch):
+    resolved = []
+
+    async def fake_addr_info(target, force_ipv6, dns_server, dns_tcp, dns_timeout):
+        resolved.append(target)
+        await asyncio.sleep(0)
+        return {"host": "127.0.0.1", "is_ipv6": False, "is_link_local_ipv6": False}, 60
+
+    monkeypatch.setattr(resolver, "async_addr_info", fake_addr_info)
+    server, port = listening_port()
+    args = Namespace(force_ipv6=False, dns_server="127.0.0.53", dns_tcp=False, dns_timeout=1)
+    try:
+        targets = LivenessSweep(DNSPrefetch(Targets(["localhost", "127.0.0.1"]), args), [port], timeout=2)
+        assert sorted(targets) == ["127.0.0.1", "localhost"]
+    finally:
+        server.close()
+
+    assert resolved == ["localhost"]
+    assert ("localhost", False, "127.0.0.53", False) in dns_cache
+
+
+def test_sweep_drops_dead_hosts():
+    server, port = listening_port()
+    try:
+        sweep = LivenessSweep(Targets(["127.0.0.1"]), [closed_port(), port], timeout=2)
+        assert list(sweep) == ["127.0.0.1"]
+        assert list(LivenessSweep(Targets(["127.0.0.1"]), [closed_port()], timeout=2)) == []
+    finally:
+        server.close()
+
+
+def test_prefetch_from_thread(monkeypatch):
+    async def fake_addr_info(target, force_ipv6, dns_server, dns_tcp, dns_timeout):
+        await asyncio.sleep(0)
+        raise Exception(f"The DNS query name does not exist: {target}")
+
+    monkeypatch.setattr(resolver, "async_addr_info", fake_addr_info)
+    args = Namespace(force_ipv6=False, dns_server="127.0.0.54", dns_tcp=False, dns_timeout=1)
+    assert list(DNSPrefetch(Targets(["missing.local", "10.0.0.1"]), args)) == ["missing.local", "10.0.0.1"]
+    # Failures are cached as negative entries
+    assert ("missing.local", False, "127.0.0.54", False) in dns_cache
+
+
+def test_sweep_ports():
+    assert sweep_ports(Namespace(protocol="smb", port=None)) == [139, 445]
+    assert sweep_ports(Namespace(protocol="smb", port=4455)) == [4455]
+    assert sweep_ports(Namespace(protocol="unknown", port=None)) == []
+
+
+def test_sweep_counts_dead_hosts():
+    targets = Targets(["127.0.0.1", "127.0.0.2", "127.0.0.3"])
+    sweep = LivenessSweep(targets, [closed_port()], timeout=2, concurrency=1)
+    assert list(sweep) == []
+    assert sweep.dead == 3
+    # The progress total shrinks by the hosts that did not respond
+    assert sweep.total() == 0
+
+
+def test_sweep_probes_ports_together():
+    probed = []
+
+    class Sweep(LivenessSweep):
+        async def _connect(self, host, port):
+            probed.append(port)
+            if port == 139:
+                # A filtered port, the sweep must not wait for it
+                await asyncio.sleep(30)
+            return port == 445
+
+    start = monotonic()
+    assert list(Sweep(Targets(["127.0.0.1"]), [139, 445], timeout=30)) == ["127.0.0.1"]
+    assert monotonic() - start < 5
+    assert probed == [139, 445]
+
+
+def test_sweep_stops_with_its_consumer():
+    server, port = listening_port()
+    try:
+        sweep = LivenessSweep(Targets(["127.0.0.1"] * 50), [port], timeout=2, concurrency=1)
+        hosts = iter(sweep)
+        assert next(hosts) == "127.0.0.1"
+        hosts.close()
+        thread = next(thread for thread in threading.enumerate() if thread.name == "nxc-sweep")
+        thread.join(timeout=5)
+        assert not thread.is_alive()
+    finally:
+        server.close()
@@ -0,0 +1,57 @@
+import pytest
+
+from nxc.database import create_db_engine
+from nxc.helpers import ratelimit
+from nxc.helpers.workers import sharding_supported
+from nxc.netexec import Engine
+from nxc.protocols.smb import database as smb_database_module
+from nxc.protocols.smb.database import database as smb_database
+
+pytestmark = pytest.mark.skipif(not sharding_supported(), reason="--workers needs fork()")
+
+NT_HASH = "aad3b435b51404eeaad3b435b51404ee:31d6cfe0d16ae931b73c59d7e0c089c0"
+
+
+class DumpingProtocol:
+    """Stand-in for a protocol class dumping the same hashes from every target, the way --ntds does"""
+
+    module_paths = []
+    module_registry = None
+    adaptive_window = None
+    rate_limiter = None
+    checkpoint = None
+    credential_plan = None
+
+    def __init__(self, args, db, target):
+        host_id = db.add_host(target, "host", "CORP.LOCAL", "Windows", False, False)[0]
+        with db.batched_writes():
+            for username in ("alice", "bob", "alice"):
+                assert db.add_credential("hash", "CORP", username, NT_HASH, pillaged_from=host_id) is None
+        print(f"dumped {target}")
+        if target == "10.0.0.4":
+            self.checkpoint.target_unfinished(target)
+        else:
+            self.checkpoint.target_done(target)
+        assert ratelimit.login_failures.share_of(3) in (1, 2)
+
+
+def test_workers_batch_writes_and_checkpoint_in_parent(tmp_path, monkeypatch):
+    db_engine = create_db_engine(tmp_path / "smb.db")
+    smb_database.db_schema(db_engine)
+    engine = Engine()
+    monkeypatch.setattr(engine, "load_protocol", lambda protocol: (DumpingProtocol, smb_database_module, db_engine))
+    journal = tmp_path / "smb.journal"
+    targets = ["10.0.0.1", "10.0.0.2", "10.0.0.3", "10.0.0.4"]
+    result = engine.run(["smb", *targets, "--no-progress", "-t", "2", "-w", "2", "--resume", str(journal)])
+
+    assert result["returncode"] == 0, result
+    assert sorted(result["stdout"].splitlines()) == [f"dumped {target}" for target in targets]
+    db = smb_database(db_engine)
+    assert sorted(host.ip for host in db.get_hosts()) == targets
+    assert sorted(credential.username for credential in db.get_credentials()) == ["alice", "bob"]
+    db.shutdown_db()
+    # 10.0.0.4 was left unfinished, so the journal is kept and holds the other targets
+    records = journal.read_text().splitlines()[1:]
+    assert sorted(records) == ["D\t10.0.0.1", "D\t10.0.0.2", "D\t10.0.0.3"]
+    engine.close()
+    db_engine.dispose()
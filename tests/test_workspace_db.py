@@ -0,0 +1,39 @@
+from nxc.database import create_db_engine
+from nxc.protocols.ldap.database import database as ldap_database
+from nxc.protocols.smb.database import database as smb_database
+from nxc.workspace_db import WorkspaceDB
+
+
+def protocol_db(tmp_path, name, database):
+    db_engine = create_db_engine(tmp_path / f"{name}.db")
+    database.db_schema(db_engine)
+    return database(db_engine)
+
+
+def test_sync_correlates_protocols(tmp_path):
+    smb = protocol_db(tmp_path, "smb", smb_database)
+    ldap = protocol_db(tmp_path, "ldap", ldap_database)
+    dc_id = smb.add_host("10.0.0.1", "dc01", "CORP.LOCAL", "Windows Server 2022", False, True)[0]
+    smb.add_host("10.0.0.2", "ws01", "CORP.LOCAL", "Windows 11", False, False)
+    alice_id = smb.add_credential("plaintext", "CORP", "alice", "Password1")
+    smb.add_admin_user("plaintext", "CORP", "alice", "Password1", "10.0.0.1", user_id=alice_id, host_id=dc_id)
+    ldap.add_host("10.0.0.1", "DC01", "corp.local", "Windows Server 2022", True, "Never")
+    ldap.add_credential("plaintext", "corp", "ALICE", "Password1")
+    ldap.add_credential("plaintext", "corp", "bob", "Password2")
+
+    db_engine = create_db_engine(tmp_path / "workspace.db")
+    WorkspaceDB.db_schema(db_engine)
+    db = WorkspaceDB(db_engine)
+    for _ in range(2):
+        db.sync("smb", tmp_path / "smb.db")
+        db.sync("ldap", tmp_path / "ldap.db")
+    db.prune()
+
+    assert [(host.ip, host.protocols) for host in db.get_hosts()] == [("10.0.0.1", "ldap,smb"), ("10.0.0.2", "smb")]
+    assert len(db.get_credentials()) == 2
+    assert [(row.username, row.ip, row.protocol) for row in db.get_access(source="ldap", target="smb")] == [("alice", "10.0.0.1", "smb")]
+    assert db.get_access(source="ldap", target="mssql") == []
+
+    for database in (db, smb, ldap):
+        database.shutdown_db()
+        database.db_engine.dispose()